@@ -1,18 +1,73 @@
 import os
-from fastapi import FastAPI, HTTPException, File, UploadFile
+import time
+import uuid
+import hashlib
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal, Optional
 from pathlib import Path
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 # from dotenv import load_dotenv
 
-from helper_functions import convert_pdf_to_images, extract_images_and_names_from_zip, create_hash_folder
-from qdrant_models import index_images_to_qdrant, search_qdrant, create_qdrant_collection, list_qdrant_collections, delete_qdrant_collection
+from helper_functions import create_hash_folder, save_multipart_upload, UploadTooLargeError
+from qdrant_models import search_qdrant_async, search_collections_async, search_qdrant_batch_async, build_payload_filter, SearchRequestError, create_async_qdrant_client, create_qdrant_client, create_payload_indexes, create_qdrant_collection, list_qdrant_collections, delete_qdrant_collection, document_pages, delete_document
+from colpali_models import get_colpali_client
+from query_cache import QueryEmbeddingCache
+from ingestion_jobs import IngestionJobManager, SUPPORTED_EXTENSIONS, PENDING_STATUSES
 
 # load_dotenv()
 QDRANT_URI = os.getenv("QDRANT_URI")
-COLPALI_URI = os.getenv("COLPALI_URI")
+COLPALI_URI = os.getenv("COLPALI_URI") # one /embed URL or a comma-separated list of replicas
 QDRANT_COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME")
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
+
+# ingestion pipeline tuning: batch size and per-stage concurrency
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", 10))
+INDEX_LOAD_WORKERS = int(os.getenv("INDEX_LOAD_WORKERS", 2))
+INDEX_EMBED_WORKERS = int(os.getenv("INDEX_EMBED_WORKERS", 2))
+INDEX_UPSERT_WORKERS = int(os.getenv("INDEX_UPSERT_WORKERS", 2)) # upsert requests in flight
+INDEX_UPSERT_BATCH_MB = float(os.getenv("INDEX_UPSERT_BATCH_MB", 8)) # initial upsert request size
+
+# resolution pages are downscaled to before embedding: "auto" (ask the ColPali server),
+# "WIDTHxHEIGHT", or "full" to send the original files
+COLPALI_IMAGE_SIZE = os.getenv("COLPALI_IMAGE_SIZE", "auto")
+if COLPALI_IMAGE_SIZE == "full":
+    MODEL_IMAGE_SIZE = None
+elif COLPALI_IMAGE_SIZE == "auto":
+    MODEL_IMAGE_SIZE = "auto"
+else:
+    MODEL_IMAGE_SIZE = tuple(int(x) for x in COLPALI_IMAGE_SIZE.lower().split("x"))
+
+# two-stage search on pooled collections: candidates fetched per pooled vector = top_k * oversampling
+SEARCH_PREFETCH_OVERSAMPLING = int(os.getenv("SEARCH_PREFETCH_OVERSAMPLING", 100))
+
+# default search mode: "dense" (ColPali), "sparse" (page text), "hybrid" (both, fused by rank)
+# or "sparse_prefilter" (text matches reranked by ColPali); requests can override it
+SEARCH_MODE = os.getenv("SEARCH_MODE", "dense")
+
+# fan-out search: named groups of collections (or aliases) searched together,
+# e.g. "textbooks=pub_a,pub_b;journals=journals_2023,journals_2024", and the time
+# each collection gets before it is left out of the merged results
+SEARCH_COLLECTION_GROUPS = {
+    name.strip(): [collection.strip() for collection in collections.split(",") if collection.strip()]
+    for name, _, collections in (
+        group.partition("=") for group in os.getenv("SEARCH_COLLECTION_GROUPS", "").split(";") if group.strip()
+    )
+}
+SEARCH_COLLECTION_TIMEOUT = float(os.getenv("SEARCH_COLLECTION_TIMEOUT", 5))
+MAX_SEARCH_COLLECTIONS = int(os.getenv("MAX_SEARCH_COLLECTIONS", 32))
+
+# query embedding cache: in-memory size bound and TTL, plus an optional SQLite file
+# shared by all backend workers (leave QUERY_CACHE_PATH empty for memory only)
+QUERY_CACHE_MAX_MB = float(os.getenv("QUERY_CACHE_MAX_MB", 64))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 3600))
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "")
+
+# upper bound on the number of questions in one /document_retrieval_batch request
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", 256))
 
 # directory to save input files
 BASE_UPLOAD_DIRECTORY = os.getenv('BASE_UPLOAD_DIR', '') # update this base directory
@@ -20,19 +75,113 @@ BASE_UPLOAD_DIRECTORY = os.getenv('BASE_UPLOAD_DIR', '') # update this base dire
 # creating base directory if it does not exists
 Path(BASE_UPLOAD_DIRECTORY).mkdir(parents=True, exist_ok=True)
 
+# uploads are streamed here and moved into their content-hash folder once complete
+INCOMING_UPLOAD_DIRECTORY = Path(BASE_UPLOAD_DIRECTORY) / ".incoming"
+INCOMING_UPLOAD_DIRECTORY.mkdir(exist_ok=True)
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", 2048)) * 1024 * 1024)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+# partial uploads untouched for this long are left over from a crash; newer ones may still
+# be streaming into another backend worker
+STALE_UPLOAD_SECONDS = float(os.getenv("STALE_UPLOAD_MINUTES", 60)) * 60
+
+# number of documents ingested concurrently in the background
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", 1))
+
+job_manager = IngestionJobManager(
+    index_kwargs={
+        "batch_size": INDEX_BATCH_SIZE,
+        "collection_name": QDRANT_COLLECTION_NAME,
+        "qdrant_uri": QDRANT_URI,
+        "colpali_url": COLPALI_URI,
+        "load_workers": INDEX_LOAD_WORKERS,
+        "embed_workers": INDEX_EMBED_WORKERS,
+        "upsert_workers": INDEX_UPSERT_WORKERS,
+        "upsert_batch_bytes": int(INDEX_UPSERT_BATCH_MB * 1024 * 1024),
+        "model_image_size": MODEL_IMAGE_SIZE,
+    },
+    workers=INGEST_JOB_WORKERS,
+    base_directory=BASE_UPLOAD_DIRECTORY,
+)
+
+# payload index types accepted by Qdrant
+PayloadFieldType = Literal["keyword", "integer", "float", "bool", "text", "datetime"]
+
+SearchMode = Literal["dense", "sparse", "hybrid", "sparse_prefilter"]
+
 class ImageRetrievalRequest(BaseModel):
     user_query: str
+    top_k: int = Field(3, ge=1, le=100)
+    # payload filters, e.g. {"ISBN": "9780134093413", "page_number": {"gte": 10, "lte": 40}}
+    filters: Optional[Dict[str, Any]] = None
+    mode: Optional[SearchMode] = None
+    # search these collections/aliases, or a configured group, instead of QDRANT_COLLECTION_NAME
+    collections: Optional[List[str]] = None
+    collection_group: Optional[str] = None
+
+class BatchRetrievalQuery(BaseModel):
+    user_query: str
+    top_k: int = Field(3, ge=1, le=100)
+    filters: Optional[Dict[str, Any]] = None
+    mode: Optional[SearchMode] = None
+
+class BatchRetrievalRequest(BaseModel):
+    queries: List[BatchRetrievalQuery]
 
 class QdrantCollectionCreate(BaseModel):
     collection_name: str
     vector_size: int
     indexing_threshold: int
+    pooled_vectors: bool = True
+    pool_factor: int = 1
+    # quantization profile; on_disk memory-maps the original vectors instead of holding them in RAM
+    quantization: Literal["none", "scalar", "binary", "product"] = "scalar"
+    on_disk: bool = False
+    oversampling: Optional[float] = None
+    rescore: bool = True
+    # indexed in addition to ISBN, page_number and subject
+    payload_indexes: Dict[str, PayloadFieldType] = {}
+    # sparse vector of the page text for sparse/hybrid search
+    text_index: bool = True
+
+class PayloadIndexCreate(BaseModel):
+    collection_name: str
+    payload_indexes: Dict[str, PayloadFieldType]
 
 # class QdrantCollectionDelete(BaseModel):
 #     collection_name: str
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # pooled clients shared by all search requests for the lifetime of the app
+    app.state.qdrant_client = create_async_qdrant_client(QDRANT_URI, prefer_grpc=QDRANT_PREFER_GRPC, grpc_port=QDRANT_GRPC_PORT)
+    if COLPALI_URI:
+        app.state.colpali_client = get_colpali_client(COLPALI_URI)
+    else:
+        # still serves sparse search and document management; the rest answers 503
+        print("Warning: COLPALI_URI is not set, embedding and dense search are unavailable")
+        app.state.colpali_client = None
+    app.state.query_cache = QueryEmbeddingCache(
+        max_bytes=int(QUERY_CACHE_MAX_MB * 1024 * 1024),
+        ttl_seconds=QUERY_CACHE_TTL,
+        disk_path=QUERY_CACHE_PATH or None,
+    )
+
+    # drop partial uploads left by a crash, then pick up interrupted ingestion jobs
+    stale_before = time.time() - STALE_UPLOAD_SECONDS
+    for partial_upload in INCOMING_UPLOAD_DIRECTORY.glob("*.part"):
+        try:
+            if partial_upload.stat().st_mtime < stale_before:
+                partial_upload.unlink()
+        except FileNotFoundError:
+            pass  # finished or removed by another worker meanwhile
+    if COLPALI_URI:
+        job_manager.resume_pending(BASE_UPLOAD_DIRECTORY)
+    yield
+
+    await app.state.qdrant_client.close()
+
 # Initialize the FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -44,9 +193,22 @@ app.add_middleware(
 )
 
 # Endpoint to create collection in qdrant
+# (plain def: the blocking Qdrant call runs in FastAPI's threadpool, off the event loop)
 @app.post("/create_qdrant_collection")
-async def qdrant_create_collection(request: QdrantCollectionCreate):
-    return create_qdrant_collection(QDRANT_URI, request.collection_name, request.vector_size, request.indexing_threshold)
+def qdrant_create_collection(request: QdrantCollectionCreate):
+    return create_qdrant_collection(QDRANT_URI, request.collection_name, request.vector_size, request.indexing_threshold,
+                                    request.pooled_vectors, request.pool_factor, request.quantization,
+                                    request.on_disk, request.oversampling, request.rescore, request.payload_indexes,
+                                    request.text_index)
+
+# Endpoint to index more payload fields of an existing collection
+@app.post("/create_payload_indexes")
+def qdrant_create_payload_indexes(request: PayloadIndexCreate):
+    try:
+        create_payload_indexes(create_qdrant_client(QDRANT_URI), request.collection_name, request.payload_indexes)
+        return True
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating payload indexes: {str(e)}")
 
 # Endpoint to delete collection in qdrant
 # @app.post("/delete_qdrant_collection")
@@ -55,54 +217,84 @@ async def qdrant_create_collection(request: QdrantCollectionCreate):
 
 # Endpoint to delete collection in qdrant
 @app.post("/get_qdrant_collections")
-async def qdrant_list_collections():
+def qdrant_list_collections():
     return list_qdrant_collections(QDRANT_URI)
 
 
 # ENDPOINT TO INDEX THE IMAGES TO QDRANT
-@app.post("/document_embed")
-async def embed_index_documents(file: UploadFile = File(...)):
+# The upload is saved and queued as an ingestion job; poll /document_embed/{job_id} for progress.
+# The multipart body is streamed to disk as it arrives and hashed on the way (the form is
+# not parsed by FastAPI, which would spool the whole file first); the job id is derived from
+# the content hash and the document id, so uploading the same document again returns the
+# existing job (and, for a registered document, registers its pages again).
+# Form fields: file, isbn, subject and document_id (all but file optional).
+UPLOAD_FORM_SCHEMA = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object",
+    "required": ["file"],
+    "properties": {
+        "file": {"type": "string", "format": "binary"},
+        "isbn": {"type": "string"},
+        "subject": {"type": "string"},
+        "document_id": {"type": "string"},
+    },
+}}}}}
+
+
+@app.post("/document_embed", openapi_extra=UPLOAD_FORM_SCHEMA)
+async def embed_index_documents(http_request: Request):
+    if not COLPALI_URI:
+        raise HTTPException(status_code=503, detail="No ColPali embedding server configured (COLPALI_URI)")
+    if int(http_request.headers.get("content-length") or 0) > MAX_UPLOAD_BYTES + 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the limit of {MAX_UPLOAD_BYTES} bytes")
+
+    partial_upload = INCOMING_UPLOAD_DIRECTORY / f"{uuid.uuid4().hex}.part"
     try:
-        # Create a unique hash-based folder
-        hash_folder, images_folder = create_hash_folder(BASE_UPLOAD_DIRECTORY)
+        try:
+            fields, filename, content_hash, size_bytes = await save_multipart_upload(
+                http_request, partial_upload, extensions=SUPPORTED_EXTENSIONS,
+                max_bytes=MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_SIZE,
+            )
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        isbn, subject, document_id = (fields.get(key) or None for key in ("isbn", "subject", "document_id"))
+
+        # a registered document (by default ISBN + file name, so the parts of a book are
+        # separate documents) only embeds changed pages of a new upload and removes the
+        # pages the new version no longer has
+        if not document_id and isbn:
+            document_id = f"{isbn}/{filename}"
+        job_id = content_hash[:32]
+        if document_id:
+            job_id = hashlib.sha256(f"{content_hash}|{document_id}".encode()).hexdigest()[:32]
+        existing_job = job_manager.get(job_id)
+        if existing_job is not None:
+            partial_upload.unlink(missing_ok=True)
+            print(f"{filename} was already uploaded as ingestion job {job_id}")
+            if document_id and existing_job["status"] not in PENDING_STATUSES:
+                # the document may have moved on to another version or been deleted since:
+                # run the job again so this version's pages are registered (and indexed) again
+                job_manager.resume(job_id)
+                return {"status": "Document already uploaded, re-registering", "job_id": job_id}
+            return {"status": "Document already uploaded", "job_id": job_id}
+
+        # Create the content-hash folder and move the upload into it
+        hash_folder, images_folder = create_hash_folder(BASE_UPLOAD_DIRECTORY, job_id)
         hash_folder = Path(hash_folder)
-        images_folder = Path(images_folder)
-        filename = file.filename
-
-        # Save the uploaded file in the hash folder
-        file_location = hash_folder / filename
-        with open(file_location, "wb") as f:
-            content = await file.read()
-            f.write(content)
-
-        if filename.endswith(".pdf"):
-            images = convert_pdf_to_images(str(file_location))
-            pdf_filename = filename.rsplit(".", 1)[0]
-            for idx, image in enumerate(images):
-                image_path = images_folder / f"{pdf_filename}_page_{idx + 1}.png"
-                image.save(str(image_path))
-        
-        elif filename.endswith(".zip"):
-            images, image_names = extract_images_and_names_from_zip(str(file_location))
-            for image, name in zip(images, image_names):
-                image_path = images_folder / name
-                image.save(str(image_path))
-        
-        elif filename.endswith(('.png', '.jpg', '.jpeg')):
-            image_path = images_folder / filename
-            with open(image_path, "wb") as f:
-                f.write(content)
-        
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type")
-        
-        image_files = [str(images_folder / img) for img in os.listdir(str(images_folder))]
-        print("Input file processed. Calling Embedding function Now!")
-        print("Number of images:{}".format(len(image_files)))
-        index_images_to_qdrant(image_files, batch_size=10, collection_name=QDRANT_COLLECTION_NAME, qdrant_uri=QDRANT_URI, colpali_url=COLPALI_URI)
-        return {"status": "Document embedded successfully"}
-    
+        os.replace(partial_upload, hash_folder / filename)
+
+        # attached to every page's payload, so searches can filter on them
+        metadata = {key: value for key, value in {"ISBN": isbn, "subject": subject}.items() if value}
+        job = job_manager.submit(hash_folder, filename, metadata=metadata, content_hash=content_hash, size_bytes=size_bytes,
+                                 document_id=document_id)
+        print(f"Ingestion job {job['job_id']} queued for {filename}")
+        return {"status": "Document queued for embedding", "job_id": job["job_id"]}
+
+    except HTTPException:
+        raise
     except Exception as e:
+        partial_upload.unlink(missing_ok=True)
         raise HTTPException(status_code=500, detail=f"Error embedding documents: {str(e)}")
     
     # finally:
@@ -110,37 +302,177 @@ async def embed_index_documents(file: UploadFile = File(...)):
     #         shutil.rmtree(hash_folder)
 
 
+# ENDPOINT TO GET THE STATUS AND PROGRESS OF AN INGESTION JOB
+@app.get("/document_embed/{job_id}")
+async def get_embed_job_status(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job
+
+# ENDPOINT TO RETRY A FINISHED INGESTION JOB (failed batches are re-run, indexed pages skipped)
+@app.post("/document_embed/{job_id}/resume")
+async def resume_embed_job(job_id: str):
+    if not COLPALI_URI:
+        raise HTTPException(status_code=503, detail="No ColPali embedding server configured (COLPALI_URI)")
+    job = job_manager.resume(job_id)
+    if job is None:
+        raise HTTPException(status_code=409, detail="Ingestion job not found or still running")
+    return job
+
+
+# ENDPOINT TO LIST THE INDEXED PAGES OF A DOCUMENT
+@app.get("/documents/{document_id:path}")
+def get_document_pages(document_id: str, collection_name: Optional[str] = None):
+    try:
+        pages = document_pages(create_qdrant_client(QDRANT_URI), collection_name or QDRANT_COLLECTION_NAME, document_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading document pages: {str(e)}")
+    if not pages:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"document_id": document_id, "pages": pages}
+
+# ENDPOINT TO DELETE ALL PAGES OF A DOCUMENT
+@app.delete("/documents/{document_id:path}")
+def delete_document_pages(document_id: str, collection_name: Optional[str] = None):
+    try:
+        deleted = delete_document(QDRANT_URI, collection_name or QDRANT_COLLECTION_NAME, document_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"document_id": document_id, "pages_deleted": deleted}
+
+
+def points_with_scores(points):
+    retrieved_points_with_scores = []
+    for point in points:
+        point_with_score = point.payload.copy()
+        point_with_score['score'] = point.score
+        retrieved_points_with_scores.append(point_with_score)
+    return retrieved_points_with_scores
+
+def colpali_client_for(http_request: Request, modes):
+    # sparse searches embed no query, so they work without an embedding server
+    colpali_client = http_request.app.state.colpali_client
+    if colpali_client is None and any(mode != "sparse" for mode in modes):
+        raise HTTPException(status_code=503, detail="No ColPali embedding server configured (COLPALI_URI)")
+    return colpali_client
+
+def search_collection_names(request: ImageRetrievalRequest):
+    collection_names = list(request.collections or [])
+    if request.collection_group:
+        if request.collection_group not in SEARCH_COLLECTION_GROUPS:
+            raise HTTPException(status_code=400, detail=f"Unknown collection group: {request.collection_group}")
+        collection_names += SEARCH_COLLECTION_GROUPS[request.collection_group]
+    # keep the order, drop repeats
+    collection_names = list(dict.fromkeys(collection_names))
+    if len(collection_names) > MAX_SEARCH_COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SEARCH_COLLECTIONS} collections per search")
+    return collection_names or [QDRANT_COLLECTION_NAME]
+
 # ENDPOINT TO RETRIEVE TOP K RELEVANT TEXTBOOK PAGE IMAGES
 @app.post("/document_retrieval")
-async def get_relevant_documents(request: ImageRetrievalRequest):
+async def get_relevant_documents(request: ImageRetrievalRequest, http_request: Request):
+    try:
+        query_filter = build_payload_filter(request.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {str(e)}")
+    collection_names = search_collection_names(request)
+    mode = request.mode or SEARCH_MODE
+    colpali_client = colpali_client_for(http_request, [mode])
+
     try:
-        search_result = search_qdrant(QDRANT_COLLECTION_NAME, request.user_query, qdrant_uri=QDRANT_URI, colpali_url=COLPALI_URI, top_k=3)
+        search_kwargs = {
+            "qdrant_client": http_request.app.state.qdrant_client,
+            "colpali_client": colpali_client,
+            "top_k": request.top_k,
+            "query_cache": http_request.app.state.query_cache,
+            "prefetch_oversampling": SEARCH_PREFETCH_OVERSAMPLING,
+            "query_filter": query_filter,
+            "mode": mode,
+        }
+        collection_statuses = None
+        if len(collection_names) == 1:
+            search_result = await search_qdrant_async(collection_names[0], request.user_query, **search_kwargs)
+        else:
+            # one query embedding, all collections searched concurrently, merged by score
+            search_result, collection_statuses = await search_collections_async(
+                collection_names, request.user_query, timeout=SEARCH_COLLECTION_TIMEOUT, **search_kwargs
+            )
     
         if not search_result.points:
             raise HTTPException(status_code=404, detail="No matching images found")
-        
-        scores = [r.score for r in search_result.points]
-        
-        image_points = [r.payload for r in search_result.points]
-
-        retrieved_points_with_scores = []
-        for point, score in zip(image_points, scores):
-            point_with_score = point.copy()
-            point_with_score['score'] = score
-            retrieved_points_with_scores.append(point_with_score)
 
         response = {
-            "retrieved_image_points": retrieved_points_with_scores
+            "retrieved_image_points": points_with_scores(search_result.points)
         }
+        if collection_statuses is not None:
+            response["collections"] = collection_statuses
         print("Relevant images retreived")
 
         return response
 
         # return FileResponse(row_image_paths[0])
 
+    except HTTPException:
+        raise
+    except SearchRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during text embedding: {str(e)}")
 
+# ENDPOINT TO RETRIEVE PAGES FOR MANY QUESTIONS AT ONCE
+# (one ColPali call for all query embeddings, one Qdrant batch query)
+@app.post("/document_retrieval_batch")
+async def get_relevant_documents_batch(request: BatchRetrievalRequest, http_request: Request):
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="At least one query is required")
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per request")
+
+    try:
+        queries = [
+            {
+                "user_query": query.user_query,
+                "top_k": query.top_k,
+                "query_filter": build_payload_filter(query.filters),
+                "mode": query.mode or SEARCH_MODE,
+            }
+            for query in request.queries
+        ]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {str(e)}")
+    colpali_client = colpali_client_for(http_request, [query["mode"] for query in queries])
+
+    try:
+        search_results = await search_qdrant_batch_async(
+            QDRANT_COLLECTION_NAME,
+            queries,
+            qdrant_client=http_request.app.state.qdrant_client,
+            colpali_client=colpali_client,
+            query_cache=http_request.app.state.query_cache,
+            prefetch_oversampling=SEARCH_PREFETCH_OVERSAMPLING,
+        )
+
+        # queries without matches get an empty list rather than failing the whole batch
+        results = [
+            {"user_query": query.user_query, "retrieved_image_points": points_with_scores(search_result.points)}
+            for query, search_result in zip(request.queries, search_results)
+        ]
+        print(f"Relevant images retreived for {len(results)} queries")
+        return {"results": results}
+
+    except SearchRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error during batch retrieval: {str(e)}")
+
+# ENDPOINT TO INSPECT THE QUERY EMBEDDING CACHE
+@app.get("/query_cache_stats")
+async def query_cache_stats(http_request: Request):
+    return http_request.app.state.query_cache.stats()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
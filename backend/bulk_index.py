@@ -0,0 +1,313 @@
+"""Offline bulk indexer for whole corpora.
+
+Walks a directory tree (or reads a CSV manifest of ISBN, file and page range),
+rasterizes PDFs in a process pool and indexes the pages with index_images_to_qdrant,
+filling the ISBN and page_number payload fields used by search_qdrant.
+
+    python bulk_index.py --input-dir /data/books --output-dir /data/pages \
+        --colpali-url http://gpu1:8000/embed --colpali-url http://gpu2:8000/embed
+
+Directory layout: every PDF is one book whose file name is the ISBN; images inside a
+folder form one book whose folder name is the ISBN, with the page number taken from
+the trailing digits of the file name.
+
+Manifest: a CSV with the header isbn,file,first_page,last_page (page range optional).
+"""
+import os
+import re
+import csv
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from helper_functions import get_pdf_page_count, render_pdf_pages
+from qdrant_models import index_images_to_qdrant
+from text_index import extract_pdf_page_texts
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def page_key(page):
+    # resume key of a planned (isbn, file, page number): PDF pages by ISBN and page, images
+    # by their file, as an image need not carry a page number
+    isbn, file_path, page_number = page
+    if file_path.lower().endswith(".pdf"):
+        return f"{isbn}:{page_number}"
+    return file_path
+
+
+def image_page_number(image_path, default):
+    match = re.search(r"(\d+)$", Path(image_path).stem)
+    return int(match.group(1)) if match else default
+
+
+def walk_documents(input_dir):
+    """Yield documents found under `input_dir` as dicts with isbn, file, first_page, last_page."""
+    input_dir = Path(input_dir)
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        images = []
+        for name in sorted(files):
+            path = Path(root) / name
+            if name.lower().endswith(".pdf"):
+                yield {"isbn": path.stem, "file": str(path), "first_page": None, "last_page": None}
+            elif name.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(path)
+
+        isbn = Path(root).name
+        for idx, path in enumerate(images):
+            page_number = image_page_number(path, idx + 1)
+            yield {"isbn": isbn, "file": str(path), "first_page": page_number, "last_page": page_number}
+
+
+def read_manifest(manifest_path):
+    with open(manifest_path, newline="") as f:
+        for row in csv.DictReader(f):
+            file_path = row["file"].strip()
+            first_page = int(row["first_page"]) if row.get("first_page") else None
+            if first_page is None and file_path.lower().endswith(IMAGE_EXTENSIONS):
+                # an image row without a page takes it from the file name, like walk_documents
+                first_page = image_page_number(file_path, None)
+            last_page = int(row["last_page"]) if row.get("last_page") else first_page
+            yield {"isbn": row["isbn"].strip(), "file": file_path, "first_page": first_page, "last_page": last_page}
+
+
+def plan_pages(documents, executor, done_keys):
+    """Resolve page ranges and return (render tasks, total pages, already done pages).
+
+    PDF page counts are read in the process pool. Each task is one PDF page chunk or one
+    image; pages in `done_keys` are left out.
+    """
+    documents = list(documents)
+    pdfs = [doc for doc in documents if doc["file"].lower().endswith(".pdf") and doc["last_page"] is None]
+    page_counts = dict(zip((doc["file"] for doc in pdfs), executor.map(get_pdf_page_count, [doc["file"] for doc in pdfs])))
+
+    pages = []
+    for doc in documents:
+        if doc["file"].lower().endswith(".pdf"):
+            first_page = doc["first_page"] or 1
+            last_page = doc["last_page"] or page_counts[doc["file"]]
+            pages.extend((doc["isbn"], doc["file"], page_number) for page_number in range(first_page, last_page + 1))
+        else:
+            pages.append((doc["isbn"], doc["file"], doc["first_page"]))
+
+    pending = [page for page in pages if page_key(page) not in done_keys]
+    return pending, len(pages), len(pages) - len(pending)
+
+
+def chunk_pages(pages, chunk_size):
+    # consecutive pages of the same file go to one worker call
+    chunk = []
+    for page in pages:
+        if chunk and (page[1] != chunk[-1][1] or len(chunk) >= chunk_size):
+            yield chunk
+            chunk = []
+        chunk.append(page)
+    if chunk:
+        yield chunk
+
+
+def render_pages(pages, output_dir, dpi):
+    """Process-pool worker: rasterize PDF pages to PNG and read their text layer for the
+    sparse text index. A chunk holds consecutive pages of one PDF."""
+    results = []
+    page_texts = {}
+    try:
+        page_texts = extract_pdf_page_texts(pages[0][1], pages[0][2], pages[-1][2])
+    except Exception as e:
+        print(f"Could not extract text from {pages[0][1]}: {e}")
+
+    isbn, file_path = pages[0][0], pages[0][1]
+    image_folder = Path(output_dir) / isbn
+    image_folder.mkdir(parents=True, exist_ok=True)
+    image_paths = {page_number: image_folder / f"{isbn}_page_{page_number}.png" for _, _, page_number in pages}
+    # pages rendered before an interruption are reused; the rest come from one open document
+    missing = [page_number for page_number, image_path in image_paths.items() if not image_path.exists()]
+    if missing:
+        for page_number, image in render_pdf_pages(file_path, missing, dpi=dpi):
+            tmp_path = image_paths[page_number].with_suffix(".tmp.png")
+            image.save(str(tmp_path))
+            image.close()
+            os.replace(tmp_path, image_paths[page_number])
+    for _, _, page_number in pages:
+        results.append((str(image_paths[page_number]), isbn, page_number, page_texts.get(page_number)))
+    return results
+
+
+def iter_rendered_pages(chunks, executor, output_dir, dpi, window, page_info, page_keys, page_texts, failures):
+    """Yield rendered page paths in order, keeping at most `window` chunks in flight.
+
+    page_info gets each path's payload, page_keys its resume key (see page_key).
+    """
+    pending = deque()
+
+    def drain_one():
+        chunk, future = pending.popleft()
+        try:
+            # image rows pass through as-is, with no text layer
+            rendered = future.result() if future is not None else [
+                (file_path, isbn, page_number, None) for isbn, file_path, page_number in chunk
+            ]
+        except Exception as e:
+            print(f"Error rendering {chunk[0][1]} pages {chunk[0][2]}-{chunk[-1][2]}: {e}")
+            failures.append({"stage": "render", "pages": [page_key(page) for page in chunk], "error": str(e)})
+            return
+        for page, (image_path, isbn, page_number, text) in zip(chunk, rendered):
+            page_info[image_path] = {"ISBN": isbn, "page_number": page_number}
+            page_keys[image_path] = page_key(page)
+            if text:
+                page_texts[image_path] = text
+            yield image_path
+
+    for chunk in chunks:
+        # only PDFs need the process pool; images stay in line, so the output order holds
+        is_pdf = chunk[0][1].lower().endswith(".pdf")
+        pending.append((chunk, executor.submit(render_pages, chunk, output_dir, dpi) if is_pdf else None))
+        if len(pending) >= window:
+            yield from drain_one()
+    while pending:
+        yield from drain_one()
+
+
+class SharedIterator:
+    """Thread-safe iterator so several indexing pipelines can pull from one page stream."""
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            return next(self.iterator)
+
+
+def load_done_keys(state_file):
+    done = set()
+    if state_file and Path(state_file).exists():
+        with open(state_file) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    done.update(json.loads(line))
+    return done
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk index a corpus of textbooks into Qdrant")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-dir", help="directory tree of PDFs and/or page image folders")
+    source.add_argument("--manifest", help="CSV manifest with isbn,file,first_page,last_page")
+    parser.add_argument("--output-dir", required=True, help="where rasterized pages are written (kept for display)")
+    parser.add_argument("--collection", default=os.getenv("QDRANT_COLLECTION_NAME"))
+    parser.add_argument("--qdrant-uri", default=os.getenv("QDRANT_URI"))
+    parser.add_argument("--colpali-url", action="append", help="ColPali /embed endpoint; repeat to use several replicas")
+    parser.add_argument("--render-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--render-chunk", type=int, default=8, help="PDF pages per render task")
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--embed-workers", type=int, default=2, help="concurrent embedding calls per ColPali endpoint")
+    parser.add_argument("--upsert-workers", type=int, default=2, help="upsert requests in flight")
+    parser.add_argument("--upsert-batch-mb", type=float, default=8, help="initial size of an upsert request; adapted to latency")
+    parser.add_argument("--state-file", help="JSONL of indexed pages; pages listed there are skipped on the next run")
+    parser.add_argument("--report", help="write the final throughput report to this JSON file")
+    parser.add_argument("--dry-run", action="store_true", help="only resolve documents and page counts")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    colpali_urls = args.colpali_url or [os.getenv("COLPALI_URI")]
+    documents = walk_documents(args.input_dir) if args.input_dir else read_manifest(args.manifest)
+    done_keys = load_done_keys(args.state_file)
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.render_workers) as executor:
+        pages, total_pages, already_done = plan_pages(documents, executor, done_keys)
+        books = len({page[0] for page in pages})
+        print(f"{total_pages} pages planned, {already_done} already indexed, {len(pages)} to index across {books} books")
+
+        if args.dry_run:
+            return
+
+        page_info = {}
+        page_keys = {}
+        page_texts = {}
+        failures = []
+        state_lock = threading.Lock()
+
+        def keys_of(paths):
+            return [page_keys[path] for path in paths]
+
+        def on_batch_done(paths):
+            if not args.state_file:
+                return
+            keys = keys_of(paths)
+            with state_lock:
+                with open(args.state_file, "a") as f:
+                    f.write(json.dumps(keys) + "\n")
+
+        def on_batch_failed(stage_name, paths, error):
+            with state_lock:
+                failures.append({"stage": stage_name, "pages": keys_of(paths), "error": str(error)})
+
+        page_stream = SharedIterator(iter_rendered_pages(
+            chunk_pages(pages, args.render_chunk), executor, args.output_dir, args.dpi,
+            window=2 * args.render_workers, page_info=page_info, page_keys=page_keys, page_texts=page_texts,
+            failures=failures,
+        ))
+
+        def run_endpoint(colpali_url):
+            return index_images_to_qdrant(
+                page_stream,
+                batch_size=args.batch_size,
+                collection_name=args.collection,
+                qdrant_uri=args.qdrant_uri,
+                colpali_url=colpali_url,
+                total=len(pages),
+                embed_workers=args.embed_workers,
+                upsert_workers=args.upsert_workers,
+                upsert_batch_bytes=int(args.upsert_batch_mb * 1024 * 1024),
+                progress_callback=on_batch_done,
+                error_callback=on_batch_failed,
+                payload_fn=page_info.get,
+                # texts are only needed until the page is loaded
+                text_fn=lambda path: page_texts.pop(path, None),
+            )
+
+        # one pipeline per ColPali endpoint, all pulling from the same page stream
+        with ThreadPoolExecutor(max_workers=len(colpali_urls)) as endpoint_executor:
+            endpoint_stats = dict(zip(colpali_urls, endpoint_executor.map(run_endpoint, colpali_urls)))
+
+    elapsed = time.perf_counter() - started
+    indexed = sum(stats["points"] for stats in endpoint_stats.values())
+    skipped = sum(stats["skipped_duplicates"] for stats in endpoint_stats.values())
+    report = {
+        "pages_planned": total_pages,
+        "pages_already_done": already_done,
+        "pages_indexed": indexed,
+        "pages_skipped_duplicates": skipped,
+        "pages_failed": sum(len(failure["pages"]) for failure in failures),
+        "elapsed_seconds": round(elapsed, 1),
+        "pages_per_second": round(indexed / elapsed, 2) if elapsed > 0 else 0.0,
+        "endpoints": endpoint_stats,
+        "failures": failures,
+    }
+
+    print(f"Indexed {indexed} pages in {report['elapsed_seconds']}s ({report['pages_per_second']} pages/s), "
+          f"{skipped} duplicates skipped, {report['pages_failed']} failed")
+    for colpali_url, stats in endpoint_stats.items():
+        print(f"  {colpali_url}: {stats['points']} pages, embed {stats['embed']['units_per_second']}/s")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,297 @@
+import os
 import json
 import base64
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
 from typing import List, Optional, Dict, Union
 import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
 from PIL import Image
 import io
 
-class ColPaliClient:
-    def __init__(self, endpoint_url: str):
+# binary response mode of the ColPali /embed server: concatenated .npy arrays
+NPY_MEDIA_TYPE = "application/x-npy"
+
+# gateway errors that mean the replica itself is unavailable, so the request is retried elsewhere
+REPLICA_FAILURE_STATUSES = (502, 503, 504)
+
+# defaults for the shared clients returned by get_colpali_client
+COLPALI_CONNECT_TIMEOUT = float(os.getenv("COLPALI_CONNECT_TIMEOUT", 5))
+COLPALI_READ_TIMEOUT = float(os.getenv("COLPALI_READ_TIMEOUT", 120))
+COLPALI_HEDGE_DELAY = float(os.getenv("COLPALI_HEDGE_DELAY")) if os.getenv("COLPALI_HEDGE_DELAY") else None
+
+_colpali_clients = {}
+_colpali_clients_lock = threading.Lock()
+
+def decode_npy_response(response) -> Dict:
+    names = [name for name in response.headers.get("X-Embedding-Arrays", "").split(",") if name]
+    buffer = io.BytesIO(response.content)
+    return {name: np.load(buffer, allow_pickle=False) for name in names}
+
+class ColPaliReplica:
+    """One ColPali server: a pooled keep-alive session plus load and health tracking."""
+    def __init__(self, endpoint_url: str, pool_size: int = 8):
         self.endpoint_url = endpoint_url
+        self.base_url = endpoint_url.rstrip("/").rsplit("/", 1)[0]
+        # multipart raw-bytes endpoint, served next to /embed
+        self.images_endpoint_url = self.base_url + "/embed_images"
+        self.processor_config_url = self.base_url + "/processor_config"
+        self.health_url = self.base_url + "/health"
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.in_flight = 0
+        self.healthy = True
+        self.retry_at = 0.0
+        self.latency = None  # moving average of request seconds
+
+class ColPaliClient:
+    def __init__(self, endpoint_url: Union[str, List[str]], response_format: str = "npy", dtype: str = "float16",
+                 timeout=(5, 120), hedge_delay: Optional[float] = None, pool_size: int = 8,
+                 health_check_interval: float = 10.0):
+        # endpoint_url may be one /embed URL, a comma-separated string or a list of replicas;
+        # requests go to the healthy replica with the fewest requests in flight.
+        # response_format "npy" asks for ndarray responses and falls back to JSON
+        # transparently if the server does not support it.
+        # hedge_delay: for query embeddings, send a second copy of the request to another
+        # replica if the first has not answered within this many seconds.
+        if response_format not in ("npy", "json"):
+            raise ValueError(f"Unsupported response format: {response_format}")
+
+        endpoint_urls = endpoint_url.split(",") if isinstance(endpoint_url, str) else list(endpoint_url)
+        endpoint_urls = [url.strip() for url in endpoint_urls if url and url.strip()]
+        if not endpoint_urls:
+            raise ValueError("At least one ColPali endpoint must be provided")
+
+        self.replicas = [ColPaliReplica(url, pool_size=pool_size) for url in endpoint_urls]
+        self.endpoint_url = endpoint_urls[0]
+        self.base_url = self.replicas[0].base_url
+        self.response_format = response_format
+        self.dtype = dtype
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.health_check_interval = health_check_interval
+        self.lock = threading.Lock()
+        self._hedge_executor = None
+        self._model_id = None
+        self._model_id_retry_at = 0.0
+
+    def _headers(self, content_type: Optional[str] = "application/json") -> Dict:
+        headers = {}
+        if content_type:
+            headers["Content-Type"] = content_type
+        if self.response_format == "npy":
+            headers["Accept"] = f"{NPY_MEDIA_TYPE}, application/json"
+            headers["X-Embedding-Dtype"] = self.dtype
+        return headers
+
+    def _parse_response(self, response) -> Dict:
+        if response.headers.get("Content-Type", "").startswith(NPY_MEDIA_TYPE):
+            return decode_npy_response(response)
+        return response.json()
+
+    def _probe(self, replica: ColPaliReplica) -> bool:
+        connect_timeout = self.timeout[0] if isinstance(self.timeout, tuple) else self.timeout
+        try:
+            response = replica.session.get(replica.health_url, timeout=connect_timeout)
+            healthy = response.status_code == 200
+        except requests.exceptions.RequestException:
+            healthy = False
+
+        with self.lock:
+            replica.healthy = healthy
+            if not healthy:
+                replica.retry_at = time.monotonic() + self.health_check_interval
+        return healthy
+
+    def check_health(self) -> Dict[str, bool]:
+        return {replica.endpoint_url: self._probe(replica) for replica in self.replicas}
+
+    def _pick(self, exclude=()) -> Optional[ColPaliReplica]:
+        candidates = [replica for replica in self.replicas if replica not in exclude]
+        if not candidates:
+            return None
+
+        # unhealthy replicas are probed again once their back-off has passed
+        now = time.monotonic()
+        for replica in candidates:
+            if not replica.healthy and now >= replica.retry_at:
+                self._probe(replica)
+
+        with self.lock:
+            healthy = [replica for replica in candidates if replica.healthy]
+            if not healthy:
+                # nothing is known to be up: try the one that failed longest ago
+                return min(candidates, key=lambda replica: replica.retry_at)
+            return min(healthy, key=lambda replica: (replica.in_flight, replica.latency or 0.0))
+
+    def _mark_failed(self, replica: ColPaliReplica, error):
+        print(f"ColPali replica {replica.base_url} failed: {error}")
+        with self.lock:
+            replica.healthy = False
+            replica.retry_at = time.monotonic() + self.health_check_interval
+
+    def _request(self, method: str, url_attr: str, first: Optional[ColPaliReplica] = None, exclude=(), **kwargs):
+        """Send a request to the best replica and return its response.
+
+        Connection errors, timeouts and gateway errors mark the replica unhealthy and the
+        request fails over to the next best one.
+        """
+        tried = set(exclude)
+        last_error = None
+
+        while True:
+            replica = first if first is not None and first not in tried else self._pick(exclude=tried)
+            if replica is None:
+                break
+            tried.add(replica)
+
+            with self.lock:
+                replica.in_flight += 1
+            started = time.monotonic()
+            try:
+                response = replica.session.request(method, getattr(replica, url_attr), timeout=self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                last_error = e
+                self._mark_failed(replica, e)
+                continue
+            finally:
+                with self.lock:
+                    replica.in_flight -= 1
+
+            if response.status_code in REPLICA_FAILURE_STATUSES:
+                last_error = requests.exceptions.HTTPError(f"{response.status_code} from {replica.base_url}")
+                self._mark_failed(replica, last_error)
+                continue
+
+            elapsed = time.monotonic() - started
+            with self.lock:
+                replica.healthy = True
+                replica.latency = elapsed if replica.latency is None else 0.8 * replica.latency + 0.2 * elapsed
+            return response
+
+        raise requests.exceptions.ConnectionError(f"No ColPali replica available: {last_error}")
+
+    def _hedged_request(self, method: str, url_attr: str, **kwargs):
+        # send to the best replica; if it has not answered after hedge_delay, race a copy on another one
+        with self.lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=2 * len(self.replicas))
+
+        primary = self._pick()
+        futures = [self._hedge_executor.submit(self._request, method, url_attr, first=primary, **kwargs)]
+        done, _ = wait(futures, timeout=self.hedge_delay)
+        if not done:
+            futures.append(self._hedge_executor.submit(self._request, method, url_attr, exclude={primary}, **kwargs))
+
+        errors = []
+        for future in as_completed(futures):
+            try:
+                return future.result()
+            except Exception as e:
+                errors.append(e)
+        raise errors[0]
 
     def get_embeddings(self, images_encoded: Optional[List[str]] = None, queries: Optional[List[str]] = None) -> Dict:
         if not images_encoded and not queries:
             raise ValueError("At least one of images or queries must be provided for embedding")
         data = {}
-        
+
         if images_encoded:
             data["images"] = images_encoded
-            
+
         if queries:
             data["queries"] = queries
 
         try:
-            response = requests.post(
-                self.endpoint_url,
-                data=json.dumps(data),
-                headers={"Content-Type": "application/json"}
+            request_kwargs = {"data": json.dumps(data), "headers": self._headers()}
+            if not images_encoded and self.hedge_delay is not None and len(self.replicas) > 1:
+                response = self._hedged_request("POST", "endpoint_url", **request_kwargs)
+            else:
+                response = self._request("POST", "endpoint_url", **request_kwargs)
+
+            response.raise_for_status()
+            return self._parse_response(response)
+
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Error making request to ColPali endpoint: {str(e)}")
+
+    def get_image_embeddings(self, images: List[bytes], names: Optional[List[str]] = None) -> Dict:
+        """Embed raw image bytes through the multipart /embed_images endpoint.
+
+        Falls back to the base64 JSON /embed endpoint if the server does not provide it.
+        """
+        if not images:
+            raise ValueError("At least one image must be provided for embedding")
+        if names is None:
+            names = [f"image_{idx}" for idx in range(len(images))]
+
+        files = [("images", (name, image_bytes, "application/octet-stream")) for name, image_bytes in zip(names, images)]
+
+        try:
+            # requests sets the multipart Content-Type (with boundary) itself
+            response = self._request(
+                "POST",
+                "images_endpoint_url",
+                files=files,
+                headers=self._headers(content_type=None)
             )
 
+            if response.status_code in (404, 405):
+                images_encoded = [base64.b64encode(image_bytes).decode('utf-8') for image_bytes in images]
+                return self.get_embeddings(images_encoded=images_encoded)
+
+            response.raise_for_status()
+            return self._parse_response(response)
+
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Error making request to ColPali endpoint: {str(e)}")
+
+    def get_processor_config(self) -> Optional[Dict]:
+        try:
+            response = self._request("GET", "processor_config_url")
             response.raise_for_status()
             return response.json()
-            
         except requests.exceptions.RequestException as e:
-            raise Exception(f"Error making request to ColPali endpoint: {str(e)}")
\ No newline at end of file
+            print(f"Could not fetch ColPali processor config: {str(e)}")
+            return None
+
+    def get_model_id(self) -> str:
+        # fetched once; used to key cached query embeddings. A failed lookup is not repeated
+        # for health_check_interval seconds, so queries do not each add a request to a
+        # struggling server
+        if self._model_id is None:
+            if time.monotonic() < self._model_id_retry_at:
+                return ""
+            config = self.get_processor_config()
+            if config is None:
+                self._model_id_retry_at = time.monotonic() + self.health_check_interval
+                return ""
+            self._model_id = config.get("model_id", "")
+        return self._model_id
+
+    def get_model_image_size(self) -> Optional[tuple]:
+        """Return the (width, height) the server's processor resizes images to, if it reports one."""
+        size = (self.get_processor_config() or {}).get("image_size") or {}
+        if size.get("width") and size.get("height"):
+            return (int(size["width"]), int(size["height"]))
+        return None
+
+
+def get_colpali_client(endpoint_url: Union[str, List[str]]) -> ColPaliClient:
+    """Return the shared client for these endpoints, so pooled sessions and replica
+    health are kept across calls instead of being rebuilt per request."""
+    key = endpoint_url if isinstance(endpoint_url, str) else ",".join(endpoint_url)
+    with _colpali_clients_lock:
+        if key not in _colpali_clients:
+            _colpali_clients[key] = ColPaliClient(
+                endpoint_url,
+                timeout=(COLPALI_CONNECT_TIMEOUT, COLPALI_READ_TIMEOUT),
+                hedge_delay=COLPALI_HEDGE_DELAY,
+            )
+        return _colpali_clients[key]
@@ -0,0 +1,377 @@
+"""Export and import of collection embeddings.
+
+A collection can be rebuilt with other settings (quantization, HNSW, on-disk vectors,
+pooled row/column vectors, token pooling) from an archive of its points, without
+sending a single page through ColPali again.
+
+    python embedding_archive.py export --collection textbooks --output /data/archives/textbooks
+    python embedding_archive.py import --archive /data/archives/textbooks --collection textbooks_binary \
+        --quantization binary --on-disk --colpali-url http://gpu1:8000/embed
+
+An archive is a directory: manifest.json, and per chunk of points a JSONL index (point id,
+token offsets, sparse vectors, payload) plus one float16 file per named vector holding
+the tokens of all points of the chunk back to back. The vector files are memory-mapped
+on import, so points are read at disk speed.
+"""
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+from qdrant_client import models
+from tqdm import tqdm
+
+from colpali_models import get_colpali_client
+from numpy_store import DEFAULT_VECTOR
+from pipeline import Stage, run_pipeline, format_pipeline_stats
+from text_index import TEXT_VECTOR
+from upsert_writer import AdaptiveUpsertWriter
+from qdrant_models import (
+    create_qdrant_client, create_qdrant_collection, collection_layout, pool_image_embedding, pool_tokens,
+    upsert_to_qdrant, content_point_id, point_config_key, ORIGINAL_VECTOR, ROWS_VECTOR, COLUMNS_VECTOR,
+)
+
+ARCHIVE_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+
+
+def _index_file(chunk):
+    return f"chunk-{chunk:05d}.jsonl"
+
+
+def _vector_file(chunk, name):
+    return f"chunk-{chunk:05d}.{name or 'default'}.f16"
+
+
+class ArchiveWriter:
+    """Appends points to an archive directory, starting a new chunk every `chunk_points` points."""
+    def __init__(self, path, dims, chunk_points=2048):
+        self.path = Path(path)
+        self.dims = dims
+        self.chunk_points = chunk_points
+        self.chunks = []
+        self.index = None
+        self.vector_files = {}
+
+    def _start_chunk(self):
+        self._finish_chunk()
+        chunk = len(self.chunks)
+        self.chunks.append({"index": _index_file(chunk), "points": 0, "tokens": dict.fromkeys(self.dims, 0)})
+        self.index = open(self.path / _index_file(chunk), "w")
+        self.vector_files = {name: open(self.path / _vector_file(chunk, name), "wb") for name in self.dims}
+
+    def _finish_chunk(self):
+        if self.index is not None:
+            self.index.close()
+            for f in self.vector_files.values():
+                f.close()
+            self.index = None
+
+    def add(self, point_id, vectors, payload):
+        # vectors: {name: multivector or SparseVector}, as returned by scroll(with_vectors=True)
+        if self.index is None or self.chunks[-1]["points"] >= self.chunk_points:
+            self._start_chunk()
+        chunk = self.chunks[-1]
+
+        offsets, sparse = {}, {}
+        for name, vector in vectors.items():
+            if hasattr(vector, "indices"):
+                sparse[name] = [list(vector.indices), list(vector.values)]
+                continue
+            data = np.asarray(vector, dtype=np.float16).reshape(-1, self.dims[name])
+            self.vector_files[name].write(data.tobytes())
+            offsets[name] = [chunk["tokens"][name], len(data)]
+            chunk["tokens"][name] += len(data)
+
+        self.index.write(json.dumps({"id": point_id, "offsets": offsets, "sparse": sparse, "payload": payload or {}}) + "\n")
+        chunk["points"] += 1
+
+    def close(self):
+        self._finish_chunk()
+        return self.chunks
+
+
+class EmbeddingArchive:
+    """Read side of an archive: the manifest, the index records and memory-mapped vectors."""
+    def __init__(self, path):
+        self.path = Path(path)
+        manifest_file = self.path / MANIFEST_FILE
+        if not manifest_file.exists():
+            raise ValueError(f"{path} is not a complete embedding archive (no {MANIFEST_FILE})")
+        with open(manifest_file) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != ARCHIVE_FORMAT:
+            raise ValueError(f"Unsupported embedding archive format: {self.manifest.get('format')}")
+        self.dims = self.manifest["vectors"]
+
+    def __len__(self):
+        return self.manifest["points"]
+
+    def records(self):
+        """Yield (chunk number, index record) for every point, chunk by chunk."""
+        for chunk_number, chunk in enumerate(self.manifest["chunks"]):
+            with open(self.path / chunk["index"]) as f:
+                for line in f:
+                    if line.strip():
+                        yield chunk_number, json.loads(line)
+
+    def segment(self, chunk_number, name):
+        tokens = self.manifest["chunks"][chunk_number]["tokens"][name]
+        if not tokens:
+            return np.empty((0, self.dims[name]), dtype=np.float16)
+        return np.memmap(self.path / _vector_file(chunk_number, name), dtype=np.float16, mode="r",
+                         shape=(tokens, self.dims[name]))
+
+
+def export_collection(qdrant_uri, collection_name, archive_path, chunk_points=2048, page_size=32):
+    """Stream every point of a collection (vectors as float16, payload) into a new archive.
+
+    The manifest is written last, so an interrupted export is not mistaken for a complete one.
+    Returns the manifest.
+    """
+    qdrant_client = create_qdrant_client(qdrant_uri)
+    collection_info = qdrant_client.get_collection(collection_name)
+    layout = collection_layout(qdrant_client, collection_name)
+    vectors_config = collection_info.config.params.vectors
+    named = isinstance(vectors_config, dict)
+    dims = {name: params.size for name, params in vectors_config.items()} if named else {DEFAULT_VECTOR: vectors_config.size}
+    source_params = vectors_config.get(ORIGINAL_VECTOR, next(iter(vectors_config.values()))) if named else vectors_config
+    # recorded so an import can recreate the collection with the same settings
+    payload_indexes = {
+        field: getattr(info.data_type, "value", info.data_type)
+        for field, info in (getattr(collection_info, "payload_schema", None) or {}).items()
+    }
+
+    archive_path = Path(archive_path)
+    if (archive_path / MANIFEST_FILE).exists():
+        raise ValueError(f"An archive already exists at {archive_path}")
+    archive_path.mkdir(parents=True, exist_ok=True)
+
+    writer = ArchiveWriter(archive_path, dims, chunk_points)
+    total = qdrant_client.count(collection_name=collection_name, exact=True).count
+    points = 0
+    offset = None
+    started = time.perf_counter()
+    with tqdm(total=total, desc="Exporting") as pbar:
+        while True:
+            records, offset = qdrant_client.scroll(
+                collection_name=collection_name,
+                limit=page_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            for record in records:
+                vectors = record.vector if isinstance(record.vector, dict) else {DEFAULT_VECTOR: record.vector}
+                writer.add(record.id, vectors, record.payload)
+            points += len(records)
+            pbar.update(len(records))
+            if offset is None:
+                break
+
+    manifest = {
+        "format": ARCHIVE_FORMAT,
+        "source_collection": collection_name,
+        "created_at": time.time(),
+        "points": points,
+        "vectors": dims,
+        "sparse": list(collection_info.config.params.sparse_vectors or {}),
+        "pooled": layout["pooled"],
+        "pool_factor": layout["pool_factor"],
+        "on_disk": bool(getattr(source_params, "on_disk", False)),
+        "payload_indexes": payload_indexes,
+        "metadata": collection_info.config.metadata or {},
+        "chunks": writer.close(),
+    }
+    tmp_file = archive_path / (MANIFEST_FILE + ".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, archive_path / MANIFEST_FILE)
+
+    elapsed = time.perf_counter() - started
+    print(f"Exported {points} points of '{collection_name}' to {archive_path} in {elapsed:.1f}s")
+    return manifest
+
+
+def import_archive(archive_path, qdrant_uri, collection_name, colpali_url=None, model_image_size="auto", batch_points=32,
+                   convert_workers=2, upsert_workers=2, upsert_batch_bytes=8 * 1024 * 1024, queue_size=4):
+    """Load an archive into an existing collection, converting the points to its layout.
+
+    The collection may use any settings of create_qdrant_collection: the original
+    multivector is copied (or token-pooled, if the collection pools by a larger factor
+    than the archive), the pooled row/column vectors are copied or computed from the
+    original, and the text vectors are kept if the collection has a text index.
+
+    Point ids are derived from the collection name (see content_point_id). With
+    colpali_url, the ids are recomputed for the new collection from the server's model id
+    and image size (nothing is embedded), so later index_images_to_qdrant runs recognize
+    the imported pages; without it, the archive's ids are kept.
+    """
+    archive = EmbeddingArchive(archive_path)
+    manifest = archive.manifest
+    qdrant_client = create_qdrant_client(qdrant_uri)
+    layout = collection_layout(qdrant_client, collection_name)
+    source_vector = ORIGINAL_VECTOR if ORIGINAL_VECTOR in archive.dims else DEFAULT_VECTOR
+    source_pool_factor = manifest["pool_factor"]
+    pool_factor = layout["pool_factor"]
+
+    # pooled tokens cannot be split again, and the row/column vectors need the full patch grid
+    if pool_factor != source_pool_factor and source_pool_factor != 1:
+        raise ValueError(f"Archive tokens are pooled by {source_pool_factor}; cannot load into a collection "
+                         f"pooled by {pool_factor}")
+    if layout["pooled"] and not manifest["pooled"] and source_pool_factor != 1:
+        raise ValueError("Archive has neither pooled vectors nor full token grids to compute them from")
+
+    model_id = None
+    if colpali_url:
+        colpali_client = get_colpali_client(colpali_url)
+        model_id = (colpali_client.get_processor_config() or {}).get("model_id", "")
+        if model_image_size == "auto":
+            model_image_size = colpali_client.get_model_image_size()
+
+    def point_id(record):
+        payload = record["payload"]
+        if model_id is None or "content_hash" not in payload:
+            return record["id"]
+        return content_point_id(payload["content_hash"], point_config_key(collection_name, model_id, model_image_size, pool_factor))
+
+    def read_batches():
+        batch = []
+        for chunk_number, record in archive.records():
+            batch.append((chunk_number, record))
+            if len(batch) >= batch_points:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def vector_of(chunk_number, record, name):
+        start, count = record["offsets"][name]
+        return np.asarray(archive.segment(chunk_number, name)[start:start + count], dtype=np.float32)
+
+    def convert_batch(batch):
+        points = []
+        for chunk_number, record in batch:
+            original = vector_of(chunk_number, record, source_vector)
+            vector = pool_tokens(original, pool_factor) if pool_factor != source_pool_factor else original
+            if layout["pooled"]:
+                if ROWS_VECTOR in record["offsets"]:
+                    rows = vector_of(chunk_number, record, ROWS_VECTOR)
+                    columns = vector_of(chunk_number, record, COLUMNS_VECTOR)
+                else:
+                    rows, columns = pool_image_embedding(original)
+                vector = {ORIGINAL_VECTOR: vector, ROWS_VECTOR: rows, COLUMNS_VECTOR: columns}
+            text = record.get("sparse", {}).get(TEXT_VECTOR)
+            if layout["sparse"] and text:
+                vector = dict(vector) if isinstance(vector, dict) else {"": vector}
+                vector[TEXT_VECTOR] = models.SparseVector(indices=text[0], values=text[1])
+            points.append(
+                models.PointStruct(
+                    id=point_id(record),
+                    vector=vector,
+                    payload={**record["payload"], "pool_factor": pool_factor},
+                )
+            )
+        return points
+
+    writer = AdaptiveUpsertWriter(
+        lambda points, wait: upsert_to_qdrant(points, collection_name, qdrant_client, wait=wait),
+        batch_bytes=upsert_batch_bytes,
+        max_in_flight=upsert_workers,
+    )
+
+    with tqdm(total=len(archive), desc="Importing") as pbar:
+        def upsert_batch(points):
+            writer.add(points, on_done=lambda: pbar.update(len(points)))
+
+        stages = [
+            Stage("convert", convert_batch, workers=convert_workers),
+            Stage("upsert", upsert_batch, workers=1),
+        ]
+        try:
+            stats = run_pipeline(read_batches(), stages, queue_size=queue_size, item_size=len)
+        finally:
+            writer_stats = writer.close()
+
+    stats["points"] = writer_stats["points"]
+    print(f"Imported {stats['points']} points into '{collection_name}'")
+    print(format_pipeline_stats(stats))
+    stats["upsert_writer"] = writer_stats
+    return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export collection embeddings to an archive, or rebuild a collection from one")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="write every point of a collection to a new archive")
+    export.add_argument("--collection", default=os.getenv("QDRANT_COLLECTION_NAME"))
+    export.add_argument("--qdrant-uri", default=os.getenv("QDRANT_URI"))
+    export.add_argument("--output", required=True, help="archive directory to create")
+    export.add_argument("--chunk-points", type=int, default=2048, help="points per archive chunk")
+    export.add_argument("--page-size", type=int, default=32, help="points read per scroll request")
+
+    load = commands.add_parser("import", help="load an archive into a collection, creating it if needed")
+    load.add_argument("--archive", required=True)
+    load.add_argument("--collection", required=True)
+    load.add_argument("--qdrant-uri", default=os.getenv("QDRANT_URI"))
+    load.add_argument("--colpali-url", help="recompute point ids for the new collection from this server's model config")
+    load.add_argument("--batch-points", type=int, default=32)
+    load.add_argument("--convert-workers", type=int, default=2, help="threads converting points (token pooling)")
+    load.add_argument("--upsert-workers", type=int, default=2, help="upsert requests in flight")
+    load.add_argument("--upsert-batch-mb", type=float, default=8, help="initial size of an upsert request; adapted to latency")
+    # settings of a collection created by the import; default to the archived collection's
+    load.add_argument("--pooled-vectors", action=argparse.BooleanOptionalAction, default=None)
+    load.add_argument("--pool-factor", type=int)
+    load.add_argument("--quantization", choices=["none", "scalar", "binary", "product"])
+    load.add_argument("--on-disk", action=argparse.BooleanOptionalAction, default=None)
+    load.add_argument("--oversampling", type=float)
+    load.add_argument("--text-index", action=argparse.BooleanOptionalAction, default=None)
+    load.add_argument("--indexing-threshold", type=int, default=20000)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "export":
+        export_collection(args.qdrant_uri, args.collection, args.output, args.chunk_points, args.page_size)
+        return
+
+    archive = EmbeddingArchive(args.archive)
+    manifest = archive.manifest
+    qdrant_client = create_qdrant_client(args.qdrant_uri)
+    if not qdrant_client.collection_exists(args.collection):
+        metadata = manifest["metadata"]
+        source_vector = ORIGINAL_VECTOR if ORIGINAL_VECTOR in archive.dims else DEFAULT_VECTOR
+        create_qdrant_collection(
+            args.qdrant_uri,
+            args.collection,
+            archive.dims[source_vector],
+            args.indexing_threshold,
+            pooled_vectors=manifest["pooled"] if args.pooled_vectors is None else args.pooled_vectors,
+            pool_factor=args.pool_factor or manifest["pool_factor"],
+            quantization=args.quantization or metadata.get("quantization", "scalar"),
+            on_disk=manifest.get("on_disk", False) if args.on_disk is None else args.on_disk,
+            oversampling=args.oversampling,
+            rescore=metadata.get("rescore", True),
+            payload_indexes=manifest.get("payload_indexes"),
+            text_index=TEXT_VECTOR in manifest["sparse"] if args.text_index is None else args.text_index,
+        )
+        print(f"Created collection '{args.collection}'")
+
+    import_archive(
+        args.archive,
+        args.qdrant_uri,
+        args.collection,
+        colpali_url=args.colpali_url,
+        batch_points=args.batch_points,
+        convert_workers=args.convert_workers,
+        upsert_workers=args.upsert_workers,
+        upsert_batch_bytes=int(args.upsert_batch_mb * 1024 * 1024),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,26 @@
 import base64
+import asyncio
+import hashlib
 import zipfile
 from PIL import Image
 from typing import List
+import pymupdf
 from pdf2image import convert_from_path
+from itertools import islice
 from io import BytesIO
 import uuid
 import os
+import shutil
+import threading
+from collections import deque
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from python_multipart.multipart import MultipartParser, parse_options_header
 
-def create_hash_folder(BASE_UPLOAD_DIRECTORY):
+def create_hash_folder(BASE_UPLOAD_DIRECTORY, hash_value=None):
+    # hash_value names the folder, e.g. the upload's content hash; random if not given
     base_dir = Path(BASE_UPLOAD_DIRECTORY)
-    hash_value = uuid.uuid4().hex
+    hash_value = hash_value or uuid.uuid4().hex
     hash_folder = base_dir / hash_value
     images_folder = hash_folder / "images_to_process"
     
@@ -19,6 +29,104 @@ def create_hash_folder(BASE_UPLOAD_DIRECTORY):
     
     return str(hash_folder), str(images_folder)
 
+class UploadTooLargeError(ValueError):
+    pass
+
+
+async def save_multipart_upload(request, destination, file_field="file", extensions=None, max_bytes=None,
+                                chunk_size=1024 * 1024, max_field_bytes=64 * 1024):
+    """Stream a multipart/form-data request body straight to `destination`.
+
+    The body is parsed as it arrives (no spooled copy as with File(...) parameters): the
+    `file_field` part is hashed and written in `chunk_size` pieces off the event loop, the
+    other parts are returned as form fields. Returns (fields, filename, sha256 hex digest,
+    size in bytes). Raises UploadTooLargeError once the file exceeds `max_bytes`, and
+    ValueError for a malformed body or a file name not ending in `extensions`; the partial
+    file is removed either way.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise ValueError("Expected a multipart/form-data upload")
+
+    fields = {}
+    part = {"headers": {}, "field": b"", "value": b"", "name": None, "filename": None, "data": bytearray()}
+    upload = {"filename": None, "size": 0, "error": None}
+    pending = bytearray()
+
+    def on_part_begin():
+        part.update(headers={}, name=None, filename=None, data=bytearray())
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part.update(field=b"", value=b"")
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options and part["name"] == file_field and upload["filename"] is None:
+            filename = Path(options[b"filename"].decode("utf-8", "replace")).name
+            if extensions is not None and not filename.endswith(extensions):
+                upload["error"] = ValueError("Unsupported file type")
+            part["filename"] = upload["filename"] = filename
+
+    def on_part_data(data, start, end):
+        if part["filename"] is not None:
+            pending.extend(data[start:end])
+            upload["size"] += end - start
+            if max_bytes is not None and upload["size"] > max_bytes:
+                upload["error"] = UploadTooLargeError(f"Upload exceeds the limit of {max_bytes} bytes")
+        else:
+            part["data"].extend(data[start:end])
+            if len(part["data"]) > max_field_bytes:
+                upload["error"] = ValueError(f"Form field {part['name']} is too large")
+
+    def on_part_end():
+        if part["filename"] is None and part["name"]:
+            fields[part["name"]] = part["data"].decode("utf-8", "replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field, "on_header_value": on_header_value,
+        "on_header_end": on_header_end, "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+
+    sha256 = hashlib.sha256()
+
+    def write(f, data):
+        sha256.update(data)
+        f.write(data)
+
+    received = 0
+    f = await asyncio.to_thread(open, destination, "wb")
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if max_bytes is not None and received > max_bytes + 1024 * 1024:
+                # room for the other fields and the multipart framing
+                raise UploadTooLargeError(f"Upload exceeds the limit of {max_bytes} bytes")
+            parser.write(chunk)
+            if upload["error"] is not None:
+                raise upload["error"]
+            if len(pending) >= chunk_size:
+                await asyncio.to_thread(write, f, bytes(pending))
+                pending.clear()
+        parser.finalize()
+        if upload["filename"] is None:
+            raise ValueError(f"No {file_field} in the upload")
+        await asyncio.to_thread(write, f, bytes(pending))
+        await asyncio.to_thread(f.close)
+    except BaseException:
+        f.close()
+        Path(destination).unlink(missing_ok=True)
+        raise
+    return fields, upload["filename"], sha256.hexdigest(), upload["size"]
+
 def encode_images_base64(image_paths: List[str]) -> List[str]:
     encoded_images = []
     try:
@@ -32,6 +140,47 @@ def encode_images_base64(image_paths: List[str]) -> List[str]:
         raise Exception(f"Error encoding images to base64: {str(e)}")
     
 
+def read_image_bytes(image_paths: List[str]) -> List[bytes]:
+    try:
+        images = []
+        for image_path in image_paths:
+            with open(image_path, "rb") as image_file:
+                images.append(image_file.read())
+        return images
+    except Exception as e:
+        raise Exception(f"Error reading image files: {str(e)}")
+
+
+def resize_image_bytes(image_path, size, format="PNG") -> bytes:
+    """Return the image at `size` (width, height) encoded as `format`.
+
+    Used to send the embedding server a model-resolution derivative; the original
+    file is left untouched. PNG keeps the derivative lossless.
+    """
+    try:
+        with Image.open(image_path) as img:
+            # lets the JPEG decoder skip straight to a reduced scale
+            img.draft("RGB", size)
+            img = img.convert("RGB").resize(size, Image.BICUBIC)
+            buffered = BytesIO()
+            img.save(buffered, format=format)
+            return buffered.getvalue()
+    except Exception as e:
+        raise Exception(f"Error resizing image {image_path}: {str(e)}")
+
+
+def read_resized_image_bytes(image_paths: List[str], size) -> List[bytes]:
+    return [resize_image_bytes(image_path, size) for image_path in image_paths]
+
+
+def hash_file(file_path, chunk_size=1024 * 1024) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
 def encode_image(image_path):
     try:
         with open(image_path, "rb") as image_file:
@@ -57,6 +206,57 @@ def convert_pdf_to_images(pdf_file_path):
     except Exception as e:
         raise RuntimeError(f"Error converting PDF to images: {str(e)}")
 
+def get_pdf_page_count(pdf_file_path):
+    try:
+        with pymupdf.open(pdf_file_path) as doc:
+            return doc.page_count
+    except Exception as e:
+        raise RuntimeError(f"Error reading PDF info: {str(e)}")
+
+def render_pdf_pages(pdf_file_path, page_numbers, dpi=300):
+    """Rasterize the given (1-based) pages of a PDF, yielding (page_number, image).
+
+    The document is opened once for all pages, and only the current page is held in memory.
+    """
+    with pymupdf.open(pdf_file_path) as doc:
+        for page_number in page_numbers:
+            try:
+                pixmap = doc[page_number - 1].get_pixmap(dpi=dpi)
+            except Exception as e:
+                raise RuntimeError(f"Error converting PDF page {page_number} to image: {str(e)}")
+            yield page_number, Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+def pdf_page_image_path(pdf_file_path, images_folder, page_number):
+    pdf_filename = Path(pdf_file_path).name.rsplit(".", 1)[0]
+    return str(Path(images_folder) / f"{pdf_filename}_page_{page_number}.png")
+
+def save_pdf_pages(pdf_file_path, images_folder, dpi=300, first_page=1, last_page=None, skip_paths=None):
+    """Rasterize and save PDF pages as PNGs, yielding each saved path as soon as it is written.
+
+    Pages whose output path is in `skip_paths` (e.g. already indexed) are not rendered.
+    """
+    if last_page is None:
+        last_page = get_pdf_page_count(pdf_file_path)
+    skip_paths = skip_paths or set()
+
+    page_numbers = [
+        page_number for page_number in range(first_page, last_page + 1)
+        if pdf_page_image_path(pdf_file_path, images_folder, page_number) not in skip_paths
+    ]
+    for page_number, image in render_pdf_pages(pdf_file_path, page_numbers, dpi=dpi):
+        image_path = pdf_page_image_path(pdf_file_path, images_folder, page_number)
+        image.save(image_path)
+        image.close()
+        yield image_path
+
+def iter_batches(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
 def extract_images_and_names_from_zip(zip_file):
     images = []
     image_names = []
@@ -76,6 +276,111 @@ def extract_images_and_names_from_zip(zip_file):
     return images, image_names
 
 
+# leading bytes of the image formats accepted for upload
+IMAGE_SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff")
+ZIP_COPY_CHUNK_SIZE = 1024 * 1024
+
+def zip_image_members(zip_file, check_headers=False):
+    # check_headers also drops members whose bytes are not PNG/JPEG, as extraction will
+    with zipfile.ZipFile(zip_file) as z:
+        members = [
+            info.filename for info in z.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(('.png', '.jpg', '.jpeg'))
+        ]
+        if check_headers:
+            members = [member_name for member_name in members if _zip_member_header(z, member_name).startswith(IMAGE_SIGNATURES)]
+        return members
+
+def _zip_member_header(z, member_name):
+    with z.open(member_name) as src:
+        return src.read(len(IMAGE_SIGNATURES[0]))
+
+def zip_member_image_path(member_name, images_folder):
+    # flatten nested folders into the file name; also keeps members from escaping images_folder
+    parts = [part for part in Path(member_name).parts if part not in ("", ".", "..", "/")]
+    return str(Path(images_folder) / "_".join(parts))
+
+def zip_member_image_paths(member_names, images_folder):
+    """Map members to unique output paths: when two members flatten to the same name
+    (a/b_c.png and a_b/c.png), later ones get a numeric prefix, which keeps the trailing
+    page number. The result only depends on the member order, so it is stable across runs."""
+    paths, used = {}, set()
+    for member_name in member_names:
+        image_path = Path(zip_member_image_path(member_name, images_folder))
+        candidate, count = image_path, 1
+        while str(candidate) in used:
+            count += 1
+            candidate = image_path.with_name(f"{count}_{image_path.name}")
+        used.add(str(candidate))
+        paths[member_name] = str(candidate)
+    return paths
+
+def _extract_zip_member(z, member_name, image_path):
+    with z.open(member_name) as src:
+        header = src.read(len(IMAGE_SIGNATURES[0]))
+        if not header.startswith(IMAGE_SIGNATURES):
+            print(f"Skipping {member_name}: not a PNG/JPEG image")
+            return None
+        with open(image_path, "wb") as dst:
+            dst.write(header)
+            shutil.copyfileobj(src, dst, ZIP_COPY_CHUNK_SIZE)
+    return image_path
+
+def extract_zip_images(zip_file, images_folder, workers=4, skip_paths=None):
+    """Stream PNG/JPEG members of a ZIP to `images_folder`, yielding each written path.
+
+    Member bytes are copied as-is in chunks (no decode/re-encode), validated by their
+    header, and extracted by a pool of `workers` threads with at most 2 * `workers`
+    members in flight. Members whose output path is in `skip_paths` are not extracted.
+    Closing the generator early stops extraction after the members already running.
+    """
+    skip_paths = skip_paths or set()
+    image_paths = zip_member_image_paths(zip_image_members(zip_file), images_folder)
+    members = [(member_name, image_path) for member_name, image_path in image_paths.items() if image_path not in skip_paths]
+
+    # one ZipFile per worker thread: opening a handle parses the whole central directory,
+    # so it must not happen per member
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+    abort = threading.Event()
+
+    def extract(member):
+        if abort.is_set():
+            return None
+        z = getattr(local, "zip", None)
+        if z is None:
+            z = local.zip = zipfile.ZipFile(zip_file)
+            with handles_lock:
+                handles.append(z)
+        return _extract_zip_member(z, *member)
+
+    in_flight = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                # results are yielded in member order as they land on disk; a consumer that
+                # falls behind holds back new submissions instead of queueing the whole archive
+                for member in members:
+                    in_flight.append(executor.submit(extract, member))
+                    if len(in_flight) >= 2 * workers:
+                        image_path = in_flight.popleft().result()
+                        if image_path is not None:
+                            yield image_path
+                while in_flight:
+                    image_path = in_flight.popleft().result()
+                    if image_path is not None:
+                        yield image_path
+            finally:
+                # closed early (or failed): drop the queued members, let the running ones finish
+                abort.set()
+                for future in in_flight:
+                    future.cancel()
+    finally:
+        for z in handles:
+            z.close()
+
+
 def display_base64_image(base64_str):
     image_data = base64.b64decode(base64_str)
     image = Image.open(BytesIO(image_data))
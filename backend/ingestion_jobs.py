@@ -0,0 +1,324 @@
+import os
+import re
+import json
+import time
+import fcntl
+import shutil
+import threading
+from itertools import chain
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from helper_functions import save_pdf_pages, get_pdf_page_count, extract_zip_images, zip_image_members
+from qdrant_models import index_images_to_qdrant, create_qdrant_client, prune_document
+from text_index import extract_pdf_page_texts
+
+JOB_FILE = "job.json"
+LOCK_FILE = "job.lock"
+CHECKPOINT_FILE = "checkpoint.jsonl"
+IMAGES_FOLDER = "images_to_process"
+SUPPORTED_EXTENSIONS = (".pdf", ".zip", ".png", ".jpg", ".jpeg")
+ZIP_EXTRACT_WORKERS = int(os.getenv("ZIP_EXTRACT_WORKERS", 4))
+
+# states in which a job still has work left and is picked up again on restart
+PENDING_STATUSES = ("queued", "running")
+
+
+def page_payload(image_path, metadata):
+    # job metadata (ISBN, subject) plus the page number from "<name>_page_<n>.png" or trailing digits
+    payload = dict(metadata or {})
+    match = re.search(r"(\d+)$", Path(image_path).stem)
+    if match:
+        payload["page_number"] = int(match.group(1))
+    return payload
+
+
+def prepare_images(file_location, images_folder, skip_paths=None, prepared=False):
+    """Return (image paths, total page count) for an uploaded file.
+
+    PDF pages and ZIP members are produced lazily by the returned generator, so
+    indexing starts with the first page; pages in `skip_paths` are not produced again.
+    A single image upload is copied to `images_folder` unless `prepared` says that
+    already happened.
+    """
+    file_location = Path(file_location)
+    images_folder = Path(images_folder)
+    filename = file_location.name
+
+    if filename.endswith(".pdf"):
+        total = get_pdf_page_count(str(file_location))
+        return save_pdf_pages(str(file_location), str(images_folder), skip_paths=skip_paths), total
+
+    if filename.endswith(".zip"):
+        # only members with a PNG/JPEG header are extracted, so only those count as pages
+        total = len(zip_image_members(str(file_location), check_headers=True))
+        return extract_zip_images(str(file_location), str(images_folder), workers=ZIP_EXTRACT_WORKERS, skip_paths=skip_paths), total
+
+    if filename.endswith(('.png', '.jpg', '.jpeg')):
+        if not prepared:
+            shutil.copyfile(file_location, images_folder / filename)
+    else:
+        raise ValueError("Unsupported file type")
+
+    image_files = [str(images_folder / img) for img in os.listdir(str(images_folder))]
+    return image_files, len(image_files)
+
+
+class IngestionJobManager:
+    """Runs uploaded documents through index_images_to_qdrant as background jobs.
+
+    Each job lives in its upload hash folder: job.json holds the status and progress,
+    and checkpoint.jsonl gets one line per indexed batch, so a restarted backend can
+    resume a job from its last completed batch.
+
+    job.json is the shared record: several backend processes may serve the same upload
+    directory, so a job is only run by the process holding the flock on its job.lock, and
+    jobs not running in this process are read from disk.
+
+    Jobs with a document_id are indexed incrementally against the document's earlier
+    uploads: unchanged pages are kept, and once the job completes without errors the pages
+    this upload (revision = job id) no longer contains are removed from the document.
+    Running such a job again (resume) registers all of its pages again, so re-uploading an
+    earlier version, or a version whose document was deleted, restores it.
+    """
+    def __init__(self, index_kwargs, workers=1, base_directory=None):
+        self.index_kwargs = index_kwargs
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.base_directory = base_directory
+        self.jobs = {}  # jobs queued or running in this process
+        self.claims = {}  # their open, flocked job.lock files
+        self.lock = threading.Lock()
+
+    def _claim(self, hash_folder):
+        # the job's lock file, flocked; None if another process (or this one) already runs the job
+        lock_file = open(Path(hash_folder) / LOCK_FILE, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _release(self, job_id):
+        with self.lock:
+            self.jobs.pop(job_id, None)
+            lock_file = self.claims.pop(job_id, None)
+        if lock_file is not None:
+            lock_file.close()  # drops the flock
+
+    def _read(self, job_file):
+        try:
+            with open(job_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save(self, job):
+        job_file = Path(job["hash_folder"]) / JOB_FILE
+        tmp_file = job_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_file, job_file)
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            job = self.jobs[job_id]
+            job.update(fields)
+            job["updated_at"] = time.time()
+            self._save(job)
+
+    def _load_checkpoint(self, hash_folder):
+        done = set()
+        checkpoint_file = Path(hash_folder) / CHECKPOINT_FILE
+        if checkpoint_file.exists():
+            with open(checkpoint_file) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        done.update(json.loads(line))
+        return done
+
+    def _append_checkpoint(self, hash_folder, paths):
+        with open(Path(hash_folder) / CHECKPOINT_FILE, "a") as f:
+            f.write(json.dumps(list(paths)) + "\n")
+
+    def submit(self, hash_folder, filename, metadata=None, content_hash=None, size_bytes=None, document_id=None):
+        # the job id is the upload folder name; a job that already exists is returned as is
+        job_id = Path(hash_folder).name
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "filename": filename,
+            "metadata": metadata or {},
+            "document_id": document_id,
+            "content_hash": content_hash,
+            "size_bytes": size_bytes,
+            "hash_folder": str(hash_folder),
+            "status": "queued",
+            "prepared": False,
+            "pages_total": None,
+            "pages_done": 0,
+            "pages_per_second": 0.0,
+            "failed_batches": [],
+            "pages_removed": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        lock_file = self._claim(hash_folder)
+        if lock_file is None:
+            # the same upload arrived at another backend process first
+            return self._read(Path(hash_folder) / JOB_FILE) or job
+        existing = self._read(Path(hash_folder) / JOB_FILE)
+        if existing is not None:
+            lock_file.close()
+            return existing
+        with self.lock:
+            self.jobs[job_id] = job
+            self.claims[job_id] = lock_file
+            self._save(job)
+        self.executor.submit(self._run, job_id)
+        return dict(job)
+
+    def get(self, job_id):
+        # jobs running here are read from memory, all others from their job.json
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        if self.base_directory is None or Path(job_id).name != job_id or job_id.startswith("."):
+            return None
+        return self._read(Path(self.base_directory) / job_id / JOB_FILE)
+
+    def resume(self, job_id):
+        # re-run a job nobody is running; pages in the checkpoint are skipped, failed batches retried
+        job = self.get(job_id)
+        if job is None:
+            return None
+        lock_file = self._claim(job["hash_folder"])
+        if lock_file is None:
+            return None
+        # job.json as its last runner left it; a "running" status here is a crashed run
+        job = self._read(Path(job["hash_folder"]) / JOB_FILE)
+        job["status"] = "queued"
+        with self.lock:
+            self.jobs[job_id] = job
+            self.claims[job_id] = lock_file
+            self._save(job)
+        self.executor.submit(self._run, job_id)
+        return self.get(job_id)
+
+    def resume_pending(self, base_directory):
+        """Restart the unfinished jobs under `base_directory` that no other process is running.
+
+        Every backend worker calls this on startup; the job lock makes sure each
+        interrupted job is picked up by one of them only.
+        """
+        resumed = []
+        for job_file in Path(base_directory).glob(f"*/{JOB_FILE}"):
+            try:
+                job = self._read(job_file)
+            except Exception as e:
+                print(f"Skipping unreadable job file {job_file}: {e}")
+                continue
+            if job is None or job["status"] not in PENDING_STATUSES:
+                continue
+
+            lock_file = self._claim(job_file.parent)
+            if lock_file is None:
+                continue  # running in another worker
+            job = self._read(job_file)  # it may have finished before the lock was free
+            if job["status"] not in PENDING_STATUSES:
+                lock_file.close()
+                continue
+            with self.lock:
+                self.jobs[job["job_id"]] = job
+                self.claims[job["job_id"]] = lock_file
+            self.executor.submit(self._run, job["job_id"])
+            resumed.append(job["job_id"])
+
+        if resumed:
+            print(f"Resuming {len(resumed)} ingestion jobs: {', '.join(resumed)}")
+        return resumed
+
+    def _run(self, job_id):
+        try:
+            self._process(job_id)
+        finally:
+            self._release(job_id)
+
+    def _process(self, job_id):
+        job = self.get(job_id)
+        hash_folder = Path(job["hash_folder"])
+        images_folder = hash_folder / IMAGES_FOLDER
+        images_folder.mkdir(exist_ok=True)
+
+        done = self._load_checkpoint(hash_folder)
+        document_id = job.get("document_id")
+        # pages of a registered document are all fed again: already indexed ones are not
+        # embedded, only registered under this revision before the prune
+        refed = sorted(path for path in done if Path(path).exists()) if document_id else []
+        initial_done = len(done) - len(refed)
+        self._update(job_id, status="running", pages_done=initial_done, failed_batches=[], error=None)
+
+        started = time.perf_counter()
+        progress = {"pages": 0}
+
+        def on_batch_done(paths):
+            self._append_checkpoint(hash_folder, paths)
+            with self.lock:
+                progress["pages"] += len(paths)
+                elapsed = time.perf_counter() - started
+                pages_per_second = round(progress["pages"] / elapsed, 2) if elapsed > 0 else 0.0
+            self._update(job_id, pages_done=initial_done + progress["pages"], pages_per_second=pages_per_second)
+
+        def on_batch_failed(stage_name, paths, error):
+            with self.lock:
+                failed_batches = self.jobs[job_id]["failed_batches"] + [
+                    {"stage": stage_name, "pages": [Path(path).name for path in paths], "error": str(error)}
+                ]
+            self._update(job_id, failed_batches=failed_batches)
+
+        try:
+            image_files, total = prepare_images(
+                hash_folder / job["filename"], images_folder, skip_paths=done, prepared=job["prepared"]
+            )
+            self._update(job_id, prepared=True, pages_total=total)
+
+            text_fn = None
+            if job["filename"].endswith(".pdf"):
+                # the PDF text layer feeds the sparse text index; pages without text get none
+                try:
+                    page_texts = extract_pdf_page_texts(str(hash_folder / job["filename"]))
+                    text_fn = lambda path: page_texts.get(page_payload(path, None).get("page_number"))
+                except Exception as e:
+                    print(f"Could not extract text from {job['filename']}: {e}")
+
+            metadata = job.get("metadata") or {}
+            pending = chain(refed, (path for path in image_files if path not in done))
+            index_images_to_qdrant(
+                pending,
+                total=max(total - initial_done, 0),
+                progress_callback=on_batch_done,
+                error_callback=on_batch_failed,
+                payload_fn=lambda path: page_payload(path, metadata),
+                text_fn=text_fn,
+                document_id=document_id,
+                document_revision=job_id if document_id else None,
+                **self.index_kwargs,
+            )
+
+            status = "completed_with_errors" if self.get(job_id)["failed_batches"] else "completed"
+            if document_id and status == "completed":
+                # every page of this upload now carries its revision; the rest leave the document
+                pages_removed = prune_document(
+                    create_qdrant_client(self.index_kwargs["qdrant_uri"]), self.index_kwargs["collection_name"],
+                    document_id, job_id,
+                )
+                self._update(job_id, pages_removed=pages_removed)
+            self._update(job_id, status=status)
+            print(f"Ingestion job {job_id} {status}")
+
+        except Exception as e:
+            print(f"Ingestion job {job_id} failed: {e}")
+            self._update(job_id, status="failed", error=str(e))
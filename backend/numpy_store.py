@@ -0,0 +1,489 @@
+import os
+import math
+import json
+import fcntl
+import shutil
+import asyncio
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from qdrant_client import models
+from qdrant_client.http.models import QueryResponse
+
+# QDRANT_URI values starting with this scheme select the embedded store, e.g. numpy:///data/vectors
+NUMPY_STORE_SCHEME = "numpy://"
+
+# default (unnamed) vector of collections created with a single VectorParams
+DEFAULT_VECTOR = ""
+
+# reciprocal rank fusion constant, the same as Qdrant's (score = sum of 1 / (k + rank))
+RRF_K = 2
+
+# tokens scored per block of the MaxSim scan (float32 working set ~ tokens * dim * 4 bytes)
+BLOCK_TOKENS = int(os.getenv("NUMPY_STORE_BLOCK_TOKENS", 262144))
+
+COLLECTION_FILE = "collection.json"
+POINTS_FILE = "points.jsonl"
+LOCK_FILE = ".lock"
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def is_numpy_store_uri(uri):
+    return bool(uri) and uri.startswith(NUMPY_STORE_SCHEME)
+
+
+def get_numpy_store(uri):
+    """Return the shared store for a numpy:// URI, so its loaded index is kept across calls."""
+    path = str(Path(uri[len(NUMPY_STORE_SCHEME):]).resolve())
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = NumpyVectorStore(path)
+        return _stores[path]
+
+
+def _vector_file(name):
+    return f"vectors_{name or 'default'}.f16"
+
+
+class _Collection:
+    """One collection on disk: collection.json, one float16 segment file per named vector
+    and points.jsonl, the append-only index of point id -> token offsets and payload.
+
+    Sparse vectors are small and kept inline in the index lines.
+    Later lines for the same id supersede earlier ones. Vectors are appended before their
+    index line under a file lock, so readers in other processes only see complete points.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / COLLECTION_FILE) as f:
+            self.config = json.load(f)
+        self.dims = self.config["vectors"]
+        self.sparse = self.config.get("sparse", [])
+        self.points = {}  # id -> {"offsets": {name: [start, count]}, "payload": {...}}
+        self.index_position = 0
+        self.segments = {}  # name -> (memmap, number of tokens it covers)
+        self.lock = threading.Lock()
+
+    def _file_lock(self):
+        lock_file = open(self.path / LOCK_FILE, "a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def refresh(self):
+        # read index lines appended since the last call (possibly by another process)
+        points_file = self.path / POINTS_FILE
+        if not points_file.exists() or points_file.stat().st_size == self.index_position:
+            return
+        with self.lock, open(points_file) as f:
+            f.seek(self.index_position)
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                self.index_position += len(line.encode("utf-8"))
+                record = json.loads(line)
+                if record.get("deleted"):
+                    self.points.pop(record["id"], None)
+                else:
+                    self.points[record["id"]] = record
+
+    def records(self):
+        with self.lock:
+            return list(self.points.values())
+
+    def segment(self, name):
+        tokens = os.path.getsize(self.path / _vector_file(name)) // (2 * self.dims[name])
+        mapped = self.segments.get(name)
+        if mapped is None or mapped[1] < tokens:
+            # remap once the file has grown past the mapped region
+            data = np.memmap(self.path / _vector_file(name), dtype=np.float16, mode="r", shape=(tokens, self.dims[name]))
+            mapped = (data, tokens)
+            self.segments[name] = mapped
+        return mapped[0]
+
+    def append(self, points):
+        lock_file = self._file_lock()
+        try:
+            lines = []
+            for point in points:
+                vectors = point.vector if isinstance(point.vector, dict) else {DEFAULT_VECTOR: point.vector}
+                offsets = {}
+                sparse = {}
+                for name, vector in vectors.items():
+                    if name in self.sparse:
+                        sparse[name] = [list(vector.indices), list(vector.values)]
+                        continue
+                    vector = np.asarray(vector, dtype=np.float32).reshape(-1, self.dims[name])
+                    # cosine distance: stored normalized, like Qdrant does
+                    vector = vector / np.maximum(np.linalg.norm(vector, axis=1, keepdims=True), 1e-12)
+                    with open(self.path / _vector_file(name), "ab") as f:
+                        start = f.tell() // (2 * self.dims[name])
+                        f.write(vector.astype(np.float16).tobytes())
+                    offsets[name] = [start, len(vector)]
+                lines.append(json.dumps({"id": point.id, "offsets": offsets, "sparse": sparse, "payload": point.payload or {}}) + "\n")
+
+            with open(self.path / POINTS_FILE, "a") as f:
+                f.writelines(lines)
+        finally:
+            lock_file.close()
+        self.refresh()
+
+    def vectors(self, record):
+        # a point's vectors as the Qdrant client returns them: float16 views of the segments
+        vectors = {name: self.segment(name)[start:start + count] for name, (start, count) in record["offsets"].items()}
+        for name, (indices, values) in record.get("sparse", {}).items():
+            vectors[name] = models.SparseVector(indices=indices, values=values)
+        if not self.config["named"] and list(vectors) == [DEFAULT_VECTOR]:
+            return vectors[DEFAULT_VECTOR]
+        return vectors
+
+    def set_payload(self, updates):
+        # updates: [(point id, payload fields)]; re-indexes the point with the merged payload
+        self.refresh()
+        lock_file = self._file_lock()
+        try:
+            lines = []
+            for point_id, payload in updates:
+                record = self.points.get(point_id)
+                if record is not None:
+                    lines.append(json.dumps({**record, "payload": {**record["payload"], **payload}}) + "\n")
+            with open(self.path / POINTS_FILE, "a") as f:
+                f.writelines(lines)
+        finally:
+            lock_file.close()
+        self.refresh()
+
+    def delete(self, ids):
+        lock_file = self._file_lock()
+        try:
+            with open(self.path / POINTS_FILE, "a") as f:
+                f.writelines(json.dumps({"id": point_id, "deleted": True}) + "\n" for point_id in ids)
+        finally:
+            lock_file.close()
+        self.refresh()
+
+    def sparse_scores(self, query, name, records):
+        """Dot product of a sparse query with each record's sparse vector `name`, with terms
+        weighted by their inverse document frequency over the whole collection."""
+        documents = [record["sparse"][name] for record in self.records() if name in record.get("sparse", {})]
+        query_weights = dict(zip(query.indices, query.values))
+        frequencies = dict.fromkeys(query_weights, 0)
+        for indices, _ in documents:
+            for index in indices:
+                if index in frequencies:
+                    frequencies[index] += 1
+        for index, frequency in frequencies.items():
+            query_weights[index] *= math.log((len(documents) - frequency + 0.5) / (frequency + 0.5) + 1)
+
+        scores = np.zeros(len(records), dtype=np.float32)
+        for idx, record in enumerate(records):
+            indices, values = record.get("sparse", {}).get(name, ([], []))
+            scores[idx] = sum(query_weights.get(index, 0.0) * value for index, value in zip(indices, values))
+        return scores
+
+    def maxsim(self, query, name, records):
+        """Score `records` against a query multivector with MaxSim over vector `name`.
+
+        Points are scored in blocks of about BLOCK_TOKENS tokens: one matrix product
+        per block, then a per-point max (np.maximum.reduceat) and a sum over query tokens.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1, self.dims[name])
+        # not in place: the caller's array may be shared (e.g. a read-only cached embedding)
+        query = query / np.maximum(np.linalg.norm(query, axis=1, keepdims=True), 1e-12)
+        segment = self.segment(name)
+
+        scores = np.empty(len(records), dtype=np.float32)
+        block_start = 0
+        while block_start < len(records):
+            block_end, tokens = block_start, 0
+            while block_end < len(records) and (tokens == 0 or tokens + records[block_end]["offsets"][name][1] <= BLOCK_TOKENS):
+                tokens += records[block_end]["offsets"][name][1]
+                block_end += 1
+
+            spans = [records[idx]["offsets"][name] for idx in range(block_start, block_end)]
+            block = np.concatenate([segment[start:start + count] for start, count in spans]).astype(np.float32)
+            starts = np.cumsum([0] + [count for _, count in spans[:-1]])
+            similarities = block @ query.T
+            scores[block_start:block_end] = np.maximum.reduceat(similarities, starts, axis=0).sum(axis=1)
+            block_start = block_end
+        return scores
+
+
+class NumpyVectorStore:
+    """Embedded multivector store with the subset of the QdrantClient API used by qdrant_models.
+
+    Collections are directories under `path`; multivectors are kept in memory-mapped
+    float16 segment files and searched with exact, vectorized MaxSim. Meant for small
+    collections, CI and machines without a Qdrant server. Search params (HNSW,
+    quantization) do not apply and are ignored.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def _collection(self, collection_name):
+        with self.lock:
+            collection = self.collections.get(collection_name)
+            if collection is None:
+                if not (self.path / collection_name / COLLECTION_FILE).exists():
+                    raise ValueError(f"Collection {collection_name} not found")
+                collection = _Collection(self.path / collection_name)
+                self.collections[collection_name] = collection
+        collection.refresh()
+        return collection
+
+    def create_collection(self, collection_name, vectors_config, sparse_vectors_config=None, metadata=None, **kwargs):
+        collection_path = self.path / collection_name
+        if (collection_path / COLLECTION_FILE).exists():
+            raise ValueError(f"Collection {collection_name} already exists")
+        vectors = vectors_config if isinstance(vectors_config, dict) else {DEFAULT_VECTOR: vectors_config}
+
+        collection_path.mkdir(parents=True, exist_ok=True)
+        for name in vectors:
+            (collection_path / _vector_file(name)).touch()
+        with open(collection_path / COLLECTION_FILE, "w") as f:
+            json.dump({
+                "vectors": {name: params.size for name, params in vectors.items()},
+                "named": isinstance(vectors_config, dict),
+                "sparse": list(sparse_vectors_config or {}),
+                "metadata": metadata or {},
+            }, f)
+        return True
+
+    def delete_collection(self, collection_name, **kwargs):
+        with self.lock:
+            self.collections.pop(collection_name, None)
+        if not (self.path / collection_name / COLLECTION_FILE).exists():
+            return False
+        shutil.rmtree(self.path / collection_name)
+        return True
+
+    def get_collections(self):
+        return models.CollectionsResponse(collections=[
+            models.CollectionDescription(name=path.parent.name)
+            for path in sorted(self.path.glob(f"*/{COLLECTION_FILE}"))
+        ])
+
+    def collection_exists(self, collection_name):
+        return (self.path / collection_name / COLLECTION_FILE).exists()
+
+    def get_collection(self, collection_name):
+        # only the fields read by qdrant_models are filled in
+        collection = self._collection(collection_name)
+        vectors = {
+            name: models.VectorParams(
+                size=size,
+                distance=models.Distance.COSINE,
+                multivector_config=models.MultiVectorConfig(comparator=models.MultiVectorComparator.MAX_SIM),
+            )
+            for name, size in collection.dims.items()
+        }
+        return SimpleNamespace(
+            points_count=len(collection.points),
+            config=SimpleNamespace(
+                params=SimpleNamespace(
+                    vectors=vectors if collection.config["named"] else vectors[DEFAULT_VECTOR],
+                    sparse_vectors={name: models.SparseVectorParams(modifier=models.Modifier.IDF) for name in collection.sparse},
+                ),
+                metadata=collection.config["metadata"],
+            ),
+        )
+
+    def create_payload_index(self, collection_name, field_name, field_schema=None, **kwargs):
+        # filters are evaluated during the exact scan, so there is nothing to build
+        self._collection(collection_name)
+        return models.UpdateResult(operation_id=0, status=models.UpdateStatus.COMPLETED)
+
+    def count(self, collection_name, count_filter=None, **kwargs):
+        records = self._collection(collection_name).records()
+        return models.CountResult(count=sum(1 for record in records if matches_filter(record["payload"], count_filter)))
+
+    def upsert(self, collection_name, points, wait=True, **kwargs):
+        self._collection(collection_name).append(points)
+        return models.UpdateResult(operation_id=0, status=models.UpdateStatus.COMPLETED)
+
+    def delete(self, collection_name, points_selector, wait=True, **kwargs):
+        collection = self._collection(collection_name)
+        if isinstance(points_selector, models.FilterSelector):
+            ids = [record["id"] for record in collection.records() if matches_filter(record["payload"], points_selector.filter)]
+        elif isinstance(points_selector, models.PointIdsList):
+            ids = points_selector.points
+        else:
+            ids = points_selector
+        collection.delete(ids)
+        return models.UpdateResult(operation_id=0, status=models.UpdateStatus.COMPLETED)
+
+    def batch_update_points(self, collection_name, update_operations, wait=True, **kwargs):
+        # only payload updates (SetPayloadOperation with point ids) are supported
+        updates = []
+        for operation in update_operations:
+            if not isinstance(operation, models.SetPayloadOperation) or operation.set_payload.points is None:
+                raise ValueError(f"Unsupported update operation: {type(operation).__name__}")
+            updates.extend((point_id, operation.set_payload.payload) for point_id in operation.set_payload.points)
+        self._collection(collection_name).set_payload(updates)
+        return [models.UpdateResult(operation_id=0, status=models.UpdateStatus.COMPLETED) for _ in update_operations]
+
+    def scroll(self, collection_name, scroll_filter=None, limit=10, offset=None, with_payload=True, with_vectors=False,
+               **kwargs):
+        # pages in point id order, like Qdrant; returns (records, id to pass as the next offset)
+        collection = self._collection(collection_name)
+        records = sorted(
+            (record for record in collection.records() if matches_filter(record["payload"], scroll_filter)),
+            key=lambda record: str(record["id"]),
+        )
+        if offset is not None:
+            records = [record for record in records if str(record["id"]) >= str(offset)]
+        # vectors are ndarrays, so the records are built without validation
+        page = [
+            models.Record.model_construct(id=record["id"], payload=_select_payload(record["payload"], with_payload),
+                                          vector=collection.vectors(record) if with_vectors else None)
+            for record in records[:limit]
+        ]
+        next_offset = records[limit]["id"] if len(records) > limit else None
+        return page, next_offset
+
+    def retrieve(self, collection_name, ids, with_payload=True, with_vectors=False, **kwargs):
+        collection = self._collection(collection_name)
+        records = []
+        for point_id in ids:
+            record = collection.points.get(point_id)
+            if record is not None:
+                records.append(models.Record(id=point_id, payload=_select_payload(record["payload"], with_payload)))
+        return records
+
+    def query_points(self, collection_name, query, using=None, prefetch=None, query_filter=None, limit=10,
+                     with_payload=True, **kwargs):
+        collection = self._collection(collection_name)
+        points = [
+            models.ScoredPoint(id=record["id"], version=0, score=float(score),
+                               payload=_select_payload(record["payload"], with_payload))
+            for record, score in self._query(collection, collection.records(), query, using, prefetch, query_filter, limit)
+        ]
+        return QueryResponse(points=points)
+
+    def _query(self, collection, records, query, using, prefetch, query_filter, limit):
+        records = [record for record in records if matches_filter(record["payload"], query_filter)]
+
+        # prefetches (run first, possibly nested) narrow the candidates before the main query,
+        # or are merged by rank for a fusion query
+        if prefetch:
+            results = [
+                self._query(collection, records, sub_query.query, sub_query.using, sub_query.prefetch,
+                            sub_query.filter, sub_query.limit or 10)
+                for sub_query in (prefetch if isinstance(prefetch, list) else [prefetch])
+            ]
+            if isinstance(query, models.FusionQuery):
+                return _reciprocal_rank_fusion(results, limit)
+            candidates = {}
+            for result in results:
+                for record, _ in result:
+                    candidates[record["id"]] = record
+            records = list(candidates.values())
+
+        return self._score(collection, records, query, using, limit)
+
+    def query_batch_points(self, collection_name, requests, **kwargs):
+        return [
+            self.query_points(
+                collection_name,
+                query=request.query,
+                using=request.using,
+                prefetch=request.prefetch,
+                query_filter=request.filter,
+                limit=request.limit or 10,
+                with_payload=request.with_payload if request.with_payload is not None else True,
+            )
+            for request in requests
+        ]
+
+    def _score(self, collection, records, query, using, limit):
+        if not records:
+            return []
+        if isinstance(query, models.SparseVector):
+            scores = collection.sparse_scores(query, using, records)
+            # like Qdrant, points sharing no term with the query are not returned
+            matched = np.flatnonzero(scores > 0)
+            records, scores = [records[idx] for idx in matched], scores[matched]
+        else:
+            scores = collection.maxsim(query, using or DEFAULT_VECTOR, records)
+        top = np.argsort(-scores, kind="stable")[:limit]
+        return [(records[idx], scores[idx]) for idx in top]
+
+    def close(self, **kwargs):
+        pass
+
+
+class AsyncNumpyVectorStore:
+    """AsyncQdrantClient-style wrapper: every store method runs on a worker thread."""
+    def __init__(self, store):
+        self.store = store
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+
+def _matches_condition(payload, condition):
+    value = payload.get(condition.key)
+    if isinstance(value, list) and condition.match is not None:
+        # like Qdrant, a match on an array payload matches if any element does
+        return any(_matches_condition({condition.key: element}, condition) for element in value)
+    if condition.match is not None:
+        if isinstance(condition.match, models.MatchAny):
+            return value in condition.match.any
+        if isinstance(condition.match, models.MatchExcept):
+            return value not in condition.match.except_
+        return value == condition.match.value
+    if condition.range is not None:
+        if not isinstance(value, (int, float)):
+            return False
+        bounds = condition.range
+        return ((bounds.gt is None or value > bounds.gt) and (bounds.gte is None or value >= bounds.gte)
+                and (bounds.lt is None or value < bounds.lt) and (bounds.lte is None or value <= bounds.lte))
+    raise ValueError(f"Unsupported filter condition on {condition.key}")
+
+
+def matches_filter(payload, query_filter):
+    """Evaluate the must/should/must_not field conditions of a Qdrant filter on a payload."""
+    if query_filter is None:
+        return True
+
+    def check(condition):
+        if isinstance(condition, models.Filter):
+            return matches_filter(payload, condition)
+        return _matches_condition(payload, condition)
+
+    def as_list(conditions):
+        if conditions is None:
+            return []
+        return conditions if isinstance(conditions, list) else [conditions]
+
+    return (all(check(condition) for condition in as_list(query_filter.must))
+            and (not as_list(query_filter.should) or any(check(condition) for condition in as_list(query_filter.should)))
+            and not any(check(condition) for condition in as_list(query_filter.must_not)))
+
+
+def _reciprocal_rank_fusion(results, limit):
+    scores, records = {}, {}
+    for result in results:
+        for rank, (record, _) in enumerate(result):
+            scores[record["id"]] = scores.get(record["id"], 0.0) + 1.0 / (RRF_K + rank)
+            records[record["id"]] = record
+    ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [(records[point_id], scores[point_id]) for point_id in ranked]
+
+
+def _select_payload(payload, with_payload):
+    if with_payload is True:
+        return payload
+    if not with_payload:
+        return None
+    return {key: payload[key] for key in with_payload if key in payload}
@@ -0,0 +1,153 @@
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class Stage:
+    """One step of a pipeline: `func` maps an input item to an output item.
+
+    Returning None drops the item. Each stage runs `workers` threads and keeps its
+    own throughput counters.
+    """
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.items = 0
+        self.units = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self._active_workers = self.workers
+        self._lock = threading.Lock()
+
+    def record(self, units, seconds):
+        with self._lock:
+            self.items += 1
+            self.units += units
+            self.busy_seconds += seconds
+
+    def worker_done(self):
+        # returns True for the last worker of this stage to finish
+        with self._lock:
+            self._active_workers -= 1
+            if self._active_workers == 0:
+                self.finished = time.perf_counter()
+                return True
+            return False
+
+    def stats(self):
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = (self.finished or time.perf_counter()) - self.started
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "units": self.units,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "elapsed_seconds": round(elapsed, 3),
+            "units_per_second": round(self.units / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+def _run_stage(stage, in_queue, out_queue, next_workers, item_size, stop, errors, on_error):
+    while True:
+        item = in_queue.get()
+        if item is _DONE:
+            break
+        # keep draining after a failure so upstream puts never block forever
+        if stop.is_set():
+            continue
+
+        start = time.perf_counter()
+        try:
+            result = stage.func(item)
+        except Exception as e:
+            if on_error is not None:
+                # report the failed item and keep the pipeline running
+                on_error(stage.name, item, e)
+                continue
+            errors.append((stage.name, e))
+            stop.set()
+            continue
+        stage.record(item_size(item), time.perf_counter() - start)
+
+        if result is not None and out_queue is not None:
+            out_queue.put(result)
+
+    if stage.worker_done() and out_queue is not None:
+        for _ in range(next_workers):
+            out_queue.put(_DONE)
+
+
+def run_pipeline(source, stages, queue_size=4, item_size=None, on_error=None):
+    """Feed items from `source` through `stages`, each stage on its own worker threads.
+
+    Stages are connected by bounded queues of `queue_size` items, so the source is only
+    consumed as fast as the slowest stage drains it. Returns per-stage stats; the first
+    error raised by any stage stops the pipeline and is re-raised as a RuntimeError,
+    unless `on_error(stage_name, item, error)` is given, in which case the failed item
+    is handed to it and dropped.
+    """
+    if item_size is None:
+        item_size = lambda item: 1
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stop = threading.Event()
+    errors = []
+    threads = []
+
+    started = time.perf_counter()
+    for idx, stage in enumerate(stages):
+        stage.started = started
+        out_queue = queues[idx + 1] if idx + 1 < len(stages) else None
+        next_workers = stages[idx + 1].workers if idx + 1 < len(stages) else 0
+        for n in range(stage.workers):
+            thread = threading.Thread(
+                target=_run_stage,
+                args=(stage, queues[idx], out_queue, next_workers, item_size, stop, errors, on_error),
+                name=f"{stage.name}-{n}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+
+    try:
+        for item in source:
+            if stop.is_set():
+                break
+            queues[0].put(item)
+    except Exception as e:
+        errors.append(("source", e))
+        stop.set()
+    finally:
+        for _ in range(stages[0].workers):
+            queues[0].put(_DONE)
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - started
+    stats = {stage.name: stage.stats() for stage in stages}
+    stats["elapsed_seconds"] = round(elapsed, 3)
+
+    if errors:
+        stage_name, error = errors[0]
+        raise RuntimeError(f"Pipeline stage '{stage_name}' failed: {str(error)}") from error
+
+    return stats
+
+
+def format_pipeline_stats(stats):
+    lines = []
+    for name, stage_stats in stats.items():
+        if not isinstance(stage_stats, dict):
+            continue
+        lines.append(
+            f"{name}: {stage_stats['units']} in {stage_stats['elapsed_seconds']}s "
+            f"({stage_stats['units_per_second']}/s, {stage_stats['workers']} workers, "
+            f"busy {stage_stats['busy_seconds']}s)"
+        )
+    return "\n".join(lines)
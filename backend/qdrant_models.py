@@ -1,19 +1,90 @@
-from qdrant_client import QdrantClient, models
+from qdrant_client import QdrantClient, AsyncQdrantClient, models
+from qdrant_client.http.models import QueryResponse
+import math
+import asyncio
+import numpy as np
+from scipy.cluster.hierarchy import linkage, fcluster
 import stamina
 from tqdm import tqdm
-from helper_functions import image_to_base64, load_images, encode_images_base64
-from colpali_models import ColPaliClient
+from helper_functions import image_to_base64, load_images, encode_images_base64, read_image_bytes, read_resized_image_bytes, iter_batches, hash_file
+import base64
+import hashlib
+from colpali_models import get_colpali_client
 import uuid
+import threading
 from pathlib import Path
+from pipeline import Stage, run_pipeline, format_pipeline_stats
+from upsert_writer import AdaptiveUpsertWriter, estimate_point_bytes
+from text_index import TEXT_VECTOR, text_sparse_vector
+from numpy_store import is_numpy_store_uri, get_numpy_store, AsyncNumpyVectorStore
+
+# named vectors of collections created with pooled_vectors=True: the full ColPali
+# multivector is only used to rerank candidates found on the mean-pooled vectors
+ORIGINAL_VECTOR = "original"
+ROWS_VECTOR = "mean_pooling_rows"
+COLUMNS_VECTOR = "mean_pooling_columns"
+
+# ColPali (PaliGemma 448px) image embeddings start with a 32x32 grid of patch tokens
+IMAGE_PATCH_COUNT = 1024
+
+# collection metadata key holding the token pool factor used for its image multivectors
+POOL_FACTOR_METADATA_KEY = "token_pool_factor"
+
+# quantization profiles for create_qdrant_collection, with the oversampling used at
+# search time when none is given (coarser profiles need more candidates to rescore)
+QUANTIZATION_PROFILES = ("none", "scalar", "binary", "product")
+DEFAULT_OVERSAMPLING = {"none": None, "scalar": 1.0, "binary": 3.0, "product": 2.0}
+
+# payload fields indexed on every new collection, so filtered searches narrow the
+# candidates before scoring; more can be added per collection (see create_payload_indexes)
+DEFAULT_PAYLOAD_INDEXES = {
+    "ISBN": "keyword", "page_number": "integer", "subject": "keyword",
+    "document_ids": "keyword", "document_revisions": "keyword",
+}
+
+# document registry payload keys: the documents a page point belongs to, and per document
+# "<document id>:<revision>" of the upload that last indexed or confirmed it (see prune_document).
+# Point ids stay content addressed, so a page shared by several documents is one point.
+DOCUMENT_IDS_KEY = "document_ids"
+DOCUMENT_REVISIONS_KEY = "document_revisions"
+
+# search modes of search_qdrant, and how many candidates per requested result each list
+# contributes to reciprocal rank fusion in "hybrid" mode
+SEARCH_MODES = ("dense", "sparse", "hybrid", "sparse_prefilter")
+FUSION_CANDIDATES_PER_RESULT = 10
+
+
+class SearchRequestError(ValueError):
+    # a search the collection cannot serve as asked (e.g. it has no text vector); the API answers 400
+    pass
+
+# collection name -> {"pooled": stores the pooled named vectors, "pool_factor": token pool factor,
+#                     "search_params": SearchParams matching its quantization,
+#                     "oversampling": candidate multiplier for reranking its quantized vectors}
+_collection_layouts = {}
 
 def create_qdrant_client(qdrant_uri):
+    # numpy:// URIs select the embedded NumPy store, which implements the client calls used here
+    if is_numpy_store_uri(qdrant_uri):
+        return get_numpy_store(qdrant_uri)
     qdrant_client = QdrantClient(
         url=qdrant_uri
     )
     return qdrant_client
 
+def create_async_qdrant_client(qdrant_uri, prefer_grpc=False, grpc_port=6334):
+    # long-lived client for the backend's request path; owned by the app lifespan
+    if is_numpy_store_uri(qdrant_uri):
+        return AsyncNumpyVectorStore(get_numpy_store(qdrant_uri))
+    return AsyncQdrantClient(
+        url=qdrant_uri,
+        prefer_grpc=prefer_grpc,
+        grpc_port=grpc_port,
+    )
+
 def delete_qdrant_collection(qdrant_uri, collection_name):
    qdrant_client = create_qdrant_client(qdrant_uri)
+   _collection_layouts.pop(collection_name, None)
    return qdrant_client.delete_collection(collection_name=collection_name)
 
 
@@ -23,110 +94,714 @@ def list_qdrant_collections(qdrant_uri):
     return qdrant_client.get_collections()
 
 
-def create_qdrant_collection(qdrant_uri, collection_name, vector_size, indexing_threshold):
+def multivector_params(vector_size, hnsw_config=None, quantization_config=None, on_disk=None):
+    return models.VectorParams(
+        size=vector_size,
+        distance=models.Distance.COSINE,
+        multivector_config=models.MultiVectorConfig(
+            comparator=models.MultiVectorComparator.MAX_SIM
+        ),
+        hnsw_config=hnsw_config,
+        quantization_config=quantization_config,
+        on_disk=on_disk,
+    )
+
+
+def quantization_config_for(quantization):
+    # quantized vectors are always kept in RAM; the originals follow the collection's on_disk setting
+    if quantization == "none":
+        return None
+    if quantization == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True,
+            ),
+        )
+    if quantization == "binary":
+        return models.BinaryQuantization(
+            binary=models.BinaryQuantizationConfig(always_ram=True),
+        )
+    if quantization == "product":
+        return models.ProductQuantization(
+            product=models.ProductQuantizationConfig(
+                compression=models.CompressionRatio.X16,
+                always_ram=True,
+            ),
+        )
+    raise ValueError(f"Unsupported quantization profile: {quantization}")
+
+
+def create_payload_indexes(qdrant_client, collection_name, payload_indexes):
+    # payload_indexes: {field name: schema type}, e.g. {"ISBN": "keyword", "page_number": "integer"}
+    for field_name, field_schema in payload_indexes.items():
+        qdrant_client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=models.PayloadSchemaType(field_schema),
+            wait=True,
+        )
+    _collection_layouts.pop(collection_name, None)  # its indexed fields changed
+
+
+def create_qdrant_collection(qdrant_uri, collection_name, vector_size, indexing_threshold, pooled_vectors=True,
+                             pool_factor=1, quantization="scalar", on_disk=False, oversampling=None, rescore=True,
+                             payload_indexes=None, text_index=True):
+    # quantization: one of QUANTIZATION_PROFILES; on_disk keeps the original vectors
+    # memory-mapped on disk, so only the quantized copies need to fit in RAM.
+    # oversampling/rescore are stored in the collection metadata and applied by search_qdrant.
+    # payload_indexes adds indexed metadata fields to DEFAULT_PAYLOAD_INDEXES.
+    # text_index adds a sparse vector of the page text for lexical and hybrid search.
     try:
         qdrant_client = create_qdrant_client(qdrant_uri)
 
+        quantization_config = quantization_config_for(quantization)
+        if oversampling is None:
+            oversampling = DEFAULT_OVERSAMPLING[quantization]
+
+        if pooled_vectors:
+            # candidates are found with HNSW on the small row/column pooled multivectors and
+            # reranked with exact MaxSim on the original, so the original needs no HNSW graph
+            vectors_config = {
+                ORIGINAL_VECTOR: multivector_params(
+                    vector_size,
+                    hnsw_config=models.HnswConfigDiff(m=0),
+                    quantization_config=quantization_config,
+                    on_disk=on_disk,
+                ),
+                ROWS_VECTOR: multivector_params(vector_size),
+                COLUMNS_VECTOR: multivector_params(vector_size),
+            }
+        else:
+            vectors_config = multivector_params(vector_size, quantization_config=quantization_config, on_disk=on_disk)
+
         qdrant_client.create_collection(
             collection_name=collection_name,
             on_disk_payload=True,
             optimizers_config=models.OptimizersConfigDiff(
                 indexing_threshold=indexing_threshold
             ),
-            vectors_config=models.VectorParams(
-                size=vector_size,
-                distance=models.Distance.COSINE,
-                multivector_config=models.MultiVectorConfig(
-                    comparator=models.MultiVectorComparator.MAX_SIM
-                ),
-                quantization_config=models.ScalarQuantization(
-                    scalar=models.ScalarQuantizationConfig(
-                        type=models.ScalarType.INT8,
-                        quantile=0.99,
-                        always_ram=True,
-                    ),
-                ),
-            ),
+            vectors_config=vectors_config,
+            # IDF is computed by Qdrant, the stored values are BM25 term frequencies
+            sparse_vectors_config={TEXT_VECTOR: models.SparseVectorParams(modifier=models.Modifier.IDF)} if text_index else None,
+            # index_images_to_qdrant pools image tokens by this factor before upserting
+            metadata={
+                POOL_FACTOR_METADATA_KEY: pool_factor,
+                "quantization": quantization,
+                "oversampling": oversampling,
+                "rescore": rescore,
+            },
         )
+        _collection_layouts.pop(collection_name, None)
+        create_payload_indexes(qdrant_client, collection_name, {**DEFAULT_PAYLOAD_INDEXES, **(payload_indexes or {})})
 
         return True
     except Exception as e:
         print("Error creating collection in qdrant. {}".format(str(e)))
         raise False
-    
+
+
+def collection_layout_info(collection_info):
+    vectors = collection_info.config.params.vectors
+    metadata = collection_info.config.metadata or {}
+    return {
+        "pooled": isinstance(vectors, dict) and ORIGINAL_VECTOR in vectors,
+        "pool_factor": int(metadata.get(POOL_FACTOR_METADATA_KEY) or 1),
+        "search_params": quantization_search_params(metadata),
+        "oversampling": float(metadata.get("oversampling") or 1.0),
+        "sparse": TEXT_VECTOR in (getattr(collection_info.config.params, "sparse_vectors", None) or {}),
+        # None when the store filters on any field (the NumPy store scans every payload)
+        "indexed_fields": set(collection_info.payload_schema) if getattr(collection_info, "payload_schema", None) is not None else None,
+    }
+
+
+def quantization_search_params(metadata):
+    # collections without a recorded profile are searched with Qdrant's defaults
+    if metadata.get("quantization") in (None, "none"):
+        return None
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(
+            ignore=False,
+            rescore=metadata.get("rescore", True),
+            oversampling=metadata.get("oversampling"),
+        )
+    )
+
+
+def collection_layout(qdrant_client, collection_name):
+    if collection_name not in _collection_layouts:
+        _collection_layouts[collection_name] = collection_layout_info(qdrant_client.get_collection(collection_name))
+    return _collection_layouts[collection_name]
+
+
+async def collection_layout_async(qdrant_client, collection_name):
+    if collection_name not in _collection_layouts:
+        _collection_layouts[collection_name] = collection_layout_info(await qdrant_client.get_collection(collection_name))
+    return _collection_layouts[collection_name]
+
+
+def pool_image_embedding(embedding, patch_count=IMAGE_PATCH_COUNT):
+    """Mean-pool the patch grid of one image multivector by rows and by columns.
+
+    Returns (rows, columns); the non-patch tokens after the grid are appended to both
+    unchanged. Embeddings without a square patch grid are returned as-is.
+    """
+    embedding = np.asarray(embedding, dtype=np.float32)
+    grid_size = int(round(patch_count ** 0.5))
+    if grid_size * grid_size != patch_count or len(embedding) < patch_count:
+        return embedding, embedding
+
+    grid = embedding[:patch_count].reshape(grid_size, grid_size, -1)
+    extra = embedding[patch_count:]
+    rows = np.concatenate([grid.mean(axis=1), extra])
+    columns = np.concatenate([grid.mean(axis=0), extra])
+    return rows, columns
+
+
+def pool_tokens(embedding, pool_factor):
+    """Merge similar token vectors of one multivector, keeping about len / pool_factor of them.
+
+    Tokens are clustered hierarchically (Ward linkage on the normalized vectors) and each
+    cluster is replaced by its mean, so MaxSim still sees every region of the page.
+    """
+    embedding = np.asarray(embedding, dtype=np.float32)
+    n_clusters = max(len(embedding) // pool_factor, 1)
+    if pool_factor <= 1 or len(embedding) <= n_clusters:
+        return embedding
+
+    normalized = embedding / np.maximum(np.linalg.norm(embedding, axis=1, keepdims=True), 1e-12)
+    labels = fcluster(linkage(normalized, method="ward"), t=n_clusters, criterion="maxclust")
+
+    pooled = np.zeros((labels.max(), embedding.shape[1]), dtype=np.float32)
+    np.add.at(pooled, labels - 1, embedding)
+    pooled /= np.bincount(labels - 1)[:, None]
+    return pooled
+
 
 @stamina.retry(on=Exception, attempts=3)
-def upsert_to_qdrant(points, collection_name, qdrant_client):
-    try:
-        qdrant_client.upsert(
+def upsert_to_qdrant(points, collection_name, qdrant_client, wait=False):
+    # errors propagate so the retry applies; the UpdateResult carries the operation id
+    return qdrant_client.upsert(
+        collection_name=collection_name,
+        points=points,
+        wait=wait,
+    )
+
+
+def content_point_id(content_hash, config_key):
+    # deterministic point id: the same page content indexed with the same
+    # collection/model configuration always maps to the same point
+    digest = hashlib.sha256(f"{config_key}:{content_hash}".encode("utf-8")).hexdigest()
+    return str(uuid.UUID(digest[:32]))
+
+
+def point_config_key(collection_name, model_id, model_image_size, pool_factor):
+    # everything besides the page content that determines a point's vectors (see content_point_id)
+    image_size_key = "x".join(str(x) for x in model_image_size) if model_image_size else "full"
+    config_key = f"{collection_name}|{model_id}|{image_size_key}"
+    if pool_factor > 1:
+        config_key += f"|pool{pool_factor}"
+    return config_key
+
+
+def existing_points(qdrant_client, collection_name, point_ids, with_payload=False):
+    # {point id: payload (or {})} of the given ids that are already in the collection
+    records = qdrant_client.retrieve(
+        collection_name=collection_name,
+        ids=point_ids,
+        with_payload=with_payload,
+        with_vectors=False,
+    )
+    return {str(record.id): record.payload or {} for record in records}
+
+
+def existing_point_ids(qdrant_client, collection_name, point_ids):
+    return set(existing_points(qdrant_client, collection_name, point_ids))
+
+
+def document_revision_entry(document_id, revision):
+    return f"{document_id}:{revision}"
+
+
+def document_membership(payload, document_id, revision=None):
+    """Registry fields of a point's payload without `document_id`, or, given a revision,
+    with `document_id` registered at that revision."""
+    document_ids = [other for other in payload.get(DOCUMENT_IDS_KEY) or [] if other != document_id]
+    revisions = [entry for entry in payload.get(DOCUMENT_REVISIONS_KEY) or [] if entry.rsplit(":", 1)[0] != document_id]
+    if revision is not None:
+        document_ids.append(document_id)
+        revisions.append(document_revision_entry(document_id, revision))
+    return {DOCUMENT_IDS_KEY: document_ids, DOCUMENT_REVISIONS_KEY: revisions}
+
+
+def set_point_payloads(qdrant_client, collection_name, payloads):
+    # payloads: {point id: payload fields}; one batch request for all of them
+    if payloads:
+        qdrant_client.batch_update_points(
             collection_name=collection_name,
-            points=points,
-            wait=False,
+            update_operations=[
+                models.SetPayloadOperation(set_payload=models.SetPayload(payload=payload, points=[point_id]))
+                for point_id, payload in payloads.items()
+            ],
+            wait=True,
         )
-        return True
-    except Exception as e:
-        print(f"Error during upsert: {e}")
-        return False
 
 
-def index_images_to_qdrant(images_paths, batch_size, collection_name, qdrant_uri, colpali_url, starting_id=0):
-    global_id = starting_id
+def document_filter(document_id, exclude_revision=None):
+    document = models.FieldCondition(key=DOCUMENT_IDS_KEY, match=models.MatchValue(value=document_id))
+    if exclude_revision is None:
+        return models.Filter(must=[document])
+    revision = models.FieldCondition(
+        key=DOCUMENT_REVISIONS_KEY,
+        match=models.MatchValue(value=document_revision_entry(document_id, exclude_revision)),
+    )
+    return models.Filter(must=[document], must_not=[revision])
+
+
+def scroll_points(qdrant_client, collection_name, scroll_filter, with_payload, page_size=256):
+    records, offset = [], None
+    while True:
+        page, offset = qdrant_client.scroll(
+            collection_name=collection_name,
+            scroll_filter=scroll_filter,
+            limit=page_size,
+            offset=offset,
+            with_payload=with_payload,
+            with_vectors=False,
+        )
+        records.extend(page)
+        if offset is None:
+            return records
+
+
+def remove_from_document(qdrant_client, collection_name, document_id, point_filter):
+    """Take the points matching `point_filter` out of a document: points no other document
+    shares are deleted, shared ones only lose their membership. Returns the number of pages."""
+    records = scroll_points(qdrant_client, collection_name, point_filter, [DOCUMENT_IDS_KEY, DOCUMENT_REVISIONS_KEY])
+    unlinked, deleted = {}, []
+    for record in records:
+        membership = document_membership(record.payload or {}, document_id)
+        if membership[DOCUMENT_IDS_KEY]:
+            unlinked[record.id] = membership
+        else:
+            deleted.append(record.id)
+
+    set_point_payloads(qdrant_client, collection_name, unlinked)
+    if deleted:
+        qdrant_client.delete(collection_name=collection_name, points_selector=models.PointIdsList(points=deleted), wait=True)
+    return len(records)
+
 
+def document_pages(qdrant_client, collection_name, document_id, page_size=256):
+    """Registry view of a document: one entry per indexed page point, ordered by page number."""
+    records = scroll_points(qdrant_client, collection_name, document_filter(document_id),
+                            ["page_number", "content_hash", "image", DOCUMENT_IDS_KEY, DOCUMENT_REVISIONS_KEY], page_size)
+    pages = []
+    for record in records:
+        payload = dict(record.payload or {})
+        revisions = payload.pop(DOCUMENT_REVISIONS_KEY, None) or []
+        payload["revision"] = next(
+            (entry.rsplit(":", 1)[1] for entry in revisions if entry.rsplit(":", 1)[0] == document_id), None
+        )
+        payload["shared_with"] = [other for other in payload.pop(DOCUMENT_IDS_KEY, None) or [] if other != document_id]
+        pages.append({"point_id": str(record.id), **payload})
+    return sorted(pages, key=lambda page: (page.get("page_number") is None, page.get("page_number") or 0))
+
+
+def prune_document(qdrant_client, collection_name, document_id, revision):
+    """Remove the pages of a document that `revision` did not index or confirm (pages dropped
+    from a new edition, or replaced by changed content). Returns the number removed."""
+    return remove_from_document(qdrant_client, collection_name, document_id,
+                                document_filter(document_id, exclude_revision=revision))
+
+
+def delete_document(qdrant_uri, collection_name, document_id):
+    # removes every page of the document; returns the number removed
     qdrant_client = create_qdrant_client(qdrant_uri)
-    colpali_client = ColPaliClient(colpali_url)
-
-    with tqdm(total=len(images_paths), desc="Indexing Progress") as pbar:
-        for i in range(0, len(images_paths), batch_size):
-            print("Processing batch")
-
-            batch = images_paths[i : i + batch_size]
-            # batch_images = load_images(batch)
-            batch_images_encoded = encode_images_base64(batch)
-
-            # Retrieve Embeddings for the image using colpali model
-            embedding_results = colpali_client.get_embeddings(images_encoded=batch_images_encoded)
-            image_embeddings = embedding_results["image_embeddings"]
-
-            # prepare points for Qdrant
-            points = []
-            print("Creating points")
-            for j, embedding in enumerate(image_embeddings):
-                points.append(
-                    models.PointStruct(
-                        id= uuid.uuid4().hex,
-                        vector=embedding,
-                        payload={
-                            "image": Path(batch[j]).as_posix()
-                        },
-                    )
+    return remove_from_document(qdrant_client, collection_name, document_id, document_filter(document_id))
+
+
+def index_images_to_qdrant(images_paths, batch_size, collection_name, qdrant_uri, colpali_url, starting_id=0, total=None,
+                           load_workers=2, embed_workers=2, upsert_workers=2, queue_size=4, upload_format="multipart",
+                           model_image_size="auto", deduplicate=True, progress_callback=None, error_callback=None,
+                           payload_fn=None, pool_factor="auto", pool_workers=2, text_fn=None,
+                           upsert_batch_bytes=8 * 1024 * 1024, document_id=None, document_revision=None):
+    # images_paths may be any iterable (e.g. the save_pdf_pages generator), so pages
+    # are embedded as they are produced instead of after the whole document is on disk.
+    # Loading/encoding, ColPali embedding and Qdrant upserts run as separate stages
+    # connected by bounded queues, so the embedding server is kept busy while files
+    # are read and points are written.
+    # Point ids are derived from the page content, and with deduplicate=True pages
+    # whose id already exists in the collection (or earlier in this run) are skipped
+    # before they reach the embedding server.
+    # progress_callback(paths) is called for every batch that is upserted or skipped as
+    # already indexed; with error_callback(stage_name, paths, error) failed batches are
+    # reported and the remaining batches still run, otherwise the first failure aborts.
+    # payload_fn(path), if given, returns extra payload fields (e.g. ISBN, page_number).
+    # pool_factor > 1 merges similar patch tokens (see pool_tokens) in a separate stage
+    # before upserting; "auto" uses the factor recorded in the collection metadata.
+    # text_fn(path), if given, returns the page text (e.g. the PDF text layer), which is
+    # stored as a sparse vector in collections with a text index.
+    # Points are written by an AdaptiveUpsertWriter: upserts of about upsert_batch_bytes
+    # (adapted to observed latency), with at most upsert_workers requests in flight; a batch
+    # only counts as done (progress_callback) once Qdrant has acknowledged it, and the final
+    # write waits for completion.
+    # document_id registers the pages under a document at document_revision: pages that are
+    # already indexed are not embedded again but are added to the document (and, unless
+    # another document shares them, get their image/page payload refreshed), so an edition
+    # re-uploaded as a new revision can then be pruned of the pages it no longer has
+    # (prune_document).
+    if total is None and hasattr(images_paths, "__len__"):
+        total = len(images_paths)
+
+    qdrant_client = create_qdrant_client(qdrant_uri)
+    colpali_client = get_colpali_client(colpali_url)
+    progress_lock = threading.Lock()
+    layout = collection_layout(qdrant_client, collection_name)
+    if pool_factor == "auto":
+        pool_factor = layout["pool_factor"]
+
+    # model_image_size: "auto" asks the ColPali server for its processor input size,
+    # a (width, height) tuple sets it explicitly, None sends the full-resolution files.
+    # Only the downscaled derivative is embedded; the payload keeps the original path.
+    processor_config = colpali_client.get_processor_config() or {}
+    if model_image_size == "auto":
+        model_image_size = colpali_client.get_model_image_size()
+    if model_image_size:
+        print(f"Downscaling images to {model_image_size[0]}x{model_image_size[1]} before embedding")
+
+    config_key = point_config_key(collection_name, processor_config.get("model_id", ""), model_image_size, pool_factor)
+    seen_ids = set()
+    skipped = [0]
+    failed = [0]
+
+    def page_payload(path):
+        payload = {"image": Path(path).as_posix()}
+        if document_id is not None:
+            payload.update(document_membership({}, document_id, document_revision))
+        if payload_fn is not None:
+            payload.update(payload_fn(path) or {})
+        return payload
+
+    def load_batch(batch):
+        content_hashes = [hash_file(path) for path in batch]
+        point_ids = [content_point_id(content_hash, config_key) for content_hash in content_hashes]
+
+        if deduplicate:
+            existing = existing_points(qdrant_client, collection_name, point_ids,
+                                       with_payload=[DOCUMENT_IDS_KEY, DOCUMENT_REVISIONS_KEY] if document_id else False)
+            keep, refresh = [], {}
+            with progress_lock:
+                for idx, point_id in enumerate(point_ids):
+                    if point_id not in seen_ids:
+                        seen_ids.add(point_id)
+                        if point_id not in existing:
+                            keep.append(idx)
+                        elif document_id is not None:
+                            membership = document_membership(existing[point_id], document_id, document_revision)
+                            if membership[DOCUMENT_IDS_KEY] == [document_id]:
+                                refresh[point_id] = {**page_payload(batch[idx]), **membership}
+                            else:
+                                refresh[point_id] = membership
+                skipped[0] += len(batch) - len(keep)
+                pbar.update(len(batch) - len(keep))
+            # pages already indexed: only the registry (and page payload) is updated
+            set_point_payloads(qdrant_client, collection_name, refresh)
+            if progress_callback is not None and len(keep) < len(batch):
+                progress_callback([path for idx, path in enumerate(batch) if idx not in keep])
+            if not keep:
+                return None
+            batch = [batch[idx] for idx in keep]
+            content_hashes = [content_hashes[idx] for idx in keep]
+            point_ids = [point_ids[idx] for idx in keep]
+
+        item = {"paths": batch, "ids": point_ids, "hashes": content_hashes}
+        if text_fn is not None and layout["sparse"]:
+            item["texts"] = [text_fn(path) for path in batch]
+        if model_image_size:
+            images = read_resized_image_bytes(batch, tuple(model_image_size))
+        else:
+            images = read_image_bytes(batch)
+
+        # "multipart" ships raw image bytes, "base64" the original JSON payload
+        if upload_format == "multipart":
+            item["images"] = images
+        else:
+            item["images_encoded"] = [base64.b64encode(image).decode('utf-8') for image in images]
+        return item
+
+    def embed_batch(item):
+        # Retrieve Embeddings for the image using colpali model
+        if "images" in item:
+            names = [Path(path).name for path in item["paths"]]
+            embedding_results = colpali_client.get_image_embeddings(item.pop("images"), names=names)
+        else:
+            embedding_results = colpali_client.get_embeddings(images_encoded=item.pop("images_encoded"))
+        item["embeddings"] = embedding_results["image_embeddings"]
+        return item
+
+    def build_vector(embedding):
+        # the pooled row/column vectors need the full patch grid, so they are taken
+        # before the tokens of the original vector are merged
+        if layout["pooled"]:
+            rows, columns = pool_image_embedding(embedding)
+            return {ORIGINAL_VECTOR: pool_tokens(embedding, pool_factor), ROWS_VECTOR: rows, COLUMNS_VECTOR: columns}
+        return pool_tokens(embedding, pool_factor)
+
+    def pool_batch(item):
+        item["vectors"] = [build_vector(embedding) for embedding in item.pop("embeddings")]
+        return item
+
+    def upsert_batch(item):
+        # prepare points for Qdrant
+        points = []
+        size = 0
+        vectors = item["vectors"] if "vectors" in item else [build_vector(embedding) for embedding in item["embeddings"]]
+        texts = item.get("texts") or [None] * len(vectors)
+        for path, point_id, content_hash, vector, text in zip(item["paths"], item["ids"], item["hashes"], vectors, texts):
+            if text and text.strip():
+                # pages without a text layer simply have no sparse vector
+                vector = dict(vector) if isinstance(vector, dict) else {"": vector}
+                vector[TEXT_VECTOR] = text_sparse_vector(text)
+            payload = {
+                "content_hash": content_hash,
+                "pool_factor": pool_factor,
+                **page_payload(path),
+            }
+            # PointStruct validation turns the ndarrays into nested lists, and REST upserts
+            # send them as JSON floats: the binary embedding response only saves the JSON
+            # parse on the way in. Sized from the arrays, before that conversion.
+            size += estimate_point_bytes(vector, payload)
+            points.append(
+                models.PointStruct(
+                    id=point_id,
+                    vector=vector,
+                    payload=payload,
                 )
-                global_id += 1
-
-            try:
-                upsert_to_qdrant(points, collection_name, qdrant_client)
-                print("Upsert done for batch")
-            except Exception as e:
-                print(f"Error during upsert: {e}")
-                continue
-            pbar.update(batch_size)
+            )
+
+        def on_done():
+            with progress_lock:
+                pbar.update(len(points))
+            if progress_callback is not None:
+                progress_callback(item["paths"])
+
+        writer.add(points, on_done=on_done, item=item, size=size)
+
+    def batch_size_of(item):
+        return len(item["paths"]) if isinstance(item, dict) else len(item)
+
+    def on_error(stage_name, item, error):
+        paths = item["paths"] if isinstance(item, dict) else item
+        print(f"Error in {stage_name} stage for batch of {len(paths)} images: {error}")
+        with progress_lock:
+            failed[0] += len(paths)
+        error_callback(stage_name, paths, error)
+
+    stages = [
+        Stage("load", load_batch, workers=load_workers),
+        Stage("embed", embed_batch, workers=embed_workers),
+        # builds the points; the writer below does the concurrent upserts
+        Stage("upsert", upsert_batch, workers=1),
+    ]
+    if pool_factor > 1:
+        # clustering is CPU-bound, keep it off the upsert threads
+        stages.insert(2, Stage("pool", pool_batch, workers=pool_workers))
+
+    writer = AdaptiveUpsertWriter(
+        lambda points, wait: upsert_to_qdrant(points, collection_name, qdrant_client, wait=wait),
+        batch_bytes=upsert_batch_bytes,
+        max_in_flight=upsert_workers,
+        on_error=(lambda item, error: on_error("upsert", item, error)) if error_callback is not None else None,
+    )
+
+    with tqdm(total=total, desc="Indexing Progress") as pbar:
+        try:
+            stats = run_pipeline(
+                iter_batches(images_paths, batch_size),
+                stages,
+                queue_size=queue_size,
+                item_size=batch_size_of,
+                on_error=on_error if error_callback is not None else None,
+            )
+        finally:
+            # flushes the remaining points and waits until the last write is applied
+            writer_stats = writer.close()
+
+    stats["points"] = writer_stats["points"]
+    stats["skipped_duplicates"] = skipped[0]
+    stats["failed"] = failed[0]
+    stats["pool_factor"] = pool_factor
     print("Indexing complete!")
+    print(format_pipeline_stats(stats))
+    print(
+        f"writes: {writer_stats['points']} points in {writer_stats['batches']} upserts "
+        f"({writer_stats['splits']} splits, final batch size {writer_stats['batch_bytes'] // 1024} KiB)"
+    )
+    stats["upsert_writer"] = writer_stats
+    return stats
+
+
+def embed_query(colpali_client, user_query, query_cache=None):
+    # repeat queries are served from the cache without touching the GPU
+    if query_cache is not None:
+        model_id = colpali_client.get_model_id()
+        cached = query_cache.get(user_query, model_id)
+        if cached is not None:
+            return cached
+
+    # Retrieve Embeddings for the query using colpali model
+    embedding_results = colpali_client.get_embeddings(queries=[user_query])
+    query_embedding = embedding_results["query_embeddings"][0]
+
+    if query_cache is not None:
+        query_embedding = query_cache.put(user_query, model_id, query_embedding)
+    return query_embedding
+
+
+def embed_queries(colpali_client, user_queries, query_cache=None):
+    """Embed several queries with one ColPali call; cached and repeated queries are not re-sent."""
+    embeddings = {}
+    if query_cache is not None:
+        model_id = colpali_client.get_model_id()
+        for user_query in user_queries:
+            cached = query_cache.get(user_query, model_id)
+            if cached is not None:
+                embeddings[user_query] = cached
+
+    missing = list(dict.fromkeys(user_query for user_query in user_queries if user_query not in embeddings))
+    if missing:
+        embedding_results = colpali_client.get_embeddings(queries=missing)
+        for user_query, query_embedding in zip(missing, embedding_results["query_embeddings"]):
+            if query_cache is not None:
+                query_embedding = query_cache.put(user_query, model_id, query_embedding)
+            embeddings[user_query] = query_embedding
+
+    return [embeddings[user_query] for user_query in user_queries]
+
+
+def build_payload_filter(filters):
+    """Build a Qdrant filter from {field: value}; a list matches any of its values and a
+    dict with gt/gte/lt/lte is a range. Returns None for no filters."""
+    if not filters:
+        return None
+    conditions = []
+    for key, value in filters.items():
+        if isinstance(value, dict):
+            conditions.append(models.FieldCondition(key=key, range=models.Range(**value)))
+        elif isinstance(value, (list, tuple)):
+            conditions.append(models.FieldCondition(key=key, match=models.MatchAny(any=list(value))))
+        else:
+            conditions.append(models.FieldCondition(key=key, match=models.MatchValue(value=value)))
+    return models.Filter(must=conditions)
 
 
-def search_qdrant(collection_name, user_query, qdrant_uri, colpali_url, top_k=3):
+def dense_search(query_embedding, limit, layout, prefetch_oversampling=100, query_filter=None, prefetch_limit=None):
+    # keyword arguments of the ColPali multivector search, usable as a query or a Prefetch
+    search = dict(query=query_embedding, limit=limit, filter=query_filter, params=layout.get("search_params"))
+    if layout.get("pooled"):
+        # two-stage: limit * prefetch_oversampling candidates (or prefetch_limit) from each
+        # pooled vector, reranked with exact MaxSim on the original multivector. The quantized
+        # original only reranks this fixed list, so Qdrant's own oversampling has nothing to
+        # widen: the collection's oversampling is applied to the candidate lists instead
+        prefetch_limit = math.ceil((prefetch_limit or limit * prefetch_oversampling) * layout.get("oversampling", 1.0))
+        search["prefetch"] = [
+            models.Prefetch(query=query_embedding, using=ROWS_VECTOR, limit=prefetch_limit, filter=query_filter),
+            models.Prefetch(query=query_embedding, using=COLUMNS_VECTOR, limit=prefetch_limit, filter=query_filter),
+        ]
+        search["using"] = ORIGINAL_VECTOR
+    return search
+
+
+def check_search_request(collection_name, layout, mode="dense", query_filter=None):
+    # raises SearchRequestError for a search the collection cannot serve, before anything is embedded
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unsupported search mode: {mode}")
+    if mode != "dense" and not layout.get("sparse"):
+        raise SearchRequestError(f"Collection {collection_name} has no '{TEXT_VECTOR}' sparse vector for {mode} search")
+    indexed_fields = layout.get("indexed_fields")
+    if query_filter is not None and indexed_fields is not None:
+        missing = sorted({condition.key for condition in query_filter.must or []} - indexed_fields)
+        if missing:
+            raise SearchRequestError(f"Collection {collection_name} has no payload index for: {', '.join(missing)}")
+
+
+def build_search_request(collection_name, query_embedding, top_k, layout=None, prefetch_oversampling=100,
+                         query_filter=None, mode="dense", query_text=None):
+    # Perform the query on Qdrant, searching for the most similar points (multivector query)
+    # mode: "dense" (ColPali only), "sparse" (page text only, no embedding needed),
+    # "hybrid" (both lists fused with reciprocal rank fusion) or "sparse_prefilter"
+    # (text matches reranked with ColPali MaxSim)
+    layout = layout or {}
+    check_search_request(collection_name, layout, mode, query_filter)
+
+    sparse = dict(query=text_sparse_vector(query_text, query=True), using=TEXT_VECTOR, filter=query_filter)
+    candidates = top_k * prefetch_oversampling
+    if mode == "dense":
+        search = dense_search(query_embedding, top_k, layout, prefetch_oversampling, query_filter)
+    elif mode == "sparse":
+        search = dict(sparse, limit=top_k)
+    elif mode == "sparse_prefilter":
+        search = dict(
+            query=query_embedding,
+            using=ORIGINAL_VECTOR if layout.get("pooled") else None,
+            # the text matches are reranked on the (quantized) original vectors, as in dense_search
+            prefetch=[models.Prefetch(limit=math.ceil(candidates * layout.get("oversampling", 1.0)), **sparse)],
+            limit=top_k,
+            filter=query_filter,
+            params=layout.get("search_params"),
+        )
+    else:
+        # the pooled stage is sized as in dense mode; only the reranked list that enters
+        # the fusion is widened to fusion_candidates
+        fusion_candidates = top_k * FUSION_CANDIDATES_PER_RESULT
+        dense = dense_search(query_embedding, fusion_candidates, layout, query_filter=query_filter,
+                             prefetch_limit=max(candidates, fusion_candidates))
+        search = dict(
+            query=models.FusionQuery(fusion=models.Fusion.RRF),
+            prefetch=[
+                models.Prefetch(**dense),
+                models.Prefetch(limit=fusion_candidates, **sparse),
+            ],
+            limit=top_k,
+        )
+
+    request = dict(
+        collection_name=collection_name,
+        with_payload=["image","ISBN","page_number","subject"],
+        query_filter=search.pop("filter", None),
+        search_params=search.pop("params", None),
+        **search,
+    )
+    return request
+
+
+def build_query_request(collection_name, query_embedding, top_k, layout=None, prefetch_oversampling=100,
+                        query_filter=None, mode="dense", query_text=None):
+    # the same search as build_search_request, as one entry of a query_batch_points call
+    if query_embedding is not None:
+        query_embedding = np.asarray(query_embedding).tolist()
+    request = build_search_request(collection_name, query_embedding, top_k, layout,
+                                   prefetch_oversampling, query_filter, mode, query_text)
+    request.pop("collection_name")
+    request["filter"] = request.pop("query_filter")
+    request["params"] = request.pop("search_params")
+    return models.QueryRequest(**request)
+
+
+def search_qdrant(collection_name, user_query, qdrant_uri, colpali_url, top_k=3, query_cache=None, prefetch_oversampling=100,
+                  query_filter=None, mode="dense"):
     try:
         qdrant_client = create_qdrant_client(qdrant_uri)
-        colpali_client = ColPaliClient(colpali_url)
-
-        # Retrieve Embeddings for the image using colpali model
-        embedding_results = colpali_client.get_embeddings(queries=[user_query])
-        query_embeddings = embedding_results["query_embeddings"]
+        colpali_client = get_colpali_client(colpali_url)
 
-        # Perform the query on Qdrant, searching for the most similar points (multivector query)
+        # text-only searches never touch the embedding server
+        query_embedding = embed_query(colpali_client, user_query, query_cache) if mode != "sparse" else None
+        layout = collection_layout(qdrant_client, collection_name)
         search_result = qdrant_client.query_points(
-            collection_name=collection_name, 
-            query=query_embeddings[0], 
-            with_payload=["image","ISBN","page_number"],
-            limit=top_k
+            **build_search_request(collection_name, query_embedding, top_k, layout, prefetch_oversampling, query_filter,
+                                   mode, user_query)
         )
         
         return search_result
@@ -134,3 +809,108 @@ def search_qdrant(collection_name, user_query, qdrant_uri, colpali_url, top_k=3)
     except Exception as e:
         raise RuntimeError(f"Error during Qdrant search: {str(e)}")
 
+
+async def search_qdrant_async(collection_name, user_query, qdrant_client, colpali_client, top_k=3, query_cache=None,
+                              prefetch_oversampling=100, query_filter=None, mode="dense"):
+    """Non-blocking search_qdrant for the backend event loop, using long-lived clients.
+
+    The query embedding runs on a worker thread through the pooled ColPaliClient, and the
+    Qdrant query goes through an AsyncQdrantClient.
+    """
+    try:
+        layout = await collection_layout_async(qdrant_client, collection_name)
+        check_search_request(collection_name, layout, mode, query_filter)
+        query_embedding = None
+        if mode != "sparse":
+            query_embedding = await asyncio.to_thread(embed_query, colpali_client, user_query, query_cache)
+        return await qdrant_client.query_points(
+            **build_search_request(collection_name, query_embedding, top_k, layout, prefetch_oversampling, query_filter,
+                                   mode, user_query)
+        )
+
+    except SearchRequestError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Error during Qdrant search: {str(e)}")
+
+
+async def search_collections_async(collection_names, user_query, qdrant_client, colpali_client, top_k=3, query_cache=None,
+                                  prefetch_oversampling=100, query_filter=None, mode="dense", timeout=None):
+    """Search several collections (or aliases) concurrently with one query embedding.
+
+    Each collection returns its own top_k, and the results are merged into a global top_k
+    by score, with the source collection added to each point's payload. A collection that
+    fails or takes longer than `timeout` seconds is left out. Returns the merged
+    QueryResponse and {collection: "ok" | "timeout" | error message}.
+    """
+    query_embedding = None
+    if mode != "sparse":
+        try:
+            query_embedding = await asyncio.to_thread(embed_query, colpali_client, user_query, query_cache)
+        except Exception as e:
+            raise RuntimeError(f"Error during Qdrant search: {str(e)}")
+
+    async def search_collection(collection_name):
+        layout = await collection_layout_async(qdrant_client, collection_name)
+        return await qdrant_client.query_points(
+            **build_search_request(collection_name, query_embedding, top_k, layout, prefetch_oversampling, query_filter,
+                                   mode, user_query)
+        )
+
+    results = await asyncio.gather(
+        *(asyncio.wait_for(search_collection(name), timeout) for name in collection_names),
+        return_exceptions=True,
+    )
+
+    points, statuses = [], {}
+    for collection_name, result in zip(collection_names, results):
+        if isinstance(result, asyncio.TimeoutError):
+            statuses[collection_name] = "timeout"
+        elif isinstance(result, Exception):
+            statuses[collection_name] = f"error: {str(result)}"
+        else:
+            statuses[collection_name] = "ok"
+            for point in result.points:
+                point.payload = {**(point.payload or {}), "collection": collection_name}
+                points.append(point)
+
+    if not any(status == "ok" for status in statuses.values()):
+        request_errors = [result for result in results if isinstance(result, SearchRequestError)]
+        if len(request_errors) == len(results):
+            # no collection can serve this search at all, rather than a failure of each
+            raise request_errors[0]
+        raise RuntimeError(f"Error during Qdrant search: no collection answered ({statuses})")
+
+    # MaxSim (and fused) scores of the same query are comparable across collections
+    points.sort(key=lambda point: point.score, reverse=True)
+    return QueryResponse(points=points[:top_k]), statuses
+
+
+async def search_qdrant_batch_async(collection_name, queries, qdrant_client, colpali_client, query_cache=None,
+                                    prefetch_oversampling=100):
+    """Search many queries at once: one ColPali call for all embeddings, one Qdrant batch query.
+
+    `queries` is a list of dicts with "user_query" and optional "top_k" (default 3),
+    "query_filter" and "mode" (default "dense"). Returns one QueryResponse per query, in order.
+    """
+    try:
+        layout = await collection_layout_async(qdrant_client, collection_name)
+        for query in queries:
+            check_search_request(collection_name, layout, query.get("mode", "dense"), query.get("query_filter"))
+
+        dense_queries = [query["user_query"] for query in queries if query.get("mode", "dense") != "sparse"]
+        embeddings = await asyncio.to_thread(embed_queries, colpali_client, dense_queries, query_cache) if dense_queries else []
+        query_embeddings = dict(zip(dense_queries, embeddings))
+
+        requests = [
+            build_query_request(collection_name, query_embeddings.get(query["user_query"]), query.get("top_k", 3), layout,
+                                prefetch_oversampling, query.get("query_filter"), query.get("mode", "dense"),
+                                query["user_query"])
+            for query in queries
+        ]
+        return await qdrant_client.query_batch_points(collection_name=collection_name, requests=requests)
+
+    except SearchRequestError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Error during Qdrant batch search: {str(e)}")
@@ -0,0 +1,152 @@
+import io
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import closing
+
+import numpy as np
+
+
+def normalize_query(query):
+    # only normalizations that do not change what the model sees (ColPali is case sensitive)
+    return " ".join(unicodedata.normalize("NFC", query).split())
+
+
+class QueryEmbeddingCache:
+    """In-process LRU/TTL cache of query multivectors, keyed by normalized query and model id.
+
+    The in-memory tier is bounded by `max_bytes` of embedding data. With `disk_path` set,
+    entries are also written to a SQLite file that several backend workers can share, so
+    a query embedded by one worker is a hit for the others. Expired and surplus rows are
+    pruned every `disk_prune_interval` writes rather than on each one.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl_seconds=3600, disk_path=None, disk_max_entries=100000,
+                 disk_prune_interval=256):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self.disk_max_entries = disk_max_entries
+        self.disk_prune_interval = disk_prune_interval
+        self.disk_writes = 0
+        self.entries = OrderedDict()  # key -> (created_at, embedding)
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if self.disk_path:
+            with self._connect() as conn, conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings "
+                    "(key TEXT PRIMARY KEY, created_at REAL NOT NULL, embedding BLOB NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS query_embeddings_created_at ON query_embeddings (created_at)")
+
+    def _connect(self):
+        # closed on exit; `with conn` inside commits the transaction
+        return closing(sqlite3.connect(self.disk_path, timeout=5))
+
+    def key(self, query, model_id):
+        return hashlib.sha256(f"{model_id}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at):
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def _store(self, key, created_at, embedding):
+        # caller holds the lock
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1].nbytes
+        self.entries[key] = (created_at, embedding)
+        self.bytes += embedding.nbytes
+        while self.bytes > self.max_bytes and self.entries:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+
+    def _disk_get(self, key):
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT created_at, embedding FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Query cache disk read failed: {e}")
+            return None
+        if row is None or self._expired(row[0]):
+            return None
+        return row[0], np.load(io.BytesIO(row[1]), allow_pickle=False)
+
+    def _disk_put(self, key, created_at, embedding):
+        buffer = io.BytesIO()
+        np.save(buffer, embedding, allow_pickle=False)
+        with self.lock:
+            self.disk_writes += 1
+            prune = self.disk_writes % self.disk_prune_interval == 0
+        try:
+            with self._connect() as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, created_at, embedding) VALUES (?, ?, ?)",
+                    (key, created_at, buffer.getvalue()),
+                )
+                if not prune:
+                    return
+                # drop expired rows and keep the table bounded
+                if self.ttl_seconds is not None:
+                    conn.execute("DELETE FROM query_embeddings WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+                conn.execute(
+                    "DELETE FROM query_embeddings WHERE key IN (SELECT key FROM query_embeddings "
+                    "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_max_entries,),
+                )
+        except sqlite3.Error as e:
+            print(f"Query cache disk write failed: {e}")
+
+    def get(self, query, model_id):
+        key = self.key(query, model_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self.bytes -= self.entries.pop(key)[1].nbytes
+
+        if self.disk_path:
+            entry = self._disk_get(key)
+            if entry is not None:
+                with self.lock:
+                    self._store(key, *entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return entry[1]
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, query, model_id, embedding):
+        key = self.key(query, model_id)
+        embedding = np.array(embedding)
+        embedding.setflags(write=False)
+        created_at = time.time()
+        with self.lock:
+            self._store(key, created_at, embedding)
+        if self.disk_path:
+            self._disk_put(key, created_at, embedding)
+        return embedding
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,112 @@
+"""Shared fixtures: page images, a stub ColPali client and an indexed numpy:// collection.
+
+The stub embeds every image as a few random unit vectors seeded by the image bytes. A query
+registered in `queries` is embedded like the image it maps to, so a dense search for it
+ranks that page first.
+"""
+import os
+import sys
+import hashlib
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# the backend modules import each other as top-level modules (run from backend/)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# app.py creates its upload directories on import
+os.environ.setdefault("BASE_UPLOAD_DIR", tempfile.mkdtemp(prefix="backend-tests-"))
+
+import qdrant_models  # noqa: E402
+from qdrant_models import create_qdrant_collection, index_images_to_qdrant  # noqa: E402
+
+VECTOR_SIZE = 16
+TOKENS = 6
+TEXTS = {
+    0: "Newton's second law relates force and acceleration",
+    1: "The Schrodinger equation describes quantum states",
+    2: "Entropy and the second law of thermodynamics",
+    3: "Maxwell equations unify electricity and magnetism",
+}
+
+
+def stub_embedding(data):
+    rng = np.random.default_rng(int.from_bytes(hashlib.sha256(data).digest()[:8], "little"))
+    vectors = rng.normal(size=(TOKENS, VECTOR_SIZE)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class StubColPaliClient:
+    def __init__(self):
+        self.images_embedded = 0
+        self.queries = {}  # query text -> image path
+
+    def get_processor_config(self):
+        return {"model_id": "stub"}
+
+    def get_model_id(self):
+        return "stub"
+
+    def get_model_image_size(self):
+        return None
+
+    def get_image_embeddings(self, images, names=None):
+        self.images_embedded += len(images)
+        return {"image_embeddings": [stub_embedding(image) for image in images]}
+
+    def get_embeddings(self, images_encoded=None, queries=None):
+        embeddings = []
+        for query in queries:
+            with open(self.queries[query], "rb") as f:
+                embeddings.append(stub_embedding(f.read()))
+        return {"query_embeddings": embeddings}
+
+
+@pytest.fixture
+def colpali(monkeypatch):
+    client = StubColPaliClient()
+    monkeypatch.setattr(qdrant_models, "get_colpali_client", lambda url: client)
+    return client
+
+
+@pytest.fixture
+def pages(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = []
+    for idx in range(len(TEXTS)):
+        path = tmp_path / f"book_page_{idx}.png"
+        Image.fromarray(rng.integers(0, 255, size=(8, 8, 3), dtype=np.uint8)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def collection(tmp_path, colpali, pages):
+    qdrant_uri = f"numpy://{tmp_path / 'store'}"
+    create_qdrant_collection(qdrant_uri, "books", VECTOR_SIZE, 100)
+    isbns = {path: ("111" if idx < 2 else "222") for idx, path in enumerate(pages)}
+    index_images_to_qdrant(
+        pages, batch_size=2, collection_name="books", qdrant_uri=qdrant_uri, colpali_url="stub",
+        payload_fn=lambda path: {"ISBN": isbns[path], "page_number": pages.index(path)},
+        text_fn=lambda path: TEXTS[pages.index(path)],
+    )
+    return qdrant_uri
+
+
+@pytest.fixture
+def backend(monkeypatch, colpali, collection):
+    """TestClient of the backend app, searching and indexing the `collection` fixture."""
+    from fastapi.testclient import TestClient
+    import app as backend_app
+
+    monkeypatch.setattr(backend_app, "QDRANT_URI", collection)
+    monkeypatch.setattr(backend_app, "COLPALI_URI", "stub")
+    monkeypatch.setattr(backend_app, "QDRANT_COLLECTION_NAME", "books")
+    monkeypatch.setattr(backend_app, "get_colpali_client", lambda url: colpali)
+    monkeypatch.setitem(backend_app.job_manager.index_kwargs, "qdrant_uri", collection)
+    monkeypatch.setitem(backend_app.job_manager.index_kwargs, "collection_name", "books")
+    monkeypatch.setitem(backend_app.job_manager.index_kwargs, "colpali_url", "stub")
+    with TestClient(backend_app.app) as client:
+        yield client
@@ -0,0 +1,17 @@
+from bulk_index import iter_rendered_pages
+
+
+class NoPool:
+    def submit(self, *args, **kwargs):
+        raise AssertionError("image rows must not go through the render pool")
+
+
+def test_image_rows_are_passed_through_without_the_render_pool(tmp_path, pages):
+    chunks = [[("111", pages[0], 0)], [("222", pages[1], 0), ("222", pages[2], 1)]]
+    page_info, page_keys, page_texts, failures = {}, {}, {}, []
+
+    rendered = list(iter_rendered_pages(chunks, NoPool(), tmp_path, 72, 2, page_info, page_keys, page_texts, failures))
+
+    assert rendered == pages[:3]
+    assert page_info[pages[2]] == {"ISBN": "222", "page_number": 1}
+    assert not failures and not page_texts
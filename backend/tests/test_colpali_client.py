@@ -0,0 +1,101 @@
+import pytest
+import requests
+
+from colpali_models import ColPaliClient
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.headers = {"Content-Type": "application/json"}
+        self.body = body or {}
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code}")
+
+
+def route(client, behaviour, calls):
+    # behaviour: {base url: exception or status code}; healthy replicas answer with their url
+    for replica in client.replicas:
+        def request(method, url, replica=replica, **kwargs):
+            calls.append(url)
+            outcome = behaviour.get(replica.base_url, 200)
+            if isinstance(outcome, Exception):
+                raise outcome
+            if url.endswith("/health"):
+                return FakeResponse(outcome)
+            return FakeResponse(outcome, {"query_embeddings": [[[0.0]]], "served_by": replica.base_url})
+        replica.session.request = request
+        replica.session.get = lambda url, replica=replica, **kwargs: request("GET", url, replica=replica)
+
+
+def make_client():
+    return ColPaliClient("http://gpu-1:8000/embed,http://gpu-2:8000/embed", response_format="json",
+                         health_check_interval=60)
+
+
+def test_requests_fail_over_to_a_healthy_replica():
+    client, calls = make_client(), []
+    route(client, {"http://gpu-1:8000": requests.exceptions.ConnectionError("refused")}, calls)
+
+    for _ in range(3):
+        assert client.get_embeddings(queries=["q"])["served_by"] == "http://gpu-2:8000"
+    # gpu-1 is tried once, then left alone until its back-off has passed
+    assert calls.count("http://gpu-1:8000/embed") == 1
+    assert client.replicas[0].healthy is False
+
+
+def test_gateway_errors_fail_over_but_client_errors_do_not():
+    client, calls = make_client(), []
+    route(client, {"http://gpu-1:8000": 503}, calls)
+    assert client.get_embeddings(queries=["q"])["served_by"] == "http://gpu-2:8000"
+
+    client, calls = make_client(), []
+    route(client, {"http://gpu-1:8000": 400, "http://gpu-2:8000": 400}, calls)
+    with pytest.raises(Exception, match="400"):
+        client.get_embeddings(queries=["q"])
+    assert len(calls) == 1
+
+
+def test_all_replicas_down_raises():
+    client, calls = make_client(), []
+    down = requests.exceptions.ConnectionError("refused")
+    route(client, {"http://gpu-1:8000": down, "http://gpu-2:8000": down}, calls)
+    with pytest.raises(Exception, match="No ColPali replica available"):
+        client.get_embeddings(queries=["q"])
+    assert sorted(calls) == ["http://gpu-1:8000/embed", "http://gpu-2:8000/embed"]
+
+
+def test_failed_replica_is_used_again_after_a_successful_probe(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("colpali_models.time.monotonic", lambda: now[0])
+    client, calls = make_client(), []
+    behaviour = {"http://gpu-1:8000": requests.exceptions.ConnectionError("refused")}
+    route(client, behaviour, calls)
+    client.get_embeddings(queries=["q"])
+
+    behaviour.clear()
+    now[0] += 61
+    client.replicas[1].in_flight = 1  # gpu-2 busy: the recovered gpu-1 gets the request
+    assert client.get_embeddings(queries=["q"])["served_by"] == "http://gpu-1:8000"
+    assert "http://gpu-1:8000/health" in calls
+
+
+def test_backend_starts_without_an_embedding_server(backend, monkeypatch):
+    from fastapi.testclient import TestClient
+    import app as backend_app
+
+    monkeypatch.setattr(backend_app, "COLPALI_URI", None)  # unset, as in docker-compose
+    with TestClient(backend_app.app) as client:
+        sparse = client.post("/document_retrieval", json={"user_query": "Schrodinger equation", "mode": "sparse"})
+        dense = client.post("/document_retrieval", json={"user_query": "Schrodinger equation", "mode": "dense"})
+        upload = client.post("/document_embed", files={"file": ("page.png", b"\x89PNG\r\n\x1a\n")})
+
+    assert sparse.status_code == 200
+    assert sparse.json()["retrieved_image_points"][0]["page_number"] == 1
+    assert dense.status_code == 503 and "COLPALI_URI" in dense.json()["detail"]
+    assert upload.status_code == 503
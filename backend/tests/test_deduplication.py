@@ -0,0 +1,21 @@
+from conftest import VECTOR_SIZE
+from qdrant_models import create_qdrant_client, create_qdrant_collection, index_images_to_qdrant
+
+
+def test_reindex_skips_pages_already_in_the_collection(collection, colpali, pages):
+    assert create_qdrant_client(collection).count("books").count == len(pages)
+    assert colpali.images_embedded == len(pages)
+
+    index_images_to_qdrant(pages + pages[:1], batch_size=2, collection_name="books", qdrant_uri=collection, colpali_url="stub")
+    assert create_qdrant_client(collection).count("books").count == len(pages)
+    assert colpali.images_embedded == len(pages)
+
+
+def test_pages_indexed_into_another_collection_get_other_ids(collection, colpali, pages):
+    # point ids include the collection, so each collection keeps its own copy of a page
+    create_qdrant_collection(collection, "copies", VECTOR_SIZE, 100)
+    index_images_to_qdrant(pages[:2], batch_size=2, collection_name="copies", qdrant_uri=collection, colpali_url="stub")
+    client = create_qdrant_client(collection)
+    books = {str(record.id) for record in client.scroll("books", limit=10)[0]}
+    copies = {str(record.id) for record in client.scroll("copies", limit=10)[0]}
+    assert len(copies) == 2 and not books & copies
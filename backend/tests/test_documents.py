@@ -0,0 +1,83 @@
+import time
+import zipfile
+from pathlib import Path
+
+from conftest import VECTOR_SIZE
+from qdrant_models import (
+    create_qdrant_client, create_qdrant_collection, delete_document, document_pages, index_images_to_qdrant,
+    prune_document,
+)
+
+
+def index_document(qdrant_uri, paths, document_id, revision):
+    index_images_to_qdrant(paths, batch_size=2, collection_name="docs", qdrant_uri=qdrant_uri, colpali_url="stub",
+                           payload_fn=lambda path: {"page_number": int(path[-5])},
+                           document_id=document_id, document_revision=revision)
+    return prune_document(create_qdrant_client(qdrant_uri), "docs", document_id, revision)
+
+
+def test_new_revision_keeps_unchanged_pages_and_prunes_dropped_ones(tmp_path, colpali, pages):
+    qdrant_uri = f"numpy://{tmp_path / 'store'}"
+    create_qdrant_collection(qdrant_uri, "docs", VECTOR_SIZE, 100)
+    client = create_qdrant_client(qdrant_uri)
+
+    assert index_document(qdrant_uri, pages[:3], "book", "r1") == 0
+    assert index_document(qdrant_uri, pages[1:], "book", "r2") == 1
+    # only the new page was embedded; page 0 left the document and the collection
+    assert colpali.images_embedded == 4
+    assert [page["page_number"] for page in document_pages(client, "docs", "book")] == [1, 2, 3]
+    assert {page["revision"] for page in document_pages(client, "docs", "book")} == {"r2"}
+    assert client.count("docs").count == 3
+
+    # going back to the first version restores it without embedding anything
+    assert index_document(qdrant_uri, pages[:3], "book", "r1") == 1
+    assert [page["page_number"] for page in document_pages(client, "docs", "book")] == [0, 1, 2]
+    assert colpali.images_embedded == 5
+
+
+def test_deleting_a_document_keeps_pages_shared_with_another(tmp_path, colpali, pages):
+    qdrant_uri = f"numpy://{tmp_path / 'store'}"
+    create_qdrant_collection(qdrant_uri, "docs", VECTOR_SIZE, 100)
+    client = create_qdrant_client(qdrant_uri)
+    index_document(qdrant_uri, pages[:3], "part-1", "a")
+    index_document(qdrant_uri, pages[2:], "part-2", "b")
+    # the shared page is stored once
+    assert client.count("docs").count == 4
+    assert document_pages(client, "docs", "part-1")[-1]["shared_with"] == ["part-2"]
+
+    assert delete_document(qdrant_uri, "docs", "part-1") == 3
+    assert document_pages(client, "docs", "part-1") == []
+    assert [page["page_number"] for page in document_pages(client, "docs", "part-2")] == [2, 3]
+    assert client.count("docs").count == 2
+
+
+def upload(backend, path, **fields):
+    with open(path, "rb") as f:
+        response = backend.post("/document_embed", files={"file": (path.name, f)}, data=fields)
+    assert response.status_code == 200, response.text
+    job_id = response.json()["job_id"]
+    for _ in range(200):
+        job = backend.get(f"/document_embed/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            return response.json()["status"], job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_reupload_after_delete_registers_the_document_again(backend, pages, tmp_path):
+    archive = tmp_path / "book.zip"
+    with zipfile.ZipFile(archive, "w") as z:
+        for path in pages[:2]:
+            z.write(path, f"book/{Path(path).name}")
+
+    status, job = upload(backend, archive, isbn="111")
+    assert job["status"] == "completed" and job["document_id"] == "111/book.zip"
+    assert len(backend.get("/documents/111/book.zip").json()["pages"]) == 2
+
+    assert backend.delete("/documents/111/book.zip").json()["pages_deleted"] == 2
+    assert backend.get("/documents/111/book.zip").status_code == 404
+
+    status, job = upload(backend, archive, isbn="111")
+    assert status == "Document already uploaded, re-registering"
+    assert job["status"] == "completed"
+    assert len(backend.get("/documents/111/book.zip").json()["pages"]) == 2
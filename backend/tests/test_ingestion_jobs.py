@@ -0,0 +1,74 @@
+import os
+import time
+import shutil
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from ingestion_jobs import IngestionJobManager, JOB_FILE
+
+
+def job_manager(base_directory, qdrant_uri):
+    # one per backend process sharing the upload directory
+    return IngestionJobManager(
+        index_kwargs={"batch_size": 2, "collection_name": "books", "qdrant_uri": qdrant_uri, "colpali_url": "stub"},
+        base_directory=str(base_directory),
+    )
+
+
+def upload_page(base_directory, job_id, page):
+    hash_folder = Path(base_directory) / job_id
+    (hash_folder / "images_to_process").mkdir(parents=True)
+    shutil.copyfile(page, hash_folder / Path(page).name)
+    return hash_folder
+
+
+def test_jobs_run_elsewhere_are_read_from_disk(tmp_path, colpali, collection, pages):
+    first, second = job_manager(tmp_path, collection), job_manager(tmp_path, collection)
+    hash_folder = upload_page(tmp_path, "job-a", pages[0])
+
+    first.submit(hash_folder, Path(pages[0]).name, metadata={"ISBN": "333"})
+    first.executor.shutdown(wait=True)
+
+    job = second.get("job-a")
+    assert job["status"] == "completed" and job["pages_done"] == 1
+    assert second.get("missing") is None and second.get("..") is None
+    # a duplicate upload reaching another worker gets the existing job instead of a new run
+    assert second.submit(hash_folder, Path(pages[0]).name)["status"] == "completed"
+    assert second.jobs == {}
+
+
+def test_an_interrupted_job_is_resumed_by_one_worker_only(tmp_path, colpali, collection, pages):
+    first, second = job_manager(tmp_path, collection), job_manager(tmp_path, collection)
+    hash_folder = upload_page(tmp_path, "job-b", pages[1])
+    first.submit(hash_folder, Path(pages[1]).name)
+    first.executor.shutdown(wait=True)
+    job_file = hash_folder / JOB_FILE
+    job_file.write_text(job_file.read_text().replace('"completed"', '"running"'))  # as left by a crash
+
+    lock_file = first._claim(hash_folder)  # the first worker picked it up on startup
+    assert second.resume_pending(tmp_path) == []
+    assert second.resume("job-b") is None
+    lock_file.close()
+
+    assert second.resume_pending(tmp_path) == ["job-b"]
+    second.executor.shutdown(wait=True)
+    assert second.get("job-b")["status"] == "completed"
+    assert "job-b" not in second.jobs
+
+
+def test_only_stale_partial_uploads_are_removed_on_startup(backend):
+    import app as backend_app
+
+    stale = backend_app.INCOMING_UPLOAD_DIRECTORY / "stale.part"
+    streaming = backend_app.INCOMING_UPLOAD_DIRECTORY / "streaming.part"
+    stale.write_bytes(b"x")
+    streaming.write_bytes(b"x")
+    old = time.time() - backend_app.STALE_UPLOAD_SECONDS - 60
+    os.utime(stale, (old, old))
+
+    with TestClient(backend_app.app):  # another worker starting up
+        pass
+
+    assert not stale.exists() and streaming.exists()
+    streaming.unlink()
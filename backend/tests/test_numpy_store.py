@@ -0,0 +1,53 @@
+"""Search against the embedded NumPy store (numpy://); fixtures are in conftest.py."""
+from conftest import VECTOR_SIZE
+from qdrant_models import build_payload_filter, create_qdrant_collection, index_images_to_qdrant, search_qdrant
+
+
+def result_pages(result):
+    return [point.payload["page_number"] for point in result.points]
+
+
+def test_dense_search_ranks_the_matching_page_first(collection, colpali, pages):
+    colpali.queries["quantum states"] = pages[2]
+    result = search_qdrant("books", "quantum states", collection, "stub", top_k=2)
+    assert result_pages(result)[0] == 2
+
+
+def test_sparse_search_matches_page_text(collection):
+    result = search_qdrant("books", "Schrodinger equation", collection, "stub", top_k=3, mode="sparse")
+    assert result_pages(result) == [1]
+
+
+def test_hybrid_search_fuses_dense_and_sparse_results(collection, colpali, pages):
+    # the dense list is led by page 0, the text list by page 2 (the only page with "thermodynamics")
+    colpali.queries["thermodynamics"] = pages[0]
+    result = search_qdrant("books", "thermodynamics", collection, "stub", top_k=2, mode="hybrid")
+    assert set(result_pages(result)) == {0, 2}
+
+
+def test_filtered_search_only_returns_matching_pages(collection, colpali, pages):
+    colpali.queries["force"] = pages[0]
+    result = search_qdrant("books", "force", collection, "stub", top_k=4, query_filter=build_payload_filter({"ISBN": "222"}))
+    assert sorted(result_pages(result)) == [2, 3]
+
+    result = search_qdrant("books", "second law", collection, "stub", top_k=4, mode="sparse",
+                           query_filter=build_payload_filter({"ISBN": "111"}))
+    assert result_pages(result) == [0]
+
+
+def test_repeated_searches_through_the_backend_use_the_cached_embedding(backend, colpali, collection, pages):
+    # the cache hands out read-only arrays, which the store must not normalize in place
+    colpali.queries["force and acceleration"] = pages[0]
+    for _ in range(2):
+        response = backend.post("/document_retrieval", json={"user_query": "force and acceleration", "top_k": 2})
+        assert response.status_code == 200, response.text
+        assert response.json()["retrieved_image_points"][0]["page_number"] == 0
+
+    # fan-out over two collections shares the same cached embedding
+    create_qdrant_collection(collection, "more", VECTOR_SIZE, 100)
+    index_images_to_qdrant(pages[2:], batch_size=2, collection_name="more", qdrant_uri=collection, colpali_url="stub")
+    response = backend.post("/document_retrieval", json={"user_query": "force and acceleration", "top_k": 3,
+                                                          "collections": ["books", "more"]})
+    assert response.status_code == 200, response.text
+    assert response.json()["collections"] == {"books": "ok", "more": "ok"}
+    assert backend.get("/query_cache_stats").json()["hits"] == 2
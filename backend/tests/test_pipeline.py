@@ -0,0 +1,30 @@
+import pytest
+
+from pipeline import Stage, run_pipeline
+
+
+def test_run_pipeline_raises_the_first_stage_error():
+    def fail_on_three(item):
+        if item == 3:
+            raise ValueError("bad item")
+        return item
+
+    collected = []
+    stages = [Stage("check", fail_on_three, workers=2), Stage("collect", collected.append)]
+    with pytest.raises(RuntimeError, match="Pipeline stage 'check' failed: bad item"):
+        run_pipeline(range(10), stages)
+
+
+def test_run_pipeline_hands_failed_items_to_on_error():
+    def fail_on_odd(item):
+        if item % 2:
+            raise ValueError(f"odd {item}")
+        return item
+
+    collected, failed = [], []
+    stages = [Stage("check", fail_on_odd, workers=2), Stage("collect", collected.append)]
+    stats = run_pipeline(range(10), stages, on_error=lambda stage_name, item, error: failed.append((stage_name, item)))
+
+    assert sorted(collected) == [0, 2, 4, 6, 8]
+    assert sorted(failed) == [("check", item) for item in (1, 3, 5, 7, 9)]
+    assert stats["check"]["items"] == 5
@@ -0,0 +1,91 @@
+import numpy as np
+
+from colpali_models import ColPaliClient
+from query_cache import QueryEmbeddingCache
+
+
+def embedding(value, tokens=4):
+    return np.full((tokens, 8), value, dtype=np.float32)
+
+
+def test_normalized_queries_share_an_entry_per_model():
+    cache = QueryEmbeddingCache()
+    cache.put("What is  entropy?", "model-a", embedding(1))
+
+    assert cache.get(" What is entropy? ", "model-a")[0, 0] == 1
+    assert cache.get("what is entropy?", "model-a") is None  # ColPali is case sensitive
+    assert cache.get("What is entropy?", "model-b") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    cache = QueryEmbeddingCache(max_bytes=2 * embedding(0).nbytes)
+    cache.put("a", "m", embedding(1))
+    cache.put("b", "m", embedding(2))
+    cache.get("a", "m")
+    cache.put("c", "m", embedding(3))
+
+    assert cache.get("b", "m") is None
+    assert cache.get("a", "m") is not None and cache.get("c", "m") is not None
+    assert cache.stats()["bytes"] == 2 * embedding(0).nbytes
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("query_cache.time.time", lambda: now[0])
+    cache = QueryEmbeddingCache(ttl_seconds=60)
+    cache.put("a", "m", embedding(1))
+
+    now[0] += 59
+    assert cache.get("a", "m") is not None
+    now[0] += 2
+    assert cache.get("a", "m") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_cached_embeddings_are_read_only():
+    cache = QueryEmbeddingCache()
+    cached = cache.put("a", "m", embedding(1))
+    assert not cached.flags.writeable
+    assert cache.get("a", "m") is cached
+
+
+def test_disk_tier_is_shared_between_caches_and_bounded(tmp_path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr("query_cache.time.time", lambda: float(next(clock)))
+    path = str(tmp_path / "queries.sqlite")
+    writer = QueryEmbeddingCache(disk_path=path, disk_max_entries=3, disk_prune_interval=2)
+    other_worker = QueryEmbeddingCache(disk_path=path)
+    writer.put("a", "m", embedding(1))
+
+    assert other_worker.get("a", "m")[0, 0] == 1
+    assert other_worker.stats()["disk_hits"] == 1
+
+    for idx in range(6):
+        writer.put(f"q{idx}", "m", embedding(idx))
+    # pruned on every second write: the newest entries survive
+    assert other_worker.get("q5", "m") is not None
+    assert other_worker.get("a", "m") is not None  # still in memory
+    assert QueryEmbeddingCache(disk_path=path).get("a", "m") is None
+
+
+def test_model_id_lookup_backs_off_after_a_failure(monkeypatch):
+    client = ColPaliClient("http://colpali:8000/embed", health_check_interval=30)
+    configs = [None, {"model_id": "vidore/colpali"}]
+    calls = []
+
+    def get_processor_config():
+        calls.append(1)
+        return configs[len(calls) - 1]
+
+    now = [100.0]
+    monkeypatch.setattr(client, "get_processor_config", get_processor_config)
+    monkeypatch.setattr("colpali_models.time.monotonic", lambda: now[0])
+
+    assert client.get_model_id() == ""
+    assert client.get_model_id() == ""
+    assert len(calls) == 1
+    now[0] += 31
+    assert client.get_model_id() == "vidore/colpali"
+    assert client.get_model_id() == "vidore/colpali"
+    assert len(calls) == 2
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from conftest import VECTOR_SIZE
+from qdrant_models import (
+    COLUMNS_VECTOR, ROWS_VECTOR, SearchRequestError, build_payload_filter, build_search_request, collection_layout, create_qdrant_client, create_qdrant_collection,
+)
+
+
+def pooled_layout(tmp_path, quantization):
+    qdrant_uri = f"numpy://{tmp_path / 'store'}"
+    create_qdrant_collection(qdrant_uri, "pooled", VECTOR_SIZE, indexing_threshold=0, pooled_vectors=True,
+                             quantization=quantization)
+    return collection_layout(create_qdrant_client(qdrant_uri), "pooled")
+
+
+def prefetch_limits(request):
+    return {prefetch.using: prefetch.limit for prefetch in request["prefetch"]}
+
+
+def test_quantization_oversampling_widens_the_pooled_candidates(tmp_path):
+    layout = pooled_layout(tmp_path, "binary")
+    query = np.ones((4, VECTOR_SIZE), dtype=np.float32)
+
+    dense = build_search_request("pooled", query, 5, layout, prefetch_oversampling=10)
+    prefilter = build_search_request("pooled", query, 5, layout, prefetch_oversampling=10,
+                                     mode="sparse_prefilter", query_text="entropy")
+
+    # binary quantization oversamples 3x: 5 * 10 * 3 candidates per pooled vector
+    assert prefetch_limits(dense) == {ROWS_VECTOR: 150, COLUMNS_VECTOR: 150}
+    assert dense["search_params"].quantization.rescore
+    assert prefilter["prefetch"][0].limit == 150 and prefilter["search_params"] is not None
+
+
+def test_unquantized_collections_keep_the_requested_candidates(tmp_path):
+    layout = pooled_layout(tmp_path, "none")
+
+    dense = build_search_request("pooled", np.ones((4, VECTOR_SIZE), dtype=np.float32), 5, layout,
+                                 prefetch_oversampling=10)
+
+    assert prefetch_limits(dense) == {ROWS_VECTOR: 50, COLUMNS_VECTOR: 50}
+    assert dense["search_params"] is None
+
+
+def test_text_searches_on_a_collection_without_text_vector_are_rejected(backend, collection):
+    create_qdrant_collection(collection, "plain", VECTOR_SIZE, indexing_threshold=0, text_index=False)
+
+    sparse = backend.post("/document_retrieval", json={"user_query": "entropy", "mode": "sparse", "collections": ["plain"]})
+    fanned_out = backend.post("/document_retrieval",
+                              json={"user_query": "entropy", "mode": "sparse", "collections": ["books", "plain"]})
+
+    assert sparse.status_code == 400 and "'text' sparse vector" in sparse.json()["detail"]
+    assert fanned_out.status_code == 200
+    assert fanned_out.json()["collections"]["plain"].startswith("error:")
+
+
+def test_filters_on_unindexed_fields_are_rejected():
+    layout = {"sparse": True, "indexed_fields": {"ISBN", "page_number"}}
+    query = np.ones((4, VECTOR_SIZE), dtype=np.float32)
+
+    build_search_request("books", query, 3, layout, query_filter=build_payload_filter({"ISBN": "111"}))
+    with pytest.raises(SearchRequestError, match="no payload index for: chapter"):
+        build_search_request("books", query, 3, layout, query_filter=build_payload_filter({"ISBN": "111", "chapter": 2}))
+
+
+def test_batch_text_searches_without_text_vector_are_rejected(backend, collection, monkeypatch):
+    import app as backend_app
+
+    create_qdrant_collection(collection, "plain", VECTOR_SIZE, indexing_threshold=0, text_index=False)
+    monkeypatch.setattr(backend_app, "QDRANT_COLLECTION_NAME", "plain")
+
+    # the stub cannot embed these queries: the batch must be rejected before embedding
+    response = backend.post("/document_retrieval_batch", json={"queries": [
+        {"user_query": "entropy"}, {"user_query": "second law", "mode": "hybrid"},
+    ]})
+
+    assert response.status_code == 400 and "'text' sparse vector for hybrid" in response.json()["detail"]
@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from helper_functions import UploadTooLargeError, save_multipart_upload
+
+BOUNDARY = "test-boundary"
+
+
+class StreamedRequest:
+    # the parts of a Starlette Request that save_multipart_upload reads
+    def __init__(self, body, chunk_size=7, content_type=f"multipart/form-data; boundary={BOUNDARY}"):
+        self.headers = {"content-type": content_type}
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for start in range(0, len(self.body), self.chunk_size):
+            yield self.body[start:start + self.chunk_size]
+
+
+def multipart_body(fields, filename, content):
+    parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields.items()
+    ]
+    parts.append(
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n".encode() + content + b"\r\n"
+    )
+    return b"".join(parts) + f"--{BOUNDARY}--\r\n".encode()
+
+
+def save(request, destination, **kwargs):
+    return asyncio.run(save_multipart_upload(request, destination, extensions=(".pdf", ".zip"), **kwargs))
+
+
+def test_file_part_is_streamed_to_disk_and_hashed(tmp_path):
+    content = bytes(range(256)) * 40
+    body = multipart_body({"isbn": "111", "subject": "physics"}, "dir/book.pdf", content)
+    destination = tmp_path / "upload.part"
+
+    fields, filename, content_hash, size = save(StreamedRequest(body), destination, chunk_size=100)
+
+    assert fields == {"isbn": "111", "subject": "physics"}
+    assert filename == "book.pdf"
+    assert (content_hash, size) == (hashlib.sha256(content).hexdigest(), len(content))
+    assert destination.read_bytes() == content
+
+
+def test_oversized_file_is_rejected_and_removed(tmp_path):
+    destination = tmp_path / "upload.part"
+    with pytest.raises(UploadTooLargeError):
+        save(StreamedRequest(multipart_body({}, "book.pdf", b"x" * 1000)), destination, max_bytes=999)
+    assert not destination.exists()
+
+
+@pytest.mark.parametrize("request_body, content_type, message", [
+    (multipart_body({}, "notes.txt", b"text"), f"multipart/form-data; boundary={BOUNDARY}", "Unsupported file type"),
+    (f"--{BOUNDARY}--\r\n".encode(), f"multipart/form-data; boundary={BOUNDARY}", "No file"),
+    (b'{"isbn": "1"}', "application/json", "Expected a multipart/form-data upload"),
+])
+def test_invalid_uploads_are_rejected(tmp_path, request_body, content_type, message):
+    destination = tmp_path / "upload.part"
+    with pytest.raises(ValueError, match=message):
+        save(StreamedRequest(request_body, content_type=content_type), destination)
+    assert not destination.exists()
+
+
+def test_backend_answers_oversized_uploads_with_413(backend, monkeypatch):
+    import app as backend_app
+
+    monkeypatch.setattr(backend_app, "MAX_UPLOAD_BYTES", 1000)
+    response = backend.post("/document_embed", files={"file": ("book.pdf", b"x" * 2000)})
+    assert response.status_code == 413
+    response = backend.post("/document_embed", files={"file": ("book.txt", b"x")})
+    assert response.status_code == 400
+    assert list(backend_app.INCOMING_UPLOAD_DIRECTORY.glob("*.part")) == []
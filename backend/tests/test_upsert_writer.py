@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from qdrant_client import models
+
+from upsert_writer import AdaptiveUpsertWriter, estimate_point_bytes
+
+
+def make_points(start, count):
+    return [
+        models.PointStruct(id=idx, vector=np.ones((2, 4), dtype=np.float32).tolist(), payload={"n": idx})
+        for idx in range(start, start + count)
+    ]
+
+
+def test_upsert_writer_splits_rejected_batches():
+    sent = []
+
+    def upsert(points, wait):
+        # rejects any request of more than 2 points, and point 5 on its own
+        if len(points) > 2 or any(point.id == 5 for point in points):
+            raise ValueError("rejected")
+        sent.extend(point.id for point in points)
+
+    failed, done = [], []
+    writer = AdaptiveUpsertWriter(upsert, batch_bytes=10 ** 9, min_batch_bytes=1, max_in_flight=1,
+                                  on_error=lambda item, error: failed.append(item))
+    for idx in range(8):
+        writer.add(make_points(idx, 1), on_done=lambda idx=idx: done.append(idx), item=idx)
+    stats = writer.close()
+
+    assert sorted(sent) == [0, 1, 2, 3, 4, 6, 7]
+    assert sorted(done) == [0, 1, 2, 3, 4, 6, 7]
+    assert failed == [5]
+    assert stats["splits"] > 0
+    assert stats["points"] == 7
+
+
+def test_upsert_writer_raises_without_on_error():
+    def upsert(points, wait):
+        raise ValueError("down")
+
+    writer = AdaptiveUpsertWriter(upsert, batch_bytes=10 ** 9)
+    writer.add(make_points(0, 2))
+    with pytest.raises(RuntimeError, match="Upsert failed: down"):
+        writer.close()
+
+
+def test_size_estimate_is_the_same_for_arrays_and_converted_points():
+    vector = {
+        "original": np.ones((30, 8), dtype=np.float32),
+        "rows": np.ones((5, 8), dtype=np.float32),
+        "text": models.SparseVector(indices=[1, 7], values=[0.5, 0.25]),
+    }
+    payload = {"ISBN": "111", "page_number": 3}
+    point = models.PointStruct(id=1, vector=vector, payload=payload)
+
+    assert estimate_point_bytes(vector, payload) == estimate_point_bytes(point.vector, point.payload)
+    assert estimate_point_bytes(vector, payload) > (30 + 5) * 8 * 4
@@ -0,0 +1,40 @@
+import os
+import time
+import zipfile
+
+from helper_functions import extract_zip_images
+from ingestion_jobs import prepare_images
+
+
+def page_archive(path, pages, count=20):
+    with zipfile.ZipFile(path, "w") as z:
+        for i in range(count):
+            z.write(pages[i % len(pages)], f"scans/page_{i:02d}.png")
+        z.writestr("scans/notes.png", b"not an image")
+    return path
+
+
+def test_pages_total_counts_only_real_images(tmp_path, pages):
+    archive = page_archive(tmp_path / "book.zip", pages)
+    images_folder = tmp_path / "images"
+    images_folder.mkdir()
+
+    image_files, total = prepare_images(archive, images_folder)
+
+    assert total == 20
+    assert [os.path.basename(path) for path in image_files] == [f"scans_page_{i:02d}.png" for i in range(20)]
+
+
+def test_a_slow_consumer_bounds_the_members_in_flight(tmp_path, pages):
+    archive = page_archive(tmp_path / "book.zip", pages)
+    images_folder = tmp_path / "images"
+    images_folder.mkdir()
+
+    extracted = extract_zip_images(str(archive), str(images_folder), workers=2)
+    next(extracted)
+    time.sleep(0.2)  # the consumer is busy with the first page
+
+    # the first page plus at most the 2 * workers members submitted after it
+    assert 1 <= len(os.listdir(images_folder)) <= 5
+    extracted.close()
+    assert len(os.listdir(images_folder)) <= 5
@@ -0,0 +1,59 @@
+import re
+import hashlib
+from collections import Counter
+
+import pymupdf
+from qdrant_client import models
+
+# sparse named vector holding the lexical index of a page's text
+TEXT_VECTOR = "text"
+
+# BM25 term-frequency saturation; IDF is applied by Qdrant (Modifier.IDF)
+BM25_K1 = 1.2
+BM25_B = 0.75
+AVG_PAGE_TOKENS = 350
+
+# words, plus hyphen/dot/slash-joined terms such as ISBNs, model numbers and section ids
+TERM_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+TERM_SEPARATORS = re.compile(r"[-./]")
+
+
+def tokenize(text):
+    """Lower-cased terms of `text`. A joined term like 978-0-13-409341-3 is also indexed
+    as its parts and without separators, so it matches however it is written."""
+    terms = []
+    for match in TERM_PATTERN.findall((text or "").lower()):
+        terms.append(match)
+        if TERM_SEPARATORS.search(match):
+            parts = TERM_SEPARATORS.split(match)
+            terms.extend(part for part in parts if part)
+            terms.append("".join(parts))
+    return terms
+
+
+def term_index(term):
+    # stable 32-bit id for a term, so no vocabulary has to be stored or shared
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+def text_sparse_vector(text, query=False):
+    """Sparse vector of `text`: BM25-saturated term frequencies for documents, or a
+    weight of 1 per distinct term for queries."""
+    terms = tokenize(text)
+    weights = {}
+    for term, count in Counter(terms).items():
+        if query:
+            weight = 1.0
+        else:
+            length_norm = 1 - BM25_B + BM25_B * len(terms) / AVG_PAGE_TOKENS
+            weight = count * (BM25_K1 + 1) / (count + BM25_K1 * length_norm)
+        index = term_index(term)
+        weights[index] = weights.get(index, 0.0) + weight
+    return models.SparseVector(indices=list(weights), values=list(weights.values()))
+
+
+def extract_pdf_page_texts(pdf_file_path, first_page=1, last_page=None):
+    """Return {page number: text} of the PDF's text layer (empty for scanned pages)."""
+    with pymupdf.open(pdf_file_path) as doc:
+        last_page = min(last_page or doc.page_count, doc.page_count)
+        return {page_number: doc[page_number - 1].get_text() for page_number in range(first_page, last_page + 1)}
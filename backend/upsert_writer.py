@@ -0,0 +1,173 @@
+import time
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# approximate bytes per vector component in the REST (JSON) request body
+BYTES_PER_VALUE = 16
+
+
+def _vector_values(vector):
+    # from the shape alone: np.size would first copy a (pydantic-converted) nested list into an array
+    if hasattr(vector, "indices"):
+        return 2 * len(vector.indices)  # sparse: indices and values
+    if isinstance(vector, np.ndarray):
+        return vector.size
+    if len(vector) and isinstance(vector[0], (list, tuple, np.ndarray)):
+        return len(vector) * len(vector[0])  # multivector
+    return len(vector)
+
+
+def estimate_point_bytes(vector, payload):
+    """Approximate serialized size of a point with this vector (array, multivector, sparse
+    vector or a dict of them) and payload: its vector values plus the JSON payload."""
+    vectors = vector.values() if isinstance(vector, dict) else [vector]
+    values = sum(_vector_values(vector) for vector in vectors)
+    return values * BYTES_PER_VALUE + len(json.dumps(payload or {}, default=str))
+
+
+class AdaptiveUpsertWriter:
+    """Groups points into upserts of about `batch_bytes` serialized bytes and sends them
+    with at most `max_in_flight` requests outstanding.
+
+    `upsert_fn(points, wait)` performs one upsert and returns its UpdateResult. After each
+    batch the target size adapts: it grows while upserts return well within
+    `target_latency` seconds and shrinks when they are slow. A failed batch of several
+    items is split in half and re-sent; a single item that still fails is handed to
+    `on_error(item, error)`, or, without on_error, raised from add()/close().
+
+    add() takes the estimated size of the points if the caller has it (estimate_point_bytes
+    on the vectors before they go into PointStructs), else estimates it from the points.
+
+    Items are added whole, so each item's `on_done()` callback runs once the batch holding
+    its points has been acknowledged. close() flushes the rest with wait=True: since
+    earlier batches are acknowledged first, the last completed write confirms all of them.
+    """
+    def __init__(self, upsert_fn, batch_bytes=8 * 1024 * 1024, min_batch_bytes=1024 * 1024,
+                 max_batch_bytes=24 * 1024 * 1024, max_in_flight=2, target_latency=2.0, on_error=None):
+        self.upsert_fn = upsert_fn
+        self.batch_bytes = batch_bytes
+        self.min_batch_bytes = min_batch_bytes
+        self.max_batch_bytes = max_batch_bytes
+        self.target_latency = target_latency
+        self.on_error = on_error
+
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="upsert-writer")
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.buffer = []  # (points, size, on_done, item)
+        self.buffer_bytes = 0
+        self.last_points = None
+        self.errors = []
+
+        self.batches = 0
+        self.points = 0
+        self.bytes = 0
+        self.splits = 0
+        self.operation_ids = []
+        self.confirmed = False
+
+    def add(self, points, on_done=None, item=None, size=None):
+        self._raise_if_failed()
+        if size is None:
+            size = sum(estimate_point_bytes(point.vector, point.payload) for point in points)
+        with self.lock:
+            self.buffer.append((points, size, on_done, item))
+            self.buffer_bytes += size
+            if self.buffer_bytes < self.batch_bytes:
+                return
+            batch, self.buffer, self.buffer_bytes = self.buffer, [], 0
+
+        # blocks while max_in_flight batches are outstanding, which backpressures the pipeline
+        self.slots.acquire()
+        self.executor.submit(self._send_batch, batch)
+
+    def _send_batch(self, batch):
+        try:
+            self._send(batch, wait=False)
+        finally:
+            self.slots.release()
+
+    def _send(self, batch, wait):
+        points = [point for entry in batch for point in entry[0]]
+        size = sum(entry[1] for entry in batch)
+        started = time.perf_counter()
+        try:
+            result = self.upsert_fn(points, wait)
+        except Exception as e:
+            with self.lock:
+                self.batch_bytes = max(self.min_batch_bytes, self.batch_bytes // 2)
+            if len(batch) > 1:
+                # retry the halves separately: too-large requests and single bad points are isolated
+                with self.lock:
+                    self.splits += 1
+                middle = len(batch) // 2
+                self._send(batch[:middle], wait)
+                self._send(batch[middle:], wait)
+                return
+            self._fail(batch[0], e)
+            return
+
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            if elapsed < self.target_latency / 2:
+                self.batch_bytes = min(self.max_batch_bytes, int(self.batch_bytes * 1.5))
+            elif elapsed > self.target_latency:
+                self.batch_bytes = max(self.min_batch_bytes, self.batch_bytes // 2)
+            self.batches += 1
+            self.points += len(points)
+            self.bytes += size
+            self.last_points = batch[-1][0]
+            if getattr(result, "operation_id", None) is not None:
+                self.operation_ids.append(result.operation_id)
+
+        for _, _, on_done, _ in batch:
+            if on_done is not None:
+                on_done()
+
+    def _fail(self, entry, error):
+        if self.on_error is not None:
+            self.on_error(entry[3], error)
+        else:
+            with self.lock:
+                self.errors.append(error)
+
+    def _raise_if_failed(self):
+        if self.errors:
+            raise RuntimeError(f"Upsert failed: {str(self.errors[0])}") from self.errors[0]
+
+    def close(self):
+        """Send the remaining points with wait=True after all in-flight batches, and return stats."""
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            batch, self.buffer, self.buffer_bytes = self.buffer, [], 0
+
+        if batch:
+            self._send(batch, wait=True)
+            self.confirmed = not self.errors
+        elif self.last_points is not None:
+            # nothing left to send: re-send the last (idempotent) point and wait for it
+            try:
+                result = self.upsert_fn(self.last_points[-1:], True)
+                if getattr(result, "operation_id", None) is not None:
+                    self.operation_ids.append(result.operation_id)
+                self.confirmed = not self.errors
+            except Exception as e:
+                self.errors.append(e)
+        self._raise_if_failed()
+        return self.stats()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "points": self.points,
+                "bytes": self.bytes,
+                "splits": self.splits,
+                "batch_bytes": self.batch_bytes,
+                "operations": len(self.operation_ids),
+                "last_operation_id": self.operation_ids[-1] if self.operation_ids else None,
+                "confirmed": self.confirmed,
+            }
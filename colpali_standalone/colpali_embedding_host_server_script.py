@@ -1,8 +1,15 @@
 import io
 import os
+import time
 import base64
 import torch
-from fastapi import FastAPI, HTTPException
+import numpy as np
+import asyncio
+from collections import deque
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Header, File, UploadFile
+from fastapi.responses import Response
 from pydantic import BaseModel
 from huggingface_hub import HfFolder
 from typing import List, Optional
@@ -14,12 +21,169 @@ from contextlib import asynccontextmanager
 model = None
 processor = None
 
+MODEL_ID = os.getenv("COLPALI_MODEL_ID", "vidore/colpali-v1.2")
+
+# binary response mode: concatenated .npy arrays, negotiated through the Accept header
+NPY_MEDIA_TYPE = "application/x-npy"
+NPY_DTYPES = {"float16": torch.float16, "float32": torch.float32}
+
+# pool used to decode uploaded image bytes off the event loop
+IMAGE_DECODE_WORKERS = int(os.getenv("IMAGE_DECODE_WORKERS", 4))
+decode_executor = ThreadPoolExecutor(max_workers=IMAGE_DECODE_WORKERS)
+
+# cross-request micro-batching: concurrent requests share forward passes of up to
+# *_MAX_BATCH_SIZE inputs, and a pass waits at most *_MAX_WAIT_MS for more requests to join
+QUERY_MAX_BATCH_SIZE = int(os.getenv("QUERY_MAX_BATCH_SIZE", 64))
+QUERY_MAX_WAIT_MS = float(os.getenv("QUERY_MAX_WAIT_MS", 2))
+IMAGE_MAX_BATCH_SIZE = int(os.getenv("IMAGE_MAX_BATCH_SIZE", 16))
+IMAGE_MAX_WAIT_MS = float(os.getenv("IMAGE_MAX_WAIT_MS", 10))
+
+# forward passes run one at a time on this thread, off the event loop
+gpu_executor = ThreadPoolExecutor(max_workers=1)
+
+class MicroBatcher:
+    """Gathers concurrent embedding requests of one kind into shared forward passes.
+
+    A pass starts once max_batch_size inputs are queued or max_wait_ms after the first of
+    them arrived; while it runs, new requests queue up for the next one. Requests are never
+    split (a larger one runs alone). Each request gets its rows of the batch output with the
+    columns that are padding for all of its inputs removed, i.e. what it would get alone.
+    If a shared pass fails, its requests are rerun alone so the error only reaches the
+    request that caused it.
+    """
+    def __init__(self, name, forward_fn, max_batch_size, max_wait_ms, stats_window=1000):
+        self.name = name
+        self.forward_fn = forward_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.pending = deque()  # (inputs, future, enqueued_at)
+        self.pending_inputs = 0
+        self.wakeup = None
+        self.task = None
+
+        self.requests = 0
+        self.inputs = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.batch_sizes = deque(maxlen=stats_window)
+        self.queue_waits = deque(maxlen=stats_window)
+        self.forward_seconds = deque(maxlen=stats_window)
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.task
+
+    async def submit(self, inputs):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((inputs, future, time.perf_counter()))
+        self.pending_inputs += len(inputs)
+        self.wakeup.set()
+        return await future
+
+    async def _gather(self):
+        # give concurrent requests up to max_wait_ms (from the oldest one) to join the batch
+        deadline = self.pending[0][2] + self.max_wait_ms / 1000
+        while self.pending_inputs < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        batch, size = [], 0
+        while self.pending and (not batch or size + len(self.pending[0][0]) <= self.max_batch_size):
+            inputs, future, enqueued_at = self.pending.popleft()
+            self.pending_inputs -= len(inputs)
+            if future.cancelled():
+                continue  # the client went away
+            batch.append((inputs, future, enqueued_at))
+            size += len(inputs)
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            batch = await self._gather()
+            if not batch:
+                continue
+
+            if not await self._forward(loop, batch) and len(batch) > 1:
+                # one bad input must not fail the requests it happened to share a pass with:
+                # rerun them one by one so only the offending request gets the error
+                for entry in batch:
+                    if not entry[1].done():
+                        await self._forward(loop, [entry])
+
+    async def _forward(self, loop, batch):
+        # runs one pass over the batch and resolves its futures; False if forward_fn raised
+        inputs = [item for entry in batch for item in entry[0]]
+        started = time.perf_counter()
+        try:
+            embeddings, attention_mask = await loop.run_in_executor(gpu_executor, self.forward_fn, inputs)
+        except Exception as e:
+            if len(batch) == 1 and not batch[0][1].done():
+                batch[0][1].set_exception(e)
+            return False
+        self._record(batch, len(inputs), started, time.perf_counter())
+
+        start = 0
+        for request_inputs, future, _ in batch:
+            end = start + len(request_inputs)
+            keep = attention_mask[start:end].bool().any(dim=0)
+            if not future.done():
+                future.set_result(embeddings[start:end][:, keep])
+            start = end
+        return True
+
+    def _record(self, batch, size, started, finished):
+        self.requests += len(batch)
+        self.inputs += size
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, size)
+        self.batch_sizes.append(size)
+        self.queue_waits.extend(started - enqueued_at for _, _, enqueued_at in batch)
+        self.forward_seconds.append(finished - started)
+
+    def stats(self):
+        # totals since start; distributions over the last stats_window batches/requests
+        def ms(values, percentile):
+            return round(float(np.percentile(values, percentile)) * 1000, 2) if values else 0.0
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "requests": self.requests,
+            "inputs": self.inputs,
+            "batches": self.batches,
+            "mean_batch_size": round(self.inputs / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "recent_mean_batch_size": round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else 0.0,
+            "queue_wait_ms_p50": ms(self.queue_waits, 50),
+            "queue_wait_ms_p95": ms(self.queue_waits, 95),
+            "forward_ms_p50": ms(self.forward_seconds, 50),
+            "forward_ms_p95": ms(self.forward_seconds, 95),
+            "pending_requests": len(self.pending),
+        }
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global model, processor
     
     try:
-        model_id = "vidore/colpali-v1.2"
+        model_id = MODEL_ID
         device = "cuda:0"
         dtype = torch.float16
         
@@ -30,12 +194,16 @@ async def lifespan(app: FastAPI):
         ).eval()
 
         processor = ColPaliProcessor.from_pretrained(model_id)
+        query_batcher.start()
+        image_batcher.start()
         yield
         
     except Exception as e:
         raise RuntimeError(f"Error loading model or processor: {str(e)}")
     
     finally:
+        await query_batcher.stop()
+        await image_batcher.stop()
         if model:
             del model
         if processor:
@@ -51,8 +219,63 @@ class EmbeddingResponse(BaseModel):
     image_embeddings: Optional[List[List[List[float]]]] = None
     query_embeddings: Optional[List[List[List[float]]]] = None
 
+def embed_images(images):
+    # returns the embeddings and the attention mask MicroBatcher uses to split the batch
+    batch_images = processor.process_images(images).to(model.device)
+    with torch.no_grad():
+        return model(**batch_images).cpu(), batch_images["attention_mask"].cpu()
+
+def embed_queries(queries):
+    with torch.no_grad():
+        batch_query = processor.process_queries(queries).to(
+            model.device
+        )
+        return model(**batch_query).cpu(), batch_query["attention_mask"].cpu()
+
+query_batcher = MicroBatcher("queries", embed_queries, QUERY_MAX_BATCH_SIZE, QUERY_MAX_WAIT_MS)
+image_batcher = MicroBatcher("images", embed_images, IMAGE_MAX_BATCH_SIZE, IMAGE_MAX_WAIT_MS)
+
+def build_embedding_response(image_embeddings, query_embeddings, accept=None, dtype=None):
+    """Return the embeddings as .npy arrays if the client accepts them, JSON otherwise.
+
+    In binary mode the body holds one .npy array per entry listed in the
+    X-Embedding-Arrays header, in that order.
+    """
+    if accept and NPY_MEDIA_TYPE in accept:
+        torch_dtype = NPY_DTYPES.get(dtype or "float16")
+        if torch_dtype is None:
+            raise HTTPException(status_code=400, detail=f"Unsupported embedding dtype: {dtype}")
+
+        buffer = io.BytesIO()
+        names = []
+        for name, embeddings in (("image_embeddings", image_embeddings), ("query_embeddings", query_embeddings)):
+            if embeddings is None:
+                continue
+            np.save(buffer, embeddings.to(torch_dtype).numpy(), allow_pickle=False)
+            names.append(name)
+
+        return Response(
+            content=buffer.getvalue(),
+            media_type=NPY_MEDIA_TYPE,
+            headers={"X-Embedding-Arrays": ",".join(names)},
+        )
+
+    return EmbeddingResponse(
+        image_embeddings=image_embeddings.float().numpy().tolist() if image_embeddings is not None else None,
+        query_embeddings=query_embeddings.float().numpy().tolist() if query_embeddings is not None else None,
+    )
+
+def decode_image_bytes(img_bytes):
+    img = Image.open(io.BytesIO(img_bytes))
+    # force the decode here, in the worker, rather than lazily inside the processor
+    return img.convert("RGB")
+
 @app.post("/embed", response_model=EmbeddingResponse)
-async def get_embeddings(request: EmbeddingRequest):
+async def get_embeddings(
+    request: EmbeddingRequest,
+    accept: Optional[str] = Header(None),
+    x_embedding_dtype: Optional[str] = Header(None),
+):
     try:
         image_embeddings = None
         query_embeddings = None
@@ -60,47 +283,82 @@ async def get_embeddings(request: EmbeddingRequest):
         # if request contains images
         if request.images:
             print("Images exists!")
-            images = []
-            for img_str in request.images:
-                img_bytes = base64.b64decode(img_str)
-                img = Image.open(io.BytesIO(img_bytes))
-                images.append(img)
+            try:
+                images = [decode_image_bytes(base64.b64decode(img_str)) for img_str in request.images]
+            except (ValueError, OSError) as e:
+                # undecodable input fails here, in its own request, not in a shared forward pass
+                raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
 
             print("Images decoded!")
             
-            batch_images = processor.process_images(images).to(model.device)
-            with torch.no_grad():
-                image_embeddings = model(**batch_images)
-                image_embeddings = image_embeddings.cpu().float().numpy().tolist()
+            image_embeddings = await image_batcher.submit(images)
 
             print("Created embeddings for images!")
 
         # if request contains queries
         if request.queries:
             print("Queries exists!")
-            with torch.no_grad():
-                batch_query = processor.process_queries(request.queries).to(
-                    model.device
-                )
-                query_embeddings = model(**batch_query)
-                query_embeddings = query_embeddings.cpu().float().numpy().tolist()
+            query_embeddings = await query_batcher.submit(request.queries)
 
-                print("Query embeddings created!!")
+            print("Query embeddings created!!")
 
-        if image_embeddings:
-            print(f"Image Embedding dimensions: {len(image_embeddings)}, {len(image_embeddings[0])}, {len(image_embeddings[0][0])}")
+        if image_embeddings is not None:
+            print(f"Image Embedding dimensions: {tuple(image_embeddings.shape)}")
 
-        if query_embeddings:
-            print(f"Query Embedding dimensions: {len(query_embeddings)}, {len(query_embeddings[0])}, {len(query_embeddings[0][0])}")
+        if query_embeddings is not None:
+            print(f"Query Embedding dimensions: {tuple(query_embeddings.shape)}")
         
-        return EmbeddingResponse(
-            image_embeddings=image_embeddings,
-            query_embeddings=query_embeddings
-        )
+        return build_embedding_response(image_embeddings, query_embeddings, accept, x_embedding_dtype)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/embed_images", response_model=EmbeddingResponse)
+async def get_image_embeddings_multipart(
+    images: List[UploadFile] = File(...),
+    accept: Optional[str] = Header(None),
+    x_embedding_dtype: Optional[str] = Header(None),
+):
+    # raw image bytes as multipart parts: no base64 overhead, decoded in parallel
+    try:
+        loop = asyncio.get_running_loop()
+        decode_tasks = []
+        for upload in images:
+            img_bytes = await upload.read()
+            decode_tasks.append(loop.run_in_executor(decode_executor, decode_image_bytes, img_bytes))
+        try:
+            decoded_images = await asyncio.gather(*decode_tasks)
+        except (ValueError, OSError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+
+        print(f"{len(decoded_images)} images decoded!")
+        image_embeddings = await image_batcher.submit(list(decoded_images))
+        print(f"Image Embedding dimensions: {tuple(image_embeddings.shape)}")
+
+        return build_embedding_response(image_embeddings, None, accept, x_embedding_dtype)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/processor_config")
+async def get_processor_config():
+    # lets clients downscale pages to the model input resolution before uploading
+    size = getattr(processor.image_processor, "size", None) or {}
+    return {
+        "model_id": MODEL_ID,
+        "image_size": {"height": size.get("height"), "width": size.get("width")},
+        "resample": "bicubic",
+    }
+
+@app.get("/batching_stats")
+async def get_batching_stats():
+    # how well concurrent requests are being merged into shared forward passes
+    return {"queries": query_batcher.stats(), "images": image_batcher.stats()}
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
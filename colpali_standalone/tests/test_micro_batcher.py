@@ -0,0 +1,65 @@
+"""MicroBatcher splitting and failure isolation, with a fake forward pass instead of the model."""
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("colpali_engine")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from colpali_embedding_host_server_script import MicroBatcher  # noqa: E402
+
+DIM = 4
+
+
+def fake_forward(calls):
+    # input n embeds as n + 1 real tokens of value n, padded to the longest input in the pass
+    def forward(inputs):
+        calls.append(list(inputs))
+        if "bad" in inputs:
+            raise ValueError("cannot embed 'bad'")
+        tokens = max(inputs) + 1
+        embeddings = torch.zeros(len(inputs), tokens, DIM)
+        attention_mask = torch.zeros(len(inputs), tokens, dtype=torch.long)
+        for row, value in enumerate(inputs):
+            embeddings[row, : value + 1] = value
+            attention_mask[row, : value + 1] = 1
+        return embeddings, attention_mask
+
+    return forward
+
+
+async def submit_all(batcher, requests):
+    batcher.start()
+    try:
+        return await asyncio.gather(*(batcher.submit(inputs) for inputs in requests), return_exceptions=True)
+    finally:
+        await batcher.stop()
+
+
+def test_concurrent_requests_share_a_pass_and_get_their_own_rows():
+    calls = []
+    batcher = MicroBatcher("test", fake_forward(calls), max_batch_size=8, max_wait_ms=50)
+
+    first, second = asyncio.run(submit_all(batcher, [[0, 1], [3]]))
+
+    assert calls == [[0, 1, 3]]
+    # each request gets what it would get alone: no columns that are padding for all its rows
+    assert first.shape == (2, 2, DIM) and second.shape == (1, 4, DIM)
+    assert torch.all(second == 3)
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["requests"] == 2
+
+
+def test_a_failing_input_only_fails_its_own_request():
+    calls = []
+    batcher = MicroBatcher("test", fake_forward(calls), max_batch_size=8, max_wait_ms=50)
+
+    good, bad, other = asyncio.run(submit_all(batcher, [[1], ["bad"], [2]]))
+
+    assert isinstance(bad, ValueError)
+    assert good.shape == (1, 2, DIM) and other.shape == (1, 3, DIM)
+    # the shared pass failed, then each request was rerun alone
+    assert calls == [[1, "bad", 2], [1], ["bad"], [2]]
@@ -8,6 +8,7 @@ from streamlit_lottie import st_lottie
 from concurrent.futures import ThreadPoolExecutor
 from anthropic_client   import AnthropicClient
 import os
+import time
 from pathlib import Path
 
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", '')
@@ -25,6 +26,9 @@ init_db()
 # Backend API URL
 BACKEND_URL = "http://backend:8000"
 
+# seconds between ingestion job status polls
+JOB_POLL_INTERVAL = 2
+
 def load_lottiefile(filepath: str):
     with open(filepath, "r") as file:
         return json.load(file)
@@ -195,20 +199,83 @@ def document_upload_page():
         help="Supported formats: ZIP (containing images), PNG, JPG, JPEG"
     )
     
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        isbn = st.text_input("ISBN (optional)")
+    with col2:
+        subject = st.text_input("Subject (optional)")
+    with col3:
+        document_id = st.text_input(
+            "Document ID (optional)",
+            help="Uploads with the same document ID replace its earlier version; defaults to ISBN/file name"
+        )
+    
     if uploaded_file is not None:
         if st.button("Process and Index Document"):
-            with st.spinner("Processing and indexing document..."):
+            with st.spinner("Uploading document..."):
                 try:
                     files = {"file": uploaded_file}
-                    response = requests.post(f"{BACKEND_URL}/document_embed", files=files)
+                    data = {key: value for key, value in {"isbn": isbn, "subject": subject, "document_id": document_id}.items() if value}
+                    response = requests.post(f"{BACKEND_URL}/document_embed", files=files, data=data)
                     
                     if response.status_code == 200:
-                        st.success("Document successfully processed and indexed!")
+                        st.session_state['ingestion_job_id'] = response.json()['job_id']
                     else:
                         st.error(f"Error: {response.json()['detail']}")
                 except Exception as e:
                     st.error(f"An error occurred: {str(e)}")
 
+    if st.session_state.get('ingestion_job_id'):
+        show_ingestion_job_progress(st.session_state['ingestion_job_id'])
+
+
+# Poll the backend ingestion job until it finishes
+def show_ingestion_job_progress(job_id):
+    st.write(f"Ingestion job: `{job_id}`")
+    progress_bar = st.progress(0.0)
+    status_text = st.empty()
+
+    while True:
+        try:
+            response = requests.get(f"{BACKEND_URL}/document_embed/{job_id}")
+            if response.status_code != 200:
+                st.error(f"Error: {response.json()['detail']}")
+                break
+            job = response.json()
+        except Exception as e:
+            st.error(f"An error occurred: {str(e)}")
+            break
+
+        pages_total = job.get('pages_total') or 0
+        pages_done = job.get('pages_done', 0)
+        if pages_total:
+            progress_bar.progress(min(pages_done / pages_total, 1.0))
+        status_text.write(
+            f"Status: {job['status']} | Pages: {pages_done}/{pages_total or '?'} | "
+            f"{job.get('pages_per_second', 0)} pages/s | Failed batches: {len(job.get('failed_batches', []))}"
+        )
+
+        if job['status'] == 'completed':
+            st.success("Document successfully processed and indexed!")
+            break
+        if job['status'] == 'completed_with_errors':
+            st.warning("Document indexed, but some batches failed:")
+            for batch in job['failed_batches']:
+                st.write(f"- {batch['stage']}: {', '.join(batch['pages'])} ({batch['error']})")
+            if st.button("Retry failed batches"):
+                requests.post(f"{BACKEND_URL}/document_embed/{job_id}/resume")
+                st.rerun()
+            break
+        if job['status'] == 'failed':
+            st.error(f"Error embedding document: {job.get('error')}")
+            # pages indexed before the failure are kept; the resumed job continues after them
+            if st.button("Resume ingestion"):
+                requests.post(f"{BACKEND_URL}/document_embed/{job_id}/resume")
+                st.rerun()
+            break
+
+        time.sleep(JOB_POLL_INTERVAL)
+
 
 
 def display_search_results(results, query):
@@ -303,14 +370,45 @@ def image_search_page():
     st.write("AI-powered image search for text queries and Answer generation")
     
     query = st.text_input("Enter your search query")
+    with st.expander("Filters"):
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            isbn_filter = st.text_input("ISBN")
+        with col2:
+            subject_filter = st.text_input("Subject")
+        with col3:
+            page_range = st.text_input("Pages (e.g. 10-40)")
+        with col4:
+            top_k = st.number_input("Results", min_value=1, max_value=100, value=3)
+        mode = st.radio(
+            "Search mode",
+            ["dense", "hybrid", "sparse", "sparse_prefilter"],
+            horizontal=True,
+            help="dense: ColPali only; hybrid: ColPali and page text fused; sparse: page text only; "
+                 "sparse_prefilter: text matches reranked by ColPali"
+        )
+        collections = st.text_input(
+            "Collections",
+            help="comma-separated collections or aliases to search together; empty searches the default collection"
+        )
     
     if st.button("Search"):
         if query:
             with st.spinner("Searching..."):
                 try:
+                    filters = {}
+                    if isbn_filter:
+                        filters["ISBN"] = isbn_filter
+                    if subject_filter:
+                        filters["subject"] = subject_filter
+                    if page_range:
+                        first_page, _, last_page = page_range.partition("-")
+                        filters["page_number"] = {"gte": int(first_page), "lte": int(last_page or first_page)}
+                    collection_names = [name.strip() for name in collections.split(",") if name.strip()]
                     response = requests.post(
                         f"{BACKEND_URL}/document_retrieval",
-                        json={"user_query": query}
+                        json={"user_query": query, "top_k": top_k, "filters": filters or None, "mode": mode,
+                              "collections": collection_names or None}
                     )
                     
                     if response.status_code == 200:
@@ -392,6 +490,35 @@ def qdrant_collections_page():
         vector_size = st.number_input("Vector Size", min_value=1, value=768)
     with col3:
         indexing_threshold = st.number_input("Indexing Threshold", min_value=1, value=20000)
+    pooled_vectors = st.checkbox(
+        "Pooled prefetch vectors",
+        value=True,
+        help="Also store mean-pooled row/column vectors for fast candidate search, reranked with the full multivector"
+    )
+    pool_factor = st.number_input(
+        "Token Pool Factor",
+        min_value=1,
+        value=1,
+        help="Merge similar patch embeddings so each page keeps about 1/N of its vectors (1 = no pooling)"
+    )
+    col4, col5, col6 = st.columns(3)
+    with col4:
+        quantization = st.selectbox("Quantization", ["scalar", "binary", "product", "none"])
+    with col5:
+        oversampling = st.number_input(
+            "Oversampling",
+            min_value=1.0,
+            value={"scalar": 1.0, "binary": 3.0, "product": 2.0}.get(quantization, 1.0),
+            help="Candidates fetched with quantized vectors, as a multiple of top-k, before rescoring"
+        )
+    with col6:
+        rescore = st.checkbox("Rescore with original vectors", value=True)
+        on_disk = st.checkbox("Original vectors on disk (mmap)", value=False)
+    text_index = st.checkbox(
+        "Text index",
+        value=True,
+        help="Store a sparse vector of each page's text (PDF text layer) for hybrid and text search"
+    )
     
     if st.button("Create Collection"):
         try:
@@ -400,7 +527,14 @@ def qdrant_collections_page():
                 json={
                     "collection_name": collection_name,
                     "vector_size": vector_size,
-                    "indexing_threshold": indexing_threshold
+                    "indexing_threshold": indexing_threshold,
+                    "pooled_vectors": pooled_vectors,
+                    "pool_factor": pool_factor,
+                    "quantization": quantization,
+                    "on_disk": on_disk,
+                    "oversampling": oversampling,
+                    "rescore": rescore,
+                    "text_index": text_index
                 }
             )
             if response.status_code == 200: